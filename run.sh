@@ -11,32 +11,30 @@ if [[ ! -d $ACTIVE_QUEUE_DIR ]]; then
   exit 1
 fi
 
-if [[ -d $OUTPUTS_DIR ]]; then
-  rm -r $OUTPUTS_DIR
-fi
-mkdir $OUTPUTS_DIR
+mkdir -p $OUTPUTS_DIR
 
-function cleanup() {
+# A finished run is kept under its start time, an unfinished one is resumed, not deleted
+RESUME=""
+if [[ -d $CURRENT_OUTPUT_DIR && ! -f $CURRENT_OUTPUT_DIR/.success ]]; then
+  echo "Resuming the unfinished run in $CURRENT_OUTPUT_DIR ..."
+  RESUME="--resume"
+else
   if [[ -d $CURRENT_OUTPUT_DIR ]]; then
-    if [[ -f $CURRENT_OUTPUT_DIR/.success ]]; then
-      mv $CURRENT_OUTPUT_DIR $OUTPUTS_DIR/$(cat $CURRENT_OUTPUT_DIR/.run_at)
-    else
-      rm -r $CURRENT_OUTPUT_DIR
-    fi
+    mv $CURRENT_OUTPUT_DIR $OUTPUTS_DIR/$(cat $CURRENT_OUTPUT_DIR/.run_at)
   fi
-
   mkdir $CURRENT_OUTPUT_DIR
   date +%F_%H:%M:%S >$CURRENT_OUTPUT_DIR/.run_at
-}
+fi
 
-for env_file in "$ACTIVE_QUEUE_DIR"/*.conf; do
-  cp $env_file .env
-  cleanup && cp .env $CURRENT_OUTPUT_DIR/.conf && python ./src/main.py
-  rm .env
-done
+# All the queued configurations (and their sweeps) run on one process pool, each is
+# stored under its own NAME (or the name of its file) in the current output directory
+cat "$ACTIVE_QUEUE_DIR"/*.conf >$CURRENT_OUTPUT_DIR/.conf
+python ./src/main.py --env "$ACTIVE_QUEUE_DIR"/*.conf $RESUME
+status=$?
 
-if [[ $? -eq 0 ]]; then
+if [[ $status -eq 0 ]]; then
   mkdir -p $QUEUES_DIR/$RUN_AT
   cp -r $ACTIVE_QUEUE_DIR $QUEUES_DIR/$RUN_AT/configs
-  cp -r $OUTPUTS_DIR $QUEUES_DIR/$RUN_AT/
+  mkdir -p $QUEUES_DIR/$RUN_AT/outputs
+  cp -r $CURRENT_OUTPUT_DIR $QUEUES_DIR/$RUN_AT/outputs/
 fi
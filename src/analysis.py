@@ -0,0 +1,218 @@
+"""
+Loading and summarizing the results of a run.
+
+    from analysis import load_run, acceptance_rate_by_reservation_time
+
+    trips, routes, env, ran_at = load_run("../outputs/current")
+    acceptance_rate_by_reservation_time(trips)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from store import read_committed
+
+TRIPS_CATEGORIES = {
+    "direction": ["INBOUND", "OUTBOUND"],
+    "reservation_status": ["PENDING", "ACCEPTED", "REJECTED"],
+}
+
+
+class RunResults(NamedTuple):
+    trips: pd.DataFrame
+    routes: pd.DataFrame
+    env: str
+    ran_at: str
+
+
+def load_run(run_path: str | Path) -> RunResults:
+    """
+    Loads the trips and routes of every configuration stored in a run directory.
+
+    Runs stored as Parquet (OUTPUT_DIR/results) are read in one pass per table, runs from
+    before the result store (a `data` directory of trips.csv and results.txt per
+    simulation) are read in parallel.
+    """
+
+    run_path = Path(run_path)
+    if (run_path / "results").is_dir():
+        trips = load_table(run_path, "trips")
+        routes = load_table(run_path, "routes")
+    else:
+        trips, routes = load_legacy_data(run_path / "data")
+
+    return RunResults(
+        trips=typed_trips(trips),
+        routes=routes,
+        env=read_text(run_path / ".conf", strip_comments=True),
+        ran_at=read_text(run_path / ".run_at").strip(),
+    )
+
+
+def load_table(run_path: Path, table_name: str) -> pd.DataFrame:
+    """Reads one table of all the configurations, with the configuration name as `config`"""
+
+    tables = []
+    for directory in sorted((run_path / "results").iterdir()):
+        # Only the chunks committed to the manifest, a crashed writer may leave others
+        table = read_committed(directory, table_name)
+        name = directory.name.removeprefix("config=")
+        tables.append(table.append_column("config", pa.array([name] * len(table))))
+
+    frame = pa.concat_tables(tables).to_pandas()
+    frame["config"] = frame["config"].astype("category")
+    return frame
+
+
+def load_legacy_data(data_path: Path, max_workers: int = 32):
+    """Reads the per-simulation directories of older runs concurrently and concatenates once"""
+
+    directories = sorted(path for path in data_path.iterdir() if path.is_dir())
+    with ThreadPoolExecutor(max_workers) as executor:
+        loaded = [
+            item
+            for item in executor.map(read_legacy_simulation, directories)
+            if item is not None
+        ]
+
+    if not loaded:
+        return pd.DataFrame(), pd.DataFrame()
+
+    trips_frames, route_rows = zip(*loaded)
+    for simulation_index, frame in enumerate(trips_frames):
+        frame["simulation_index"] = simulation_index
+    routes = pd.DataFrame(route_rows)
+    routes.insert(0, "simulation_index", np.arange(len(routes)))
+
+    return pd.concat(trips_frames, ignore_index=True), routes
+
+
+def read_legacy_simulation(path: Path):
+    try:
+        trips = pd.read_csv(path / "trips.csv", skipinitialspace=True)
+    except (OSError, pd.errors.ParserError):
+        return None
+
+    trips = trips.rename(
+        columns={
+            "ID": "trip_id",
+            "DIRECTION": "direction",
+            "LOCATION_INDEX": "location_index",
+            "RESERVED_AT": "reserved_at",
+            "RESERVATION_STATUS": "reservation_status",
+        }
+    )
+
+    route = {
+        "scenario_name": path.name,
+        "route": None,
+        "route_time": np.nan,
+        "solver_time": np.nan,
+    }
+    # Parse the lines by their labels, not by their position
+    lines = read_text(path / "results.txt").splitlines()
+    for previous_line, line in zip([""] + lines, lines):
+        if previous_line.startswith("Route for Shuttle"):
+            route["route"] = [int(point) for point in line.split("->")]
+        elif line.startswith("Route time:"):
+            route["route_time"] = float(line.split()[2])
+        elif line.startswith("Elapsed time:"):
+            route["solver_time"] = float(line.split()[2])
+
+    return trips, route
+
+
+def read_text(path: Path, strip_comments: bool = False) -> str:
+    if not path.exists():
+        return ""
+    with open(path, "r") as f:
+        lines = f.readlines()
+    if strip_comments:
+        lines = [line.split("#")[0] for line in lines]
+    return "".join(lines)
+
+
+def typed_trips(trips: pd.DataFrame) -> pd.DataFrame:
+    for column, categories in TRIPS_CATEGORIES.items():
+        if column in trips:
+            trips[column] = pd.Categorical(
+                trips[column].astype(str), categories=categories
+            )
+    return trips
+
+
+def group_keys(frame: pd.DataFrame) -> list:
+    return ["config"] if "config" in frame else []
+
+
+def acceptance_rate_by_reservation_time(
+    trips: pd.DataFrame, bin_width: int = 10
+) -> pd.DataFrame:
+    """Number of trips, accepted trips and acceptance rate per reservation time bucket"""
+
+    # Riders carried over from a previous cycle have negative reservation times
+    first_edge = min(0, trips["reserved_at"].min() // bin_width * bin_width)
+    edges = np.arange(first_edge, trips["reserved_at"].max() + bin_width + 1, bin_width)
+    buckets = pd.cut(trips["reserved_at"], edges, right=False)
+    accepted = trips["reservation_status"] == "ACCEPTED"
+
+    summary = (
+        accepted.groupby(
+            [trips[key] for key in group_keys(trips)] + [buckets], observed=True
+        )
+        .agg(trips="size", accepted="sum")
+        .rename_axis(group_keys(trips) + ["reserved_at"])
+    )
+    summary["acceptance_rate"] = summary["accepted"] / summary["trips"]
+    return summary
+
+
+def acceptance_rate(trips: pd.DataFrame) -> pd.Series | float:
+    accepted = trips["reservation_status"] == "ACCEPTED"
+    keys = group_keys(trips)
+    if not keys:
+        return accepted.mean()
+    return accepted.groupby([trips[key] for key in keys], observed=True).mean()
+
+
+def route_time_stats(routes: pd.DataFrame) -> pd.DataFrame:
+    """Count, mean, variance and standard deviation of the route times (minutes)"""
+
+    route_times = routes["route_time"]
+    keys = group_keys(routes)
+    grouped = (
+        route_times.groupby([routes[key] for key in keys], observed=True)
+        if keys
+        else route_times
+    )
+    stats = grouped.agg(["count", "mean", "var", "std"])
+    return stats.to_frame().T if not keys else stats
+
+
+def solver_time_distribution(
+    routes: pd.DataFrame, quantiles: Sequence[float] = (0.5, 0.9, 0.99)
+) -> pd.DataFrame:
+    """Mean, maximum and quantiles of the solver time (seconds)"""
+
+    solver_times = routes["solver_time"]
+    keys = group_keys(routes)
+    grouped = (
+        solver_times.groupby([routes[key] for key in keys], observed=True)
+        if keys
+        else solver_times
+    )
+
+    stats = grouped.agg(["count", "mean", "max"])
+    quantile_values = grouped.quantile(list(quantiles))
+    if keys:
+        stats = stats.join(quantile_values.unstack().add_prefix("p"))
+    else:
+        stats = stats.to_frame().T
+        for quantile, value in quantile_values.items():
+            stats[f"p{quantile}"] = value
+    return stats
@@ -0,0 +1,484 @@
+"""
+Benchmarks for the hot paths of the simulation.
+
+Usage:
+    python ./src/benchmark.py routing [--zones 10] [--trips 10 25 50] [--time-limit 2]
+    python ./src/benchmark.py suite [--scenarios Zero One] [--zones 10 20] [--lambdas 0.1 0.2]
+        [--save BASELINE] [--compare BASELINE]
+    python ./src/benchmark.py startup [--workers 4] [--target 0.5]
+
+The suite runs every scenario over the grid sizes and demand densities with fixed seeds
+and a fixed solver budget (a number of solutions rather than seconds), one case per fresh
+process, and reports setup time, solve time, route time, acceptance rate and peak memory.
+`--save` writes the results as a baseline, `--compare` prints the change of every case
+against a baseline and exits with status 1 if any case got slower or worse.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, wait
+import json
+from math import floor
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from timeit import default_timer as timer
+from typing import Dict, List
+
+from dotenv import dotenv_values
+import numpy as np
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+from main import config_from_env
+from models import ServiceRegion
+from runner import SimulationTask, run_simulation, simulation_seed, worker_pool
+from scenarios.base import SECONDS_PER_MINUTE
+
+
+def sample_routing_matrix(
+    service_region: ServiceRegion, num_of_trips: int, seed: int
+) -> np.ndarray:
+    """Returns the integer distance matrix of the fixed stop and `num_of_trips` random stops"""
+
+    rng = np.random.default_rng(seed)
+    trip_stops = rng.choice(
+        service_region.none_fixed_stops_indices, num_of_trips, replace=False
+    )
+    locations = np.concatenate(([service_region.fixed_stop_index], trip_stops))
+    return service_region.distances(locations, locations).astype(int)
+
+
+def count_solutions(
+    distance_matrix: np.ndarray, max_distance: int, time_limit: int, transit: str
+) -> int:
+    """Solves the routing instance the same way the scenarios do and counts the solutions found"""
+
+    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+
+    if transit == "callback":
+
+        def distance_callback(from_index, to_index):
+            from_node = manager.IndexToNode(from_index)
+            to_node = manager.IndexToNode(to_index)
+            return distance_matrix[from_node][to_node]
+
+        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    else:
+        transit_callback_index = routing.RegisterTransitMatrix(distance_matrix.tolist())
+
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    routing.AddDimension(transit_callback_index, 0, max_distance, True, "Distance")
+    routing.GetDimensionOrDie("Distance").SetGlobalSpanCostCoefficient(50)
+    for node in range(1, len(distance_matrix)):
+        routing.AddDisjunction([manager.NodeToIndex(node)], 1000)
+
+    solutions = 0
+
+    def on_solution():
+        nonlocal solutions
+        solutions += 1
+
+    routing.AddAtSolutionCallback(on_solution)
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    )
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    )
+    search_parameters.time_limit.seconds = time_limit
+    routing.SolveWithParameters(search_parameters)
+
+    return solutions
+
+
+def benchmark_routing(args):
+    service_region = ServiceRegion(args.zones, args.zone_length, args.zone_width)
+    max_distance = floor(args.cutoff * SECONDS_PER_MINUTE * args.shuttle_speed)
+
+    print(f"{'TRIPS':>6} {'CALLBACK sol/s':>15} {'MATRIX sol/s':>13} {'SPEEDUP':>8}")
+    for num_of_trips in args.trips:
+        distance_matrix = sample_routing_matrix(service_region, num_of_trips, args.seed)
+        rates = [
+            count_solutions(distance_matrix, max_distance, args.time_limit, transit)
+            / args.time_limit
+            for transit in ("callback", "matrix")
+        ]
+        print(
+            f"{num_of_trips:>6} {rates[0]:>15.1f} {rates[1]:>13.1f} {rates[1] / max(rates[0], 1e-9):>7.2f}x"
+        )
+
+
+# Base configuration of the suite cases, see sample.conf
+SUITE_ENV = {
+    "SCENARIO": "Zero",
+    "SOLVER": "OrTools",
+    "PLANNING_HORIZON": "0.7",
+    "SHUTTLE_SPEED": "0.00556",
+    "RESERVATION_CUTOFF": "50",
+    "ZONE_LENGTH": "1",
+    "ZONE_WIDTH": "1",
+    "MIN_RESERVATION_TIME": "0",
+    "MAX_RESERVATION_TIME": "60",
+    # The budget is a number of solutions, so the results do not depend on the machine.
+    # The time limit only guards against a case that runs away
+    "SOLVER_STALL_RATIO": "0",
+    "SOLVER_TIME_LIMIT": "60",
+    "SOLVER_TIME_PER_TRIP": "0",
+    "SOLVER_MAX_TIME_LIMIT": "60",
+}
+
+# Phases counted as setup of a simulation, see instrumentation.PHASES
+SETUP_PHASES = ("region", "trips", "submatrix", "model")
+
+# Metrics compared against a baseline: higher is worse for times, memory and the route
+# time, lower is worse for the acceptance rate
+TIME_METRICS = ("setup_time", "solve_time", "simulation_time")
+MEMORY_METRICS = ("peak_rss",)
+QUALITY_METRICS = ("acceptance_rate",)
+ROUTE_METRICS = ("route_time",)
+# Times of a few milliseconds are noisy, smaller slowdowns are never regressions
+MIN_TIME_CHANGE = 0.002
+
+
+def run_case(case: Dict) -> Dict:
+    """Runs the simulations of a suite case, in a process of its own"""
+
+    with TemporaryDirectory() as output_dir:
+        config = config_from_env(
+            {
+                **case["env"],
+                "SCENARIO": case["scenario"],
+                "NUMBER_OF_ZONES_PER_ROW": str(case["zones"]),
+                "LAMBDA_PARAM": str(case["lambda"]),
+                "NUM_OF_SIMULATIONS": str(case["simulations"]),
+                "OUTPUT_DIR": output_dir,
+            }
+        )
+
+        results, metrics = [], []
+        for index in range(config.number_of_simulations):
+            seed = simulation_seed(case["seed"], index)
+            simulation_results = run_simulation(SimulationTask(config, index, seed))
+            for result in simulation_results:
+                if result.error:
+                    raise RuntimeError(result.error)
+            results.extend(simulation_results)
+            metrics.append(simulation_results[0].metrics)
+
+    phases = [m["phases"] for m in metrics]
+    route_times = [r.route_time for r in results if r.route_time is not None]
+    return {
+        **{key: case[key] for key in ("scenario", "zones", "lambda")},
+        "num_of_trips": float(np.mean([r.num_of_trips for r in results])),
+        "setup_time": float(
+            np.mean([sum(p.get(name, 0.0) for name in SETUP_PHASES) for p in phases])
+        ),
+        "solve_time": float(np.mean([p.get("solve", 0.0) for p in phases])),
+        "simulation_time": float(np.mean([m["total"] for m in metrics])),
+        "route_time": float(np.mean(route_times)) if route_times else None,
+        "acceptance_rate": sum(r.num_of_accepted for r in results)
+        / max(sum(r.num_of_trips for r in results), 1),
+        "peak_rss": max(m["peak_rss"] for m in metrics),
+    }
+
+
+def case_key(case: Dict) -> tuple:
+    return (case["scenario"], case["zones"], case["lambda"])
+
+
+def compare_cases(
+    case: Dict,
+    baseline: Dict,
+    time_tolerance: float,
+    quality_tolerance: float,
+    route_tolerance: float,
+) -> List[str]:
+    """
+    Returns the regressions of a case against its baseline. A case without a route time
+    (no cycle solved) regresses when its baseline had one.
+    """
+
+    regressions = []
+    for metric in TIME_METRICS:
+        if case[metric] > baseline[metric] * (1 + time_tolerance) and (
+            case[metric] - baseline[metric] > MIN_TIME_CHANGE
+        ):
+            regressions.append(metric)
+    for metric in MEMORY_METRICS:
+        if case[metric] > baseline[metric] * (1 + time_tolerance):
+            regressions.append(metric)
+    for metric in QUALITY_METRICS:
+        if case[metric] < baseline[metric] - quality_tolerance:
+            regressions.append(metric)
+    for metric in ROUTE_METRICS:
+        if baseline.get(metric) is None:
+            continue
+        if case[metric] is None or case[metric] > baseline[metric] * (
+            1 + route_tolerance
+        ):
+            regressions.append(metric)
+    return regressions
+
+
+def print_cases(cases: List[Dict], baseline: Dict[tuple, Dict] = None):
+    def change(metric, case):
+        base = (baseline or {}).get(case_key(case))
+        if base is None or base.get(metric) is None or case[metric] is None:
+            return ""
+        if metric in QUALITY_METRICS:
+            return f" ({case[metric] - base[metric]:+.3f})"
+        return f" ({case[metric] / max(base[metric], 1e-9) - 1:+.0%})"
+
+    print(
+        f"{'SCENARIO':<15} {'ZONES':>5} {'LAMBDA':>6} {'TRIPS':>6} {'SETUP ms':>15}"
+        f" {'SOLVE ms':>15} {'ROUTE min':>15} {'ACCEPTED':>15} {'RSS MiB':>13}"
+    )
+    for case in cases:
+        route_time = (
+            f"{case['route_time']:.1f}" if case["route_time"] is not None else "-"
+        )
+        print(
+            f"{case['scenario']:<15} {case['zones']:>5} {case['lambda']:>6g}"
+            f" {case['num_of_trips']:>6.0f}"
+            f" {case['setup_time'] * 1000:>7.1f}{change('setup_time', case):<8}"
+            f" {case['solve_time'] * 1000:>7.1f}{change('solve_time', case):<8}"
+            f" {route_time:>7}{change('route_time', case):<8}"
+            f" {case['acceptance_rate']:>7.3f}{change('acceptance_rate', case):<8}"
+            f" {case['peak_rss'] / 2**20:>5.0f}{change('peak_rss', case):<8}"
+        )
+
+
+def benchmark_suite(args):
+    env = dict(SUITE_ENV)
+    if args.env:
+        env.update(dotenv_values(args.env.as_posix()))
+    if args.solver:
+        env["SOLVER"] = args.solver
+    env["SOLVER_SOLUTION_LIMIT"] = str(args.solution_limit)
+    settings = {
+        "simulations": args.simulations,
+        "seed": args.seed,
+        "env": env,
+    }
+
+    cases = [
+        {
+            "scenario": scenario,
+            "zones": zones,
+            "lambda": lambda_param,
+            "simulations": args.simulations,
+            "seed": args.seed,
+            "env": env,
+        }
+        for scenario in args.scenarios
+        for zones in args.zones
+        for lambda_param in args.lambdas
+    ]
+
+    # A fresh process per case, so that its region build and peak memory are its own
+    with ProcessPoolExecutor(1, max_tasks_per_child=1) as executor:
+        results = list(executor.map(run_case, cases))
+
+    baseline = None
+    if args.compare:
+        saved = json.loads(args.compare.read_text())
+        differences = [
+            key
+            for key in settings.keys() | saved["settings"].keys()
+            if settings.get(key) != saved["settings"].get(key)
+        ]
+        if differences:
+            print(
+                f"Warning: {args.compare} was run with other {', '.join(sorted(differences))}, "
+                "the results are not comparable"
+            )
+        baseline = {case_key(case): case for case in saved["cases"]}
+
+    print_cases(results, baseline)
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(
+            json.dumps(
+                {
+                    "settings": settings,
+                    "machine": {
+                        "python": platform.python_version(),
+                        "processor": platform.processor() or platform.machine(),
+                    },
+                    "cases": results,
+                },
+                indent=2,
+            )
+        )
+        print(f"Baseline saved to {args.save}.")
+
+    if baseline:
+        regressions = {
+            case_key(case): compare_cases(
+                case,
+                baseline[case_key(case)],
+                args.time_tolerance,
+                args.quality_tolerance,
+                args.route_tolerance,
+            )
+            for case in results
+            if case_key(case) in baseline
+        }
+        regressions = {key: found for key, found in regressions.items() if found}
+        for (scenario, zones, lambda_param), found in regressions.items():
+            print(
+                f"Regression in {scenario}, {zones} zones, lambda {lambda_param:g}: {', '.join(found)}"
+            )
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+
+def startup_config(output_dir: str):
+    return config_from_env(
+        {
+            **SUITE_ENV,
+            "NUMBER_OF_ZONES_PER_ROW": "10",
+            "LAMBDA_PARAM": "0.1",
+            "SOLVER_SOLUTION_LIMIT": "100",
+            "NUM_OF_SIMULATIONS": "1",
+            "OUTPUT_DIR": output_dir,
+        }
+    )
+
+
+def benchmark_startup(args):
+    """
+    Times a fresh interpreter importing main, and a worker pool from its creation until
+    every worker is ready and until the first simulation result
+    """
+
+    import_times = []
+    for _ in range(args.repeats):
+        starting_time = timer()
+        subprocess.run(
+            [sys.executable, "-c", "import main"],
+            cwd=Path(__file__).parent,
+            check=True,
+            stderr=subprocess.DEVNULL,
+        )
+        import_times.append(timer() - starting_time)
+    import_time = float(np.median(import_times))
+
+    with TemporaryDirectory() as output_dir:
+        config = startup_config(output_dir)
+        ServiceRegion.prepare(config)
+
+        starting_time = timer()
+        with worker_pool(args.workers, [config]) as executor:
+            # A task per worker, each one only starts once its worker is initialized
+            wait([executor.submit(os.getpid) for _ in range(args.workers)])
+            ready_time = timer() - starting_time
+        starting_time = timer()
+        with worker_pool(args.workers, [config]) as executor:
+            executor.submit(
+                run_simulation, SimulationTask(config, 0, simulation_seed(0, 0))
+            ).result()
+            first_time = timer() - starting_time
+
+    print(
+        f"import main:            {import_time * 1000:>7.0f} ms (median of {args.repeats})"
+    )
+    print(f"pool of {args.workers} ready:        {ready_time * 1000:>7.0f} ms")
+    print(f"first simulation result: {first_time * 1000:>7.0f} ms")
+    if import_time > args.target:
+        print(f"Importing main takes longer than the {args.target}s target.")
+        sys.exit(1)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(required=True)
+
+    routing_parser = subparsers.add_parser(
+        "routing",
+        help="Solutions per second of the Python callback vs. the native matrix",
+    )
+    routing_parser.add_argument("--zones", type=int, default=10)
+    routing_parser.add_argument("--zone-length", type=float, default=1)
+    routing_parser.add_argument("--zone-width", type=float, default=1)
+    routing_parser.add_argument("--trips", type=int, nargs="+", default=[10, 25, 50])
+    routing_parser.add_argument("--cutoff", type=int, default=50)
+    routing_parser.add_argument("--shuttle-speed", type=float, default=0.00556)
+    routing_parser.add_argument("--time-limit", type=int, default=2)
+    routing_parser.add_argument("--seed", type=int, default=0)
+    routing_parser.set_defaults(run=benchmark_routing)
+
+    suite_parser = subparsers.add_parser(
+        "suite", help="Speed and quality of the scenarios over grid sizes and demands"
+    )
+    suite_parser.add_argument(
+        "--scenarios", nargs="+", default=["Zero", "One", "AllBelowCutoff"]
+    )
+    suite_parser.add_argument("--zones", type=int, nargs="+", default=[10, 20, 30])
+    suite_parser.add_argument(
+        "--lambdas", type=float, nargs="+", default=[0.05, 0.1, 0.2]
+    )
+    suite_parser.add_argument(
+        "--simulations", type=int, default=5, help="simulations per case"
+    )
+    suite_parser.add_argument("--seed", type=int, default=0, help="root seed")
+    suite_parser.add_argument(
+        "--solver", help="OrTools or Heuristic, overrides SOLVER of --env"
+    )
+    suite_parser.add_argument(
+        "--solution-limit",
+        type=int,
+        default=200,
+        help="solutions per solve, the fixed solver budget",
+    )
+    suite_parser.add_argument(
+        "--env", type=Path, help="configuration file overriding the base settings"
+    )
+    suite_parser.add_argument("--save", type=Path, help="save the results as baseline")
+    suite_parser.add_argument("--compare", type=Path, help="compare with a baseline")
+    suite_parser.add_argument(
+        "--time-tolerance",
+        type=float,
+        default=0.2,
+        help="relative slowdown (and memory growth) counted as a regression",
+    )
+    suite_parser.add_argument(
+        "--quality-tolerance",
+        type=float,
+        default=0.005,
+        help="drop of the acceptance rate counted as a regression",
+    )
+    suite_parser.add_argument(
+        "--route-tolerance",
+        type=float,
+        default=0.02,
+        help="relative growth of the mean route time counted as a regression",
+    )
+    suite_parser.set_defaults(run=benchmark_suite)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="Import time of main and start-up time of the worker pool"
+    )
+    startup_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    startup_parser.add_argument("--repeats", type=int, default=5)
+    startup_parser.add_argument(
+        "--target",
+        type=float,
+        default=0.5,
+        help="seconds importing main may take, exits with status 1 above it",
+    )
+    startup_parser.set_defaults(run=benchmark_startup)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
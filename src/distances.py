@@ -0,0 +1,96 @@
+"""
+Distances between the stops of a service region.
+
+A metric computes the distances between the stops it is asked for, so a simulation only
+pays for the (trips + 1)² entries of its routing problem instead of the region holding
+the distances of every pair of stops. Stops are the rows of `ServiceRegion.stops_grid`.
+
+- `euclidean`: straight-line distances between the stop coordinates.
+- `manhattan`: distances along the grid, the sum of the x and y offsets.
+- `table`: travel times in seconds between every pair of stops read from a file, turned
+  into distances at the shuttle speed. A `.npy` table is memory-mapped, other files are
+  read as CSV and converted to `.npy` once by `ServiceRegion.prepare`.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+DISTANCE_METRICS = ("euclidean", "manhattan", "table")
+
+
+class DistanceMetric:
+    name: str = None
+
+    def distances(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """The distances from the stops of `rows` to the stops of `columns`"""
+        raise NotImplementedError
+
+
+class EuclideanMetric(DistanceMetric):
+    name = "euclidean"
+
+    def __init__(self, stops: np.ndarray) -> None:
+        self.stops = stops
+
+    def distances(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        offsets = self.stops[rows][:, None, :] - self.stops[columns][None, :, :]
+        return np.sqrt((offsets**2).sum(axis=-1))
+
+
+class ManhattanMetric(DistanceMetric):
+    name = "manhattan"
+
+    def __init__(self, stops: np.ndarray) -> None:
+        self.stops = stops
+
+    def distances(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        offsets = self.stops[rows][:, None, :] - self.stops[columns][None, :, :]
+        return np.abs(offsets).sum(axis=-1)
+
+
+class TableMetric(DistanceMetric):
+    """Travel times in seconds between the stops, row i and column i are stop i"""
+
+    name = "table"
+
+    def __init__(self, travel_times: np.ndarray, shuttle_speed: float) -> None:
+        self.travel_times = travel_times
+        self.shuttle_speed = shuttle_speed
+
+    def distances(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        # Only the selected entries are read from the (possibly memory-mapped) table
+        return self.travel_times[np.ix_(rows, columns)] * self.shuttle_speed
+
+
+def load_travel_times(path: Path) -> np.ndarray:
+    """Reads a travel times table, a `.npy` file is memory-mapped read-only"""
+
+    if path.suffix == ".npy":
+        return np.load(path, mmap_mode="r")
+    return np.loadtxt(path, delimiter=",", ndmin=2)
+
+
+def make_metric(
+    name: str,
+    stops: np.ndarray,
+    travel_times: Optional[np.ndarray] = None,
+    shuttle_speed: float = 1.0,
+) -> DistanceMetric:
+    if name == "euclidean":
+        return EuclideanMetric(stops)
+    if name == "manhattan":
+        return ManhattanMetric(stops)
+    if name == "table":
+        if travel_times is None:
+            raise ValueError("The table distance metric needs a DISTANCE_TABLE")
+        if travel_times.shape != (len(stops), len(stops)):
+            raise ValueError(
+                f"DISTANCE_TABLE must be {len(stops)}x{len(stops)} for this region,"
+                f" got {'x'.join(map(str, travel_times.shape))}"
+            )
+        return TableMetric(travel_times, shuttle_speed)
+    raise ValueError(
+        f"Unknown distance metric {name}, expected one of {DISTANCE_METRICS}"
+    )
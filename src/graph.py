@@ -1,21 +1,41 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import batched
 from pathlib import Path
 import traceback
+from typing import List
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
 import pandas as pd
 import networkx as nx
 import matplotlib.pyplot as plt
+import pyarrow.compute as pc
+
+from models import RENDER_MODES, Config, ServiceRegion
+from store import read_committed, results_directory
+
+FIXED_STOP_COLOR, INBOUND_COLOR, OUTBOUND_COLOR = ("#8DB1E2", "#C4D6A0", "#FFC000")
+FIXED_STOP_SIZE, TRIPS_NODE_SIZE = (3000, 500)
+
+RENDER_BATCH_SIZE = 256
 
 
 def draw(nodes_df: pd.DataFrame, output_path: Path):
     try:
-        nodes_with_next_df =  nodes_df[nodes_df.notna().all(axis=1)]
+        nodes_with_next_df = nodes_df[nodes_df.notna().all(axis=1)]
         G = nx.DiGraph()
         edges = list(zip(nodes_with_next_df["NODES"], nodes_with_next_df["NEXT_NODES"]))
 
+        # The fixed stop has a row per route, every other node a single row
+        nodes_df = nodes_df.drop_duplicates("NODES")
         G.add_nodes_from(nodes_df["NODES"])
         G.add_edges_from(edges)
 
-        # Generate the spring layout
-        pos = nodes_df["POSITIONS"]
+        # Positions are looked up by node, not by row
+        pos = dict(zip(nodes_df["NODES"], nodes_df["POSITIONS"]))
         # pos = nx.spring_layout(G, k=0.1, pos=dict(zip(nodes_df["NODES"], pos)), iterations=1)
 
         options = {
@@ -28,15 +48,15 @@ def draw(nodes_df: pd.DataFrame, output_path: Path):
             "arrowsize": 20,
         }
 
-        plt.figure(figsize=[20, 10])
+        figure = plt.figure(figsize=[20, 10])
 
         nx.draw(
             G,
             pos,
             nodelist=nodes_df["NODES"].to_list(),
-            node_color=nodes_df["COLORS"],
+            node_color=nodes_df["COLORS"].to_list(),
             node_shape="o",
-            node_size=nodes_df["SIZES"],
+            node_size=nodes_df["SIZES"].to_list(),
             **options,
         )
 
@@ -47,16 +67,173 @@ def draw(nodes_df: pd.DataFrame, output_path: Path):
 
         # Save the plot
         image_output_path = output_path / "graph.png"
-        print(f"Saving the graph in {image_output_path.as_posix()}")
         plt.savefig(
             image_output_path,
             format="png",
             bbox_inches="tight",
             pad_inches=0.1,
         )
+        # Release the figure, workers render many graphs
+        plt.close(figure)
 
         gml_output_path = output_path / "graph.gml"
-        print(f"Saving the GML for graph in {gml_output_path}")
         nx.write_gml(G, gml_output_path)
     except Exception:
         traceback.print_exc()
+
+
+def build_nodes_df(
+    routes: List[List[int]], trips: pd.DataFrame, service_region: ServiceRegion
+) -> pd.DataFrame:
+    """
+    Builds the nodes of one simulation: every route through the fixed stop (labelled 0)
+    and the accepted trips, then the rejected trips without a next node. Trips are
+    labelled by their IDs.
+    """
+
+    trip_nodes = trips["node"].to_numpy(dtype=float, na_value=np.nan)
+    rejected = trips["reservation_status"].astype(str).to_numpy() == "REJECTED"
+    outbound = trips["direction"].astype(str).to_numpy() == "OUTBOUND"
+    positions = service_region.none_fixed_stops[trips["location_index"].to_numpy()]
+
+    # Row of the trips frame for each routing node
+    rows_by_node = np.full(len(trips) + 1, -1)
+    routed = ~np.isnan(trip_nodes)
+    rows_by_node[trip_nodes[routed].astype(int)] = np.flatnonzero(routed)
+
+    labels = trips["trip_id"].to_numpy()
+    fixed_stop = tuple(service_region.fixed_stop)
+
+    route_dfs = []
+    for route in routes if routes is not None else [[]]:
+        route = np.asarray(route, dtype=int)
+        route_rows = rows_by_node[route[1:-1]] if len(route) > 2 else np.empty(0, int)
+        route_labels = np.concatenate(([0], labels[route_rows]))
+
+        route_df = pd.DataFrame(
+            {
+                "NODES": route_labels,
+                "NEXT_NODES": pd.array(np.append(route_labels[1:], 0), dtype="Int64"),
+                "POSITIONS": [fixed_stop] + list(map(tuple, positions[route_rows])),
+                "COLORS": np.concatenate(
+                    (
+                        [FIXED_STOP_COLOR],
+                        np.where(outbound[route_rows], OUTBOUND_COLOR, INBOUND_COLOR),
+                    )
+                ),
+                "SIZES": [FIXED_STOP_SIZE] + [TRIPS_NODE_SIZE] * len(route_rows),
+            }
+        )
+        if len(route) <= 2:
+            route_df["NEXT_NODES"] = pd.NA
+        route_dfs.append(route_df)
+
+    rejected_df = pd.DataFrame(
+        {
+            "NODES": labels[rejected],
+            "NEXT_NODES": pd.array([pd.NA] * rejected.sum(), dtype="Int64"),
+            "POSITIONS": list(map(tuple, positions[rejected])),
+            "COLORS": np.where(outbound[rejected], OUTBOUND_COLOR, INBOUND_COLOR),
+            "SIZES": TRIPS_NODE_SIZE,
+        }
+    )
+
+    return pd.concat(route_dfs + [rejected_df], ignore_index=True)
+
+
+def failed(routes: pd.DataFrame) -> pd.Series:
+    """Whether the simulation of each row failed or found no route"""
+
+    return routes["error"].notna() | routes["route_time"].isna()
+
+
+def select_simulations(routes: pd.DataFrame, mode: str, every: int) -> pd.DataFrame:
+    """Returns the routes of the simulations to render"""
+
+    if mode == "all":
+        return routes
+    if mode == "every":
+        return routes[routes["simulation_index"] % every == 0]
+    if mode == "failures":
+        return routes[failed(routes)]
+    raise ValueError(f"Unknown render mode {mode}, expected one of {RENDER_MODES}")
+
+
+def render_simulation(task):
+    nodes_df, output_path = task
+    output_path.mkdir(parents=True, exist_ok=True)
+    draw(nodes_df, output_path)
+
+
+def render_run(config: Config) -> int:
+    """
+    Draws the graphs of the simulations selected by the config's render mode from the
+    stored results, into OUTPUT_DIR/data/<scenario name>/, with a `cycle_<n>` directory
+    per cycle when there are several. A failed simulation does not always know its cycle
+    or scenario, its graph goes to `failures/simulation_<index>_cycle_<n>/` instead.
+    Returns the number of graphs.
+    """
+
+    if config.render_mode == "none":
+        return 0
+
+    directory = results_directory(config.output_dir, config.name)
+    # Only the chunks committed to the manifest, a crashed writer may leave others
+    routes = read_committed(
+        directory,
+        "routes",
+        columns=[
+            "simulation_index",
+            "cycle",
+            "scenario_name",
+            "routes",
+            "route_time",
+            "error",
+        ],
+    ).to_pandas()
+    routes = select_simulations(routes, config.render_mode, config.render_every)
+    if routes.empty:
+        return 0
+
+    trips = read_committed(
+        directory,
+        "trips",
+        filter=pc.field("simulation_index").isin(routes["simulation_index"]),
+    ).to_pandas()
+    trips_by_cycle = dict(list(trips.groupby(["simulation_index", "cycle"])))
+    service_region = ServiceRegion.from_config(config)
+    routes = routes.assign(failed=failed(routes))
+
+    def tasks():
+        for (
+            simulation_index,
+            cycle,
+            scenario_name,
+            simulation_routes,
+            is_failed,
+        ) in routes[
+            ["simulation_index", "cycle", "scenario_name", "routes", "failed"]
+        ].itertuples(
+            index=False
+        ):
+            cycle_trips = trips_by_cycle.get((simulation_index, cycle), trips.iloc[:0])
+            output_path = config.output_dir / "data" / scenario_name
+            if is_failed:
+                output_path = (
+                    output_path
+                    / "failures"
+                    / f"simulation_{simulation_index}_cycle_{cycle}"
+                )
+            elif config.number_of_cycles > 1:
+                output_path = output_path / f"cycle_{cycle}"
+            yield (
+                build_nodes_df(simulation_routes, cycle_trips, service_region),
+                output_path,
+            )
+
+    # Submit in batches so that only a batch of node frames is held in memory
+    with ProcessPoolExecutor(config.num_of_workers) as executor:
+        for batch in batched(tasks(), RENDER_BATCH_SIZE):
+            list(executor.map(render_simulation, batch, chunksize=8))
+
+    return len(routes)
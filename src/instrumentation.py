@@ -0,0 +1,352 @@
+"""
+Per-phase timings and memory of the simulations.
+
+A worker opens a `record()` around every simulation. Code on the hot path wraps its phases
+in `phase(name)`, which adds their seconds to the open record, and the solvers report the
+phases they ran in `RoutingSolution.phase_times`. Events such as solution cache hits are
+counted with `count(name)`. Phases run on several threads (the
+subproblems of a fleet) add up their thread seconds. The resident memory of the worker is
+sampled after every phase, its peak is kept per process.
+
+The parent writes one JSON line per simulation to the config's `metrics/` directory, plus
+one per run with the time spent writing results and drawing graphs. `build_report` turns
+them into the run's performance report.
+
+With PROFILE_FRACTION, that fraction of the simulations (chosen by seed, so a replay
+profiles the same ones) runs under cProfile, with the stats saved to `profiles/`.
+"""
+
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import json
+import os
+from pathlib import Path
+import pstats
+import threading
+from timeit import default_timer as timer
+from typing import Dict, Iterator, List, Optional
+import uuid
+
+import numpy as np
+import psutil
+
+# Phases of a simulation, in the order they run
+PHASES = (
+    "region",
+    "trips",
+    "submatrix",
+    "cache",
+    "prefilter",
+    "model",
+    "solve",
+    "extract",
+)
+# Phases of the parent process
+RUN_PHASES = ("write", "render")
+
+METRICS_DIRECTORY = "metrics"
+PROFILES_DIRECTORY = "profiles"
+REPORT_FILE = "report.json"
+
+_lock = threading.Lock()
+_phase_times: Optional[Dict[str, float]] = None
+_counters: Optional[Dict[str, int]] = None
+_process: Optional[psutil.Process] = None
+_peak_rss = 0
+
+
+def sample_rss() -> int:
+    """Samples the resident memory of this process, returns its peak so far"""
+
+    global _process, _peak_rss
+    # A forked worker must not sample its parent
+    if _process is None or _process.pid != os.getpid():
+        _process, _peak_rss = psutil.Process(), 0
+    _peak_rss = max(_peak_rss, _process.memory_info().rss)
+    return _peak_rss
+
+
+def add_phase_time(name: str, seconds: float) -> None:
+    """Adds seconds to a phase of the open record, if any"""
+
+    with _lock:
+        if _phase_times is not None:
+            _phase_times[name] = _phase_times.get(name, 0.0) + seconds
+
+
+def add_phase_times(phase_times: Dict[str, float]) -> None:
+    for name, seconds in phase_times.items():
+        add_phase_time(name, seconds)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Adds n to a counter of the open record, if any"""
+
+    with _lock:
+        if _counters is not None:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Times the block as a phase of the open record, without a record it is not timed"""
+
+    if _phase_times is None:
+        yield
+        return
+
+    starting_time = timer()
+    try:
+        yield
+    finally:
+        add_phase_time(name, timer() - starting_time)
+        sample_rss()
+
+
+def timed(name: str):
+    """Decorator timing every call of the function as a phase"""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def record(profiler: Optional[cProfile.Profile] = None) -> Iterator[Dict]:
+    """
+    Records the phases of the block. The yielded metrics are filled in when the block
+    exits: phase seconds, counters, total seconds, worker pid, its peak RSS and whether it
+    was profiled.
+    """
+
+    global _phase_times, _counters
+    metrics = {}
+    _phase_times, _counters = {}, {}
+    starting_time = timer()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        metrics.update(
+            phases=_phase_times,
+            counters=_counters,
+            total=timer() - starting_time,
+            pid=os.getpid(),
+            peak_rss=sample_rss(),
+            profiled=profiler is not None,
+        )
+        _phase_times, _counters = None, None
+
+
+def is_profiled(seed: int, profile_fraction: float) -> bool:
+    """Whether the simulation of the seed is profiled, seeds are uniform over uint64"""
+
+    return profile_fraction > 0 and seed / 2**64 < profile_fraction
+
+
+def profile_path(directory: Path, simulation_index: int) -> Path:
+    return directory / PROFILES_DIRECTORY / f"simulation-{simulation_index}.prof"
+
+
+def save_profile(profiler: cProfile.Profile, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(path)
+
+
+class MetricsLog:
+    """Appends the metrics records of a run to `<directory>/metrics/<session>.jsonl`"""
+
+    def __init__(self, directory: Path) -> None:
+        (directory / METRICS_DIRECTORY).mkdir(parents=True, exist_ok=True)
+        self.path = directory / METRICS_DIRECTORY / f"{uuid.uuid4().hex[:12]}.jsonl"
+
+    def write(self, record: Dict) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def write_simulation(
+        self, simulation_index: int, seed: int, num_of_cycles: int, metrics: Dict
+    ) -> None:
+        self.write(
+            {
+                "type": "simulation",
+                "simulation_index": simulation_index,
+                "seed": seed,
+                "num_of_cycles": num_of_cycles,
+                **metrics,
+            }
+        )
+
+    def write_run(self, phase_times: Dict[str, float]) -> None:
+        self.write({"type": "run", "phases": phase_times})
+
+
+def read_metrics(directory: Path) -> List[Dict]:
+    records = []
+    for path in sorted((directory / METRICS_DIRECTORY).glob("*.jsonl")):
+        with open(path, "r") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def build_report(directory: Path, top: int = 15) -> Dict:
+    """
+    Aggregates the metrics of a config: per phase the total, mean and 95th percentile
+    seconds per simulation and share of the simulation time, the peak RSS of every worker
+    and, if any simulation was profiled, the functions with the most time of their own.
+    """
+
+    records = read_metrics(directory)
+    # A resumed run reruns the simulations of uncommitted chunks, keep their last record
+    simulations = list(
+        {
+            r["simulation_index"]: r for r in records if r["type"] == "simulation"
+        }.values()
+    )
+    runs = [r for r in records if r["type"] == "run"]
+
+    totals = np.array([r["total"] for r in simulations], dtype=float)
+    phases = {}
+    for name in PHASES:
+        seconds = np.array([r["phases"].get(name, 0.0) for r in simulations])
+        phases[name] = phase_summary(seconds, totals.sum())
+    # Time of a simulation outside of its phases, e.g. event dispatch decisions
+    other = totals - np.array(
+        [sum(r["phases"].get(name, 0.0) for name in PHASES) for r in simulations]
+    )
+    phases["other"] = phase_summary(other, totals.sum())
+
+    peak_rss = {}
+    for r in simulations:
+        peak_rss[r["pid"]] = max(peak_rss.get(r["pid"], 0), r["peak_rss"])
+
+    counters = {}
+    for r in simulations:
+        for name, n in r.get("counters", {}).items():
+            counters[name] = counters.get(name, 0) + n
+
+    profiles = sorted((directory / PROFILES_DIRECTORY).glob("*.prof"))
+    return {
+        "num_of_simulations": len(simulations),
+        "simulation_time": float(totals.sum()),
+        "phases": phases,
+        "counters": counters,
+        "cache_hit_rate": cache_hit_rate(counters),
+        "run_phases": {
+            name: float(sum(r["phases"].get(name, 0.0) for r in runs))
+            for name in RUN_PHASES
+        },
+        "peak_rss": {str(pid): rss for pid, rss in sorted(peak_rss.items())},
+        "max_peak_rss": max(peak_rss.values(), default=0),
+        "num_of_profiles": len(profiles),
+        "top_functions": top_functions(profiles, top) if profiles else [],
+    }
+
+
+def cache_hit_rate(counters: Dict[str, int]) -> Optional[float]:
+    """Share of the solution cache lookups that were hits, None without lookups"""
+
+    lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+    return counters.get("cache_hits", 0) / lookups if lookups else None
+
+
+def phase_summary(seconds: np.ndarray, simulation_time: float) -> Dict[str, float]:
+    if not len(seconds):
+        return {"total": 0.0, "mean": 0.0, "p95": 0.0, "share": 0.0}
+    return {
+        "total": float(seconds.sum()),
+        "mean": float(seconds.mean()),
+        "p95": float(np.percentile(seconds, 95)),
+        "share": float(seconds.sum() / simulation_time) if simulation_time else 0.0,
+    }
+
+
+def top_functions(profiles: List[Path], top: int) -> List[Dict]:
+    """The functions with the most time of their own over all the profiles"""
+
+    stats = pstats.Stats(*map(str, profiles))
+    rows = []
+    for (file, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append(
+            {
+                "function": f"{Path(file).name}:{line}({function})",
+                "calls": calls,
+                "own": own,
+                "cumulative": cumulative,
+            }
+        )
+    return sorted(rows, key=lambda row: row["own"], reverse=True)[:top]
+
+
+def write_report(directory: Path) -> Dict:
+    report = build_report(directory)
+    with open(directory / METRICS_DIRECTORY / REPORT_FILE, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"{report['num_of_simulations']} simulations, {report['simulation_time']:.2f}s in the workers:",
+        f"  {'phase':<10} {'total':>9} {'mean':>9} {'p95':>9} {'share':>6}",
+    ]
+    for name, summary in report["phases"].items():
+        lines.append(
+            f"  {name:<10} {summary['total']:>8.2f}s {summary['mean'] * 1000:>7.1f}ms"
+            f" {summary['p95'] * 1000:>7.1f}ms {summary['share']:>6.1%}"
+        )
+    lines.append(
+        "  "
+        + ", ".join(
+            f"{name} {seconds:.2f}s" for name, seconds in report["run_phases"].items()
+        )
+        + " in the parent"
+    )
+    lines.append(
+        f"  peak RSS {report['max_peak_rss'] / 2**20:.0f} MiB over {len(report['peak_rss'])} workers"
+    )
+    if report["cache_hit_rate"] is not None:
+        counters = report["counters"]
+        lines.append(
+            f"  solution cache: {counters.get('cache_hits', 0)} hits,"
+            f" {counters.get('cache_misses', 0)} misses ({report['cache_hit_rate']:.1%})"
+        )
+    if any(name.startswith("prefilter_") for name in report["counters"]):
+        counters = report["counters"]
+        lines.append(
+            f"  prefilter: {counters.get('prefilter_unreachable', 0)} unreachable trips dropped,"
+            f" searches skipped: {counters.get('prefilter_exact', 0)} by enumeration,"
+            f" {counters.get('prefilter_bounded', 0)} by bounds"
+        )
+    wins = {
+        name.split(":", 1)[1]: n
+        for name, n in report["counters"].items()
+        if name.startswith("portfolio_wins:")
+    }
+    if wins:
+        lines.append(
+            f"  portfolio: {report['counters'].get('portfolio_cancelled', 0)} searches cancelled, wins: "
+            + ", ".join(
+                f"{name} {n}"
+                for name, n in sorted(wins.items(), key=lambda item: -item[1])
+            )
+        )
+    if report["num_of_profiles"]:
+        lines.append(
+            f"  {report['num_of_profiles']} profiles, by own time (own, cumulative):"
+        )
+        for row in report["top_functions"][:5]:
+            lines.append(
+                f"    {row['own']:>8.2f}s {row['cumulative']:>8.2f}s {row['function']}"
+            )
+    return "\n".join(lines)
@@ -1,15 +1,46 @@
+from argparse import ArgumentParser
+from contextlib import ExitStack
+from itertools import batched, chain, groupby
 from logging import getLogger
+import os
 from pathlib import Path
+import threading
+import time
+from timeit import default_timer as timer
+from typing import Dict, List, Tuple
 from scenarios import (
-    AbstractScenario,
+    DISPATCH_MODES,
     ScenarioAllBelowCutoff,
     ScenarioOne,
     ScenarioZero,
 )
-from tqdm.contrib.concurrent import process_map
 from dotenv import dotenv_values
+from tqdm import tqdm
 
-from models import Config
+from models import RENDER_MODES, Config, ServiceRegion, SimulationResult
+from solvers import DECOMPOSITIONS, HeuristicSolver, OrToolsSolver
+from runner import (
+    SimulationTask,
+    resolve_root_seed,
+    run_simulation,
+    run_simulations,
+    common_random_numbers_groups,
+    paired_simulation_tasks,
+    simulation_seed,
+    worker_pool,
+)
+from store import (
+    ResultStore,
+    manifest_simulations,
+    read_manifest,
+    read_simulations,
+    remove_uncommitted_parts,
+    results_directory,
+)
+from stats import PairedStatistics, RunStatistics
+from sweep import expand_sweep, parse_overrides
+from workqueue import POLL_SECONDS, Lease, QueueChunk, WorkQueue
+import instrumentation
 
 logger = getLogger(__name__)
 
@@ -19,18 +50,53 @@ scenarios_registry = {
     "AllBelowCutoff": ScenarioAllBelowCutoff,
 }
 
+solvers_registry = {
+    "OrTools": OrToolsSolver,
+    "Heuristic": HeuristicSolver,
+}
+
+
+def parse_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes")
+
 
 def read_env(env_file: Path):
     """Reads the environment file and returns a configuration object"""
+    return config_from_env(dotenv_values(env_file.as_posix()))
+
+
+def read_sweep(
+    env_file: Path, overrides: Dict[str, str] = None, default_name: str = None
+) -> List[Config]:
+    """
+    Reads the environment file and returns the configuration of every sweep point. A file
+    without a NAME is named `default_name` when given, otherwise after its SCENARIO.
+    """
+
     env = dotenv_values(env_file.as_posix())
+    if default_name and not env.get("NAME"):
+        env["NAME"] = default_name
+    return [config_from_env(point) for point in expand_sweep(env, overrides)]
+
+
+def config_from_env(env: Dict[str, str]) -> Config:
+    """Builds a configuration object from the values of an environment file"""
 
     def value(key, type=None, default_value=None):
         return (
             type(env.get(key, default_value)) if type else env.get(key, default_value)
         )
 
+    def choice(key, choices, default_value):
+        """The value of the key, rejected before the run when it is not one of the choices"""
+        chosen = value(key, None, default_value)
+        if chosen not in choices:
+            raise ValueError(f"{key} must be one of {choices}, got {chosen}")
+        return chosen
+
     config = Config(
         scenario=scenarios_registry[value("SCENARIO")],
+        name=value("NAME", None, value("SCENARIO")),
         reservation_cuttoff=value("RESERVATION_CUTOFF", int),
         output_dir=value("OUTPUT_DIR", Path),
         number_of_zones_per_row=value("NUMBER_OF_ZONES_PER_ROW", int),
@@ -42,41 +108,591 @@ def read_env(env_file: Path):
         shuttle_speed=value("SHUTTLE_SPEED", float),
         min_reservation_time=value("MIN_RESERVATION_TIME", int, 0),
         max_reservation_time=value("MAX_RESERVATION_TIME", int, 60),
+        num_of_workers=value("NUM_OF_WORKERS", int, os.cpu_count()),
+        chunk_size=value("CHUNK_SIZE", int, 8),
+        solver=solvers_registry[value("SOLVER", None, "OrTools")],
+        solver_time_limit=value("SOLVER_TIME_LIMIT", float, 0.1),
+        solver_time_per_trip=value("SOLVER_TIME_PER_TRIP", float, 0.05),
+        solver_max_time_limit=value("SOLVER_MAX_TIME_LIMIT", float, 30),
+        solver_stall_ratio=value("SOLVER_STALL_RATIO", float, 0.1),
+        solver_solution_limit=value("SOLVER_SOLUTION_LIMIT", int, 0),
+        results_chunk_size=value("RESULTS_CHUNK_SIZE", int, 1_000),
+        render_mode=choice("RENDER_MODE", RENDER_MODES, "none"),
+        render_every=value("RENDER_EVERY", int, 100),
+        root_seed=value("ROOT_SEED", int) if env.get("ROOT_SEED") else None,
+        dispatch_mode=choice("DISPATCH_MODE", DISPATCH_MODES, "static"),
+        resolve_every=value("RESOLVE_EVERY", int, 10),
+        number_of_cycles=value("NUMBER_OF_CYCLES", int, 1),
+        warm_start=value("WARM_START", parse_bool, "true"),
+        num_of_shuttles=value("NUM_OF_SHUTTLES", int, 1),
+        decomposition=choice("DECOMPOSITION", DECOMPOSITIONS, "none"),
+        cross_route_pass=value("CROSS_ROUTE_PASS", parse_bool, "true"),
+        profile_fraction=value("PROFILE_FRACTION", float, 0.0),
+        solution_cache=(
+            value("SOLUTION_CACHE", Path) if env.get("SOLUTION_CACHE") else None
+        ),
+        solution_cache_size=value("SOLUTION_CACHE_SIZE", int, 100_000),
+        distance_metric=value("DISTANCE_METRIC", None, "euclidean"),
+        distance_table=(
+            value("DISTANCE_TABLE", Path) if env.get("DISTANCE_TABLE") else None
+        ),
+        confidence_level=value("CONFIDENCE_LEVEL", float, 0.95),
+        target_precision=value("TARGET_PRECISION", float, 0.0),
+        min_simulations=value("MIN_SIMULATIONS", int, 30),
+        stats_bucket_minutes=value("STATS_BUCKET_MINUTES", int, 10),
+        common_random_numbers=value("COMMON_RANDOM_NUMBERS", parse_bool, "false"),
+        prefilter=value("PREFILTER", parse_bool, "true"),
+        solver_bound_gap=value("SOLVER_BOUND_GAP", float, 0.0),
+        solver_portfolio=value("SOLVER_PORTFOLIO", int, 0),
+        queue_chunk_size=value("QUEUE_CHUNK_SIZE", int, 64),
+        lease_seconds=value("LEASE_SECONDS", float, 600),
     )
+    if (
+        issubclass(config.scenario, ScenarioOne)
+        and config.dispatch_mode == "event"
+        and config.num_of_shuttles > 1
+    ):
+        raise ValueError(
+            f"DISPATCH_MODE=event plans the route of a single shuttle, got NUM_OF_SHUTTLES={config.num_of_shuttles}"
+        )
 
     return config
 
 
-def run_scenario(scenario: AbstractScenario):
-    try:
-        print(f"Running {scenario.scenario_name} ...")
-        scenario.run()
-        print(
-            f"{scenario.scenario_name} Complete. Results stored at {scenario.scenario_directory.as_posix()}."
+def replay(config: Config, simulation_index: int, seed: int = None):
+    """Reruns a single simulation of the run in this process and prints its results"""
+
+    if seed is None:
+        seed = simulation_seed(resolve_root_seed(config), simulation_index)
+
+    # Only a replay prints tables
+    import pandas as pd
+
+    results = run_simulation(SimulationTask(config, simulation_index, seed))
+    if results[0].error:
+        print(results[0].error)
+        return
+
+    print(f"Simulation {simulation_index} (seed {seed}):")
+    for result in results:
+        if config.number_of_cycles > 1:
+            print(f"Cycle {result.cycle}:")
+        trips = pd.DataFrame(result.trips).replace({"node": {-1: pd.NA}})
+        print(trips.to_string(index=False))
+        print("Route for Shuttle:")
+        for route in result.routes:
+            print(" -> ".join(str(point) for point in route))
+        if result.route_time is not None:
+            print(f"Route time: {result.route_time:.2f} minutes")
+    print(
+        "Phases: "
+        + ", ".join(
+            f"{name} {seconds * 1000:.1f}ms"
+            for name, seconds in results[0].metrics["phases"].items()
         )
+    )
+
+
+def completed_simulations(config: Config, resume: bool) -> Dict[int, bool]:
+    """
+    Returns the simulations of the config already committed to its results, by index,
+    with whether they failed. Without `resume` the config must not have results yet.
+    """
+
+    directory = results_directory(config.output_dir, config.name)
+    entries = read_manifest(directory)
+    if not resume:
+        if entries or any(directory.glob("*/part-*")):
+            raise ValueError(
+                f"{directory} already holds results, rerun with --resume to complete them"
+            )
+        return {}
+
+    removed = remove_uncommitted_parts(directory)
+    if removed:
+        print(f"{config.name}: removed {removed} files of uncommitted chunks.")
+
+    for entry in entries:
+        if entry["root_seed"] != config.root_seed:
+            raise ValueError(
+                f"{directory} was run with root seed {entry['root_seed']}, not {config.root_seed}"
+            )
+    return manifest_simulations(entries)
+
+
+def run_configs(configs: List[Config], resume: bool = False):
+    """
+    Runs the simulations of all the configs on one process pool.
+
+    The tasks of the configs are queued one after another, so the workers move on to the
+    next config as soon as the previous one runs out of tasks. Every config keeps its own
+    results under its NAME. The pool is sized by the first config.
+
+    With `resume`, the simulations committed by a previous, interrupted run are skipped.
+    """
+
+    prepare_configs(configs)
+    completed = {}
+    for config in configs:
+        completed[config.name] = completed_simulations(config, resume)
+        if completed[config.name]:
+            print(
+                f"{config.name}: resuming after {len(completed[config.name])} of {config.number_of_simulations} simulations."
+            )
+
+    statistics = {config.name: RunStatistics(config) for config in configs}
+    groups = common_random_numbers_groups(configs)
+    paired = {
+        group[0].name: PairedStatistics(group) for group in groups if len(group) > 1
+    }
+    group_names = {config.name: group[0].name for group in groups for config in group}
+
+    def scheduled_tasks(group: List[Config]):
+        """The tasks of the group, until all its configs reach the target precision"""
+        for task in paired_simulation_tasks(group, completed):
+            if all(statistics[config.name].precise for config in group):
+                return
+            yield task
+
+    # The config of the latest simulation, shown next to the progress bar
+    current = None
+
+    def status() -> str:
+        if current is None:
+            return ""
+        prefix = f"{current}: " if len(configs) > 1 else ""
+        return prefix + statistics[current].summary()
+
+    results = run_simulations(
+        chain.from_iterable(scheduled_tasks(group) for group in groups),
+        total=sum(
+            config.number_of_simulations - len(completed[config.name])
+            for config in configs
+        ),
+        num_of_workers=configs[0].num_of_workers,
+        chunk_size=configs[0].chunk_size,
+        configs=configs,
+        status=status,
+    )
+
+    failed = {config.name: sum(completed[config.name].values()) for config in configs}
+    with ExitStack() as stack:
+        stores = {
+            config.name: stack.enter_context(ResultStore(config)) for config in configs
+        }
+        metrics_logs = {
+            name: instrumentation.MetricsLog(store.directory)
+            for name, store in stores.items()
+        }
+        num_of_cycles = {config.name: config.number_of_cycles for config in configs}
+        # The results of a simulation, one per cycle, arrive one after another
+        for (current, simulation_index), simulation_results in groupby(
+            results, key=lambda result: (result.config_name, result.simulation_index)
+        ):
+            simulation_results = list(simulation_results)
+            stores[current].append(simulation_results)
+            for result in simulation_results:
+                if result.metrics:
+                    metrics_logs[result.config_name].write_simulation(
+                        result.simulation_index,
+                        result.seed,
+                        num_of_cycles[result.config_name],
+                        result.metrics,
+                    )
+                if result.error:
+                    failed[result.config_name] += 1
+                    logger.error(
+                        f"Simulation {result.simulation_index} of {result.config_name} failed:\n{result.error}"
+                    )
+            statistics[current].add(simulation_results)
+            if group_names[current] in paired:
+                paired[group_names[current]].add(
+                    current, simulation_index, simulation_results
+                )
+
+    finish_run(
+        configs,
+        statistics,
+        paired,
+        {
+            config.name: len(completed[config.name])
+            + statistics[config.name].num_of_simulations
+            for config in configs
+        },
+        failed,
+        metrics_logs,
+        {name: store.write_time for name, store in stores.items()},
+    )
+
+
+def prepare_configs(configs: List[Config]) -> None:
+    """Checks the configs, resolves their root seeds and prepares their service regions"""
+
+    names = [config.name for config in configs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Configurations must have unique names, got {duplicates}")
+
+    for config in configs:
+        resolve_root_seed(config)
+        # Check the service regions, the workers memory-map their travel times tables
+        ServiceRegion.prepare(config)
+    for root_seed in dict.fromkeys(config.root_seed for config in configs):
+        print(f"Root seed: {root_seed}")
+
+
+def finish_run(
+    configs: List[Config],
+    statistics: Dict[str, RunStatistics],
+    paired: Dict[str, PairedStatistics],
+    num_of_simulations: Dict[str, int],
+    failed: Dict[str, int],
+    metrics_logs: Dict[str, instrumentation.MetricsLog],
+    write_times: Dict[str, float],
+):
+    """
+    Prints and writes the statistics and the performance report of every config, draws
+    its graphs and marks the run as successful
+    """
+
+    for config in configs:
+        prefix = f"{config.name}: " if len(configs) > 1 else ""
+        directory = results_directory(config.output_dir, config.name)
         print(
-            "----------------------------------------------------------------------------------\n"
+            f"{prefix}{num_of_simulations[config.name] - failed[config.name]} simulations completed, {failed[config.name]} failed."
         )
-    except Exception as e:
-        logger.error(e)
+        if (
+            statistics[config.name].precise
+            and num_of_simulations[config.name] < config.number_of_simulations
+        ):
+            print(
+                f"{prefix}target precision of {config.target_precision:.1%} reached,"
+                f" {config.number_of_simulations - num_of_simulations[config.name]} simulations skipped."
+            )
+        statistics[config.name].write(directory)
+        print(prefix + statistics[config.name].format())
 
+        # Graphs are drawn from the stored results once all the simulations are done
+        starting_time = timer()
+        num_of_graphs = 0
+        if config.render_mode != "none":
+            # matplotlib, networkx and pandas are only imported to draw graphs
+            import graph
+
+            num_of_graphs = graph.render_run(config)
+        if num_of_graphs:
+            print(
+                f"{prefix}{num_of_graphs} graphs drawn in {(config.output_dir / 'data').as_posix()}."
+            )
+        render_time = timer() - starting_time
+
+        metrics_logs[config.name].write_run(
+            {"write": write_times[config.name], "render": render_time}
+        )
+        report = instrumentation.write_report(directory)
+        print(prefix + instrumentation.format_report(report))
+
+    configs_by_name = {config.name: config for config in configs}
+    for name, paired_statistics in paired.items():
+        config = configs_by_name[name]
+        paired_statistics.write(
+            results_directory(config.output_dir, config.name), statistics
+        )
+        print(paired_statistics.format(statistics))
+
+    for output_dir in {config.output_dir for config in configs}:
+        with open(output_dir / ".success", "w+") as f:
+            f.write("")
+
+
+def coordinate(configs: List[Config], resume: bool = False):
+    """
+    Queues the simulations of the configs for `work` processes on any machine that sees
+    OUTPUT_DIR, requeues the chunks of crashed workers until every simulation is committed,
+    then writes the statistics and reports of the run from the stored results. See
+    workqueue.py.
+    """
+
+    prepare_configs(configs)
+    queue = WorkQueue.of_output_dir(configs[0].output_dir, configs[0].lease_seconds)
+    if queue.exists():
+        # Workers may still be writing, their uncommitted files are left alone
+        if not resume:
+            raise ValueError(
+                f"{queue.directory} holds the queue of a run, rerun with --resume to coordinate it"
+            )
+    else:
+        for config in configs:
+            completed_simulations(config, resume)
+        queue.create()
+    print(f"Queue in {queue.directory}, start the workers with --work.")
+
+    groups = common_random_numbers_groups(configs)
+    with tqdm(
+        total=sum(config.number_of_simulations for config in configs)
+    ) as progress:
+        while True:
+            requeued = queue.requeue_expired()
+            if requeued:
+                logger.warning(f"Requeued {requeued} chunks of expired leases")
+
+            # The queue is read before the manifests: a chunk whose lease is gone by then
+            # was committed before its lease was deleted
+            queued = queue.queued_simulations()
+            committed = {
+                config.name: manifest_simulations(
+                    read_manifest(results_directory(config.output_dir, config.name))
+                )
+                for config in configs
+            }
+            progress.update(sum(map(len, committed.values())) - progress.n)
+
+            num_of_missing = 0
+            for group in groups:
+                # Simulations neither committed nor queued, by the configs missing them
+                missing: Dict[Tuple[str, ...], List[int]] = {}
+                for index in range(group[0].number_of_simulations):
+                    names = tuple(
+                        config.name
+                        for config in group
+                        if index not in committed[config.name]
+                        and index not in queued.get(config.name, ())
+                    )
+                    if names:
+                        missing.setdefault(names, []).append(index)
+                for names, indices in missing.items():
+                    num_of_missing += len(indices)
+                    for chunk in batched(indices, configs[0].queue_chunk_size):
+                        queue.put(
+                            QueueChunk(list(names), list(chunk), group[0].root_seed)
+                        )
+
+            if not queued and not num_of_missing:
+                break
+            time.sleep(POLL_SECONDS)
+    queue.finish()
+
+    statistics = {config.name: RunStatistics(config) for config in configs}
+    paired = {
+        group[0].name: PairedStatistics(group) for group in groups if len(group) > 1
+    }
+    group_names = {config.name: group[0].name for group in groups for config in group}
+    for config in configs:
+        directory = results_directory(config.output_dir, config.name)
+        for simulation_results in read_simulations(directory):
+            statistics[config.name].add(simulation_results)
+            if group_names[config.name] in paired:
+                paired[group_names[config.name]].add(
+                    config.name,
+                    simulation_results[0].simulation_index,
+                    simulation_results,
+                )
+
+    finish_run(
+        configs,
+        statistics,
+        paired,
+        {name: stat.num_of_simulations for name, stat in statistics.items()},
+        {name: stat.num_of_failed for name, stat in statistics.items()},
+        {
+            config.name: instrumentation.MetricsLog(
+                results_directory(config.output_dir, config.name)
+            )
+            for config in configs
+        },
+        # The workers record their own write times
+        {config.name: 0.0 for config in configs},
+    )
 
-def main():
-    config = read_env(Path(".env"))
 
-    args = {"config": config}
+def work(configs: List[Config]):
+    """
+    Runs the chunks leased from the queue of the coordinator on a local process pool, and
+    commits the results of every chunk once all its simulations are back, until the
+    coordinator marks the queue finished. See workqueue.py.
+    """
 
-    generated_scenarios = [
-        config.scenario(**args) for i in range(config.number_of_simulations)
-    ]
+    queue = WorkQueue.of_output_dir(configs[0].output_dir, configs[0].lease_seconds)
+    if not queue.exists():
+        print(f"Waiting for a coordinator to create {queue.directory} ...")
+    while not queue.exists():
+        time.sleep(POLL_SECONDS)
 
-    process_map(run_scenario, generated_scenarios)
+    # The root seeds are needed by the stores, the coordinator saved them before queueing
+    for config in configs:
+        resolve_root_seed(config)
 
-    with open(config.output_dir / ".success", "w+") as f:
-        f.write("")
+    configs_by_name = {config.name: config for config in configs}
+    leases: Dict[str, Lease] = {}
+    # Simulations of every lease still running and the results of those that are back
+    remaining: Dict[str, int] = {}
+    lease_results: Dict[str, List[SimulationResult]] = {}
+    lease_names: Dict[Tuple[str, int], str] = {}
+
+    def tasks():
+        while (lease := queue.lease()) is not None:
+            unknown = set(lease.chunk.configs) - set(configs_by_name)
+            if unknown:
+                raise ValueError(
+                    f"Chunk {lease.name} is for the configurations {unknown}, which this worker was not given"
+                )
+            group = [configs_by_name[name] for name in lease.chunk.configs]
+            root_seed = group[0].root_seed
+            if root_seed != lease.chunk.root_seed:
+                raise ValueError(
+                    f"Chunk {lease.name} was queued with root seed {lease.chunk.root_seed}, not {root_seed}"
+                )
+
+            leases[lease.name] = lease
+            remaining[lease.name] = len(group) * len(lease.chunk.simulation_index)
+            lease_results[lease.name] = []
+            for index in lease.chunk.simulation_index:
+                for config in group:
+                    lease_names[(config.name, index)] = lease.name
+                yield SimulationTask(
+                    group[0], index, simulation_seed(root_seed, index), tuple(group[1:])
+                )
+
+    def commit(lease: Lease, results: List[SimulationResult]):
+        if not queue.holds(lease):
+            logger.warning(
+                f"The lease of chunk {lease.name} expired, its results are discarded"
+            )
+            return
+        results_by_config: Dict[str, List[SimulationResult]] = {}
+        for result in results:
+            results_by_config.setdefault(result.config_name, []).append(result)
+        for name, config_results in results_by_config.items():
+            stores[name].write_chunk(config_results)
+            for result in config_results:
+                if result.metrics:
+                    metrics_logs[name].write_simulation(
+                        result.simulation_index,
+                        result.seed,
+                        configs_by_name[name].number_of_cycles,
+                        result.metrics,
+                    )
+        queue.complete(lease)
+
+    # Keep the leases alive while their simulations run
+    stopped = threading.Event()
+
+    def renew_leases():
+        while not stopped.wait(queue.lease_seconds / 4):
+            queue.renew(list(leases.values()))
+
+    threading.Thread(target=renew_leases, daemon=True).start()
+
+    num_of_chunks = 0
+    with ExitStack() as stack:
+        stack.callback(stopped.set)
+        stores = {
+            config.name: stack.enter_context(ResultStore(config)) for config in configs
+        }
+        metrics_logs = {
+            name: instrumentation.MetricsLog(store.directory)
+            for name, store in stores.items()
+        }
+        # One pool and progress bar for the whole session, an idle worker only polls
+        executor = stack.enter_context(worker_pool(configs[0].num_of_workers, configs))
+        progress = stack.enter_context(tqdm())
+        while not queue.finished:
+            if not queue.has_pending():
+                # Wait for the other workers to finish their chunks, or for requeues
+                time.sleep(POLL_SECONDS)
+                continue
+            results = run_simulations(
+                tasks(),
+                num_of_workers=configs[0].num_of_workers,
+                chunk_size=configs[0].chunk_size,
+                configs=configs,
+                executor=executor,
+                progress=progress,
+            )
+            for key, simulation_results in groupby(
+                results,
+                key=lambda result: (result.config_name, result.simulation_index),
+            ):
+                name = lease_names.pop(key)
+                lease_results[name].extend(simulation_results)
+                remaining[name] -= 1
+                if not remaining[name]:
+                    commit(leases.pop(name), lease_results.pop(name))
+                    del remaining[name]
+                    num_of_chunks += 1
+
+        for name, store in stores.items():
+            metrics_logs[name].write_run({"write": store.write_time, "render": 0.0})
+    print(f"The queue is finished, {num_of_chunks} chunks run by this worker.")
+
+
+def main():
+    parser = ArgumentParser(description="Semi-flex transit service simulation")
+    parser.add_argument(
+        "--env",
+        type=Path,
+        nargs="+",
+        default=[Path(".env")],
+        help="configuration file(s), all of them are run on one process pool",
+    )
+    parser.add_argument(
+        "--sweep",
+        action="append",
+        metavar="KEY=VALUES",
+        help="sweep a parameter over a list (a,b,c) or a range (start:stop:step), see sweep.py",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="complete an interrupted run, skipping the simulations it has stored",
+    )
+    parser.add_argument(
+        "--coordinate",
+        action="store_true",
+        help="queue the simulations for --work processes in OUTPUT_DIR/queue, see workqueue.py",
+    )
+    parser.add_argument(
+        "--work",
+        action="store_true",
+        help="run the simulations leased from the queue of a --coordinate process",
+    )
+    parser.add_argument(
+        "--replay",
+        type=int,
+        metavar="INDEX",
+        help="rerun only the simulation with this index, using the run's root seed",
+    )
+    parser.add_argument(
+        "--seed", type=int, help="with --replay, the seed of the simulation instead"
+    )
+    args = parser.parse_args()
+
+    try:
+        overrides = parse_overrides(args.sweep)
+        # Several files may share their SCENARIO, those without a NAME are named after
+        # the file instead
+        configs = [
+            config
+            for env_file in args.env
+            for config in read_sweep(
+                env_file, overrides, env_file.stem if len(args.env) > 1 else None
+            )
+        ]
+    except ValueError as e:
+        parser.error(str(e))
 
-    # with Pool(os.cpu_count()) as p:
-    #     p.map(run_scenario, generated_scenarios, 200)
+    if args.replay is not None:
+        if len(configs) != 1:
+            parser.error("--replay needs a single configuration, without a sweep")
+        replay(configs[0], args.replay, args.seed)
+    elif args.coordinate and args.work:
+        parser.error("--coordinate and --work run in separate processes")
+    elif args.coordinate:
+        coordinate(configs, args.resume)
+    elif args.work:
+        work(configs)
+    else:
+        run_configs(configs, args.resume)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import datetime
 from enum import Enum
+import hashlib
 from math import floor
 from pathlib import Path
-from typing import Type
+from typing import Dict, List, Optional, Type
 
 import numpy as np
-from scipy.spatial import distance_matrix
+
+from distances import DistanceMetric, load_travel_times, make_metric
+import instrumentation
+
+# How the route graphs of a run are selected, see graph.select_simulations
+RENDER_MODES = ("none", "every", "failures", "all")
 
 
 @dataclass
@@ -23,6 +29,41 @@ class Config:
     shuttle_speed: float
     min_reservation_time: int
     max_reservation_time: int
+    num_of_workers: Optional[int] = None
+    chunk_size: int = 8
+    solver: Optional[Type] = None
+    solver_time_limit: float = 0.1
+    solver_time_per_trip: float = 0.05
+    solver_max_time_limit: float = 30
+    solver_stall_ratio: float = 0.1
+    solver_solution_limit: int = 0
+    name: str = "default"
+    results_chunk_size: int = 1_000
+    render_mode: str = "none"
+    render_every: int = 100
+    root_seed: Optional[int] = None
+    dispatch_mode: str = "static"
+    resolve_every: int = 10
+    number_of_cycles: int = 1
+    warm_start: bool = True
+    num_of_shuttles: int = 1
+    decomposition: str = "none"
+    cross_route_pass: bool = True
+    profile_fraction: float = 0.0
+    solution_cache: Optional[Path] = None
+    solution_cache_size: int = 100_000
+    distance_metric: str = "euclidean"
+    distance_table: Optional[Path] = None
+    confidence_level: float = 0.95
+    target_precision: float = 0.0
+    min_simulations: int = 30
+    stats_bucket_minutes: int = 10
+    common_random_numbers: bool = False
+    prefilter: bool = True
+    solver_bound_gap: float = 0.0
+    solver_portfolio: int = 0
+    queue_chunk_size: int = 64
+    lease_seconds: float = 600
 
 
 class TripDirection(Enum):
@@ -57,9 +98,139 @@ class Trip:
         return f"""{self.id}, {self.direction.name}, {self.location_index}, {self.reserved_at}, {self.reservation_status.name}"""
 
 
+DIRECTION_NAMES = np.array([None] + [d.name for d in TripDirection], dtype=object)
+STATUS_NAMES = np.array([s.name for s in ReservationStatus], dtype=object)
+
+
+@dataclass
+class TripSet:
+    """
+    The trips of a simulation as parallel arrays, entry i of every array is the i-th trip.
+
+    Directions and statuses hold the values of TripDirection and ReservationStatus. The
+    scenarios work on the arrays, `Trip` objects are only built by `to_trips`.
+    """
+
+    ids: np.ndarray
+    reserved_at: np.ndarray
+    directions: np.ndarray
+    location_indices: np.ndarray
+    locations: np.ndarray
+    statuses: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "TripSet":
+        return cls(
+            ids=np.empty(0, np.int32),
+            reserved_at=np.empty(0, np.int32),
+            directions=np.empty(0, np.int8),
+            location_indices=np.empty(0, np.int32),
+            locations=np.empty((0, 2)),
+            statuses=np.empty(0, np.int8),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def take(self, indices: np.ndarray) -> "TripSet":
+        """A copy of the trips at the indices"""
+        return TripSet(
+            **{name: getattr(self, name)[indices] for name in self.__dataclass_fields__}
+        )
+
+    @classmethod
+    def concatenate(cls, trip_sets: List["TripSet"]) -> "TripSet":
+        return cls(
+            **{
+                name: np.concatenate([getattr(trips, name) for trips in trip_sets])
+                for name in cls.__dataclass_fields__
+            }
+        )
+
+    @property
+    def num_of_accepted(self) -> int:
+        return int(np.count_nonzero(self.statuses == ReservationStatus.ACCEPTED.value))
+
+    def to_trips(self) -> List[Trip]:
+        trips = []
+        for i in range(len(self)):
+            trip = Trip(
+                id=int(self.ids[i]),
+                reserved_at=int(self.reserved_at[i]),
+                direction=TripDirection(self.directions[i]),
+                location_index=int(self.location_indices[i]),
+                location=tuple(self.locations[i]),
+            )
+            trip.reservation_status = ReservationStatus(self.statuses[i])
+            trips.append(trip)
+        return trips
+
+    def columns(self, nodes: np.ndarray) -> Dict[str, np.ndarray]:
+        """The columns of store.TRIPS_SCHEMA, `nodes` is -1 for trips that were not routed"""
+
+        return {
+            "trip_id": self.ids,
+            "node": nodes,
+            "direction": DIRECTION_NAMES[self.directions],
+            "location_index": self.location_indices,
+            "reserved_at": self.reserved_at,
+            "reservation_status": STATUS_NAMES[self.statuses],
+        }
+
+
+@dataclass
+class SimulationResult:
+    """Compact summary of a single simulation, sent back from the worker processes"""
+
+    simulation_index: int
+    seed: int
+    scenario_name: str
+    # NAME of the config, several configs may share a process pool
+    config_name: Optional[str] = None
+    # Shuttle cycle of the simulation, a simulation has NUMBER_OF_CYCLES results
+    cycle: int = 0
+    num_of_trips: int = 0
+    num_of_accepted: int = 0
+    # Route of the first shuttle, and the routes of all the shuttles
+    route: List[int] = field(default_factory=list)
+    routes: List[List[int]] = field(default_factory=list)
+    route_distance: int = 0
+    route_time: Optional[float] = None
+    dropped_nodes: List[int] = field(default_factory=list)
+    elapsed_time: float = 0.0
+    time_limit: float = 0.0
+    num_of_solutions: int = 0
+    stop_reason: Optional[str] = None
+    num_of_resolves: int = 0
+    warm_started: bool = False
+    error: Optional[str] = None
+    # Columns of the generated trips, see store.TRIPS_SCHEMA and TripSet.columns
+    trips: Dict[str, np.ndarray] = field(default_factory=dict)
+    # Phase timings and peak RSS of the whole simulation, see instrumentation.record.
+    # Only the first result of a simulation holds them
+    metrics: Dict = field(default_factory=dict)
+
+    @property
+    def solved(self) -> bool:
+        return self.error is None and self.route_time is not None
+
+
+def table_digest(path: Path) -> str:
+    """Identifies a travel times table by its path and modification time"""
+
+    path = Path(path).resolve()
+    return hashlib.sha256(f"{path}:{path.stat().st_mtime_ns}".encode()).hexdigest()[:12]
+
+
 class ServiceRegion:
     def __init__(
-        self, num_of_zones_per_row: int, zone_length: float, zone_width: float
+        self,
+        num_of_zones_per_row: int,
+        zone_length: float,
+        zone_width: float,
+        distance_metric: str = "euclidean",
+        travel_times: np.ndarray = None,
+        shuttle_speed: float = 1.0,
     ) -> None:
         self.num_of_zones_per_row = num_of_zones_per_row
         self.zone_length = zone_length
@@ -67,22 +238,100 @@ class ServiceRegion:
 
         self.stops_coords: np.ndarray = None
         self.stops_grid: np.ndarray = None
-        self.stops_distance_matrix: np.ndarray = None
 
         self.build_stops_grid()
-        self.generate_distance_matrix()
+        # Distances are computed for the stops a simulation picks, never for all of them
+        self.distance_metric: DistanceMetric = make_metric(
+            distance_metric, self.stops_grid, travel_times, shuttle_speed
+        )
 
-        # Set a random fixed stop in the service region
-        # 1. Get the number of rows in the array
-        # 2. Pick a random row index
+        # The fixed stop is the middle item of the stops grid, it only depends on the
+        # geometry so that a single region can be shared by all simulations
         num_rows = self.stops_grid.shape[0]
-        self.fixed_stop_index = np.random.choice(num_rows)
-        # self.fixed_stop: np.ndarray = self.stops_grid[self.fixed_stop_index]
-        self.fixed_stop: np.ndarray = self.stops_grid[floor(num_rows / 2)]
+        self.fixed_stop_index = floor(num_rows / 2)
+        self.fixed_stop: np.ndarray = self.stops_grid[self.fixed_stop_index]
 
-        # Pick all other stops ignoring the fixed stop as none_fixed_stops
+        # Pick all other stops ignoring the fixed stop as none_fixed_stops,
+        # none_fixed_stops_indices maps them back to rows of the stops grid
         mask = ~np.all(self.stops_grid == self.fixed_stop, axis=1)
         self.none_fixed_stops = self.stops_grid[mask]
+        self.none_fixed_stops_indices = np.flatnonzero(mask)
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ServiceRegion":
+        """
+        Returns the service region of the config, built once per process.
+
+        A travel times table is memory-mapped read-only, so that all the worker processes
+        share the same pages.
+        """
+
+        key = cls.region_key(config)
+        if key not in _shared_service_regions:
+            with instrumentation.phase("region"):
+                _shared_service_regions[key] = cls.build(config)
+
+        return _shared_service_regions[key]
+
+    @classmethod
+    def build(cls, config: Config) -> "ServiceRegion":
+        travel_times = None
+        if config.distance_metric == "table" and config.distance_table is not None:
+            travel_times_file = cls.travel_times_file(config)
+            travel_times = load_travel_times(
+                travel_times_file
+                if travel_times_file.exists()
+                else config.distance_table
+            )
+        return cls(
+            config.number_of_zones_per_row,
+            config.zone_length,
+            config.zone_width,
+            config.distance_metric,
+            travel_times,
+            config.shuttle_speed,
+        )
+
+    @classmethod
+    def prepare(cls, config: Config) -> Optional[Path]:
+        """
+        Converts a CSV travel times table to `.npy` for the workers to map, and checks that
+        the region of the config can be built. Returns the table the workers map, if any.
+        """
+
+        if config.distance_metric != "table" or config.distance_table is None:
+            cls.build(config)
+            return None
+
+        travel_times_file = cls.travel_times_file(config)
+        if not travel_times_file.exists():
+            travel_times_file.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so that a worker never maps a partial file
+            temporary_file = travel_times_file.with_suffix(".tmp.npy")
+            np.save(temporary_file, load_travel_times(config.distance_table))
+            temporary_file.replace(travel_times_file)
+        cls.build(config)
+
+        return travel_times_file
+
+    @staticmethod
+    def region_key(config: Config) -> str:
+        key = f"{config.number_of_zones_per_row}x{config.zone_length:g}x{config.zone_width:g}-{config.distance_metric}"
+        if config.distance_metric == "table" and config.distance_table is not None:
+            key += f"-{table_digest(config.distance_table)}-{config.shuttle_speed:g}"
+        return key
+
+    @classmethod
+    def travel_times_file(cls, config: Config) -> Path:
+        """The `.npy` travel times table of the config, a CSV table is converted to it"""
+
+        if config.distance_table.suffix == ".npy":
+            return config.distance_table
+        return (
+            config.output_dir
+            / "regions"
+            / f"{config.distance_table.stem}-{table_digest(config.distance_table)}.npy"
+        )
 
     @property
     def num_of_zones(self):
@@ -111,5 +360,16 @@ class ServiceRegion:
     def generate_points(self, zone_size: float):
         return np.arange(self.num_of_zones_per_row) * zone_size + zone_size / 2
 
-    def generate_distance_matrix(self):
-        self.stops_distance_matrix = distance_matrix(self.stops_grid, self.stops_grid)
+    def distances(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """The distances from the stops of `rows` to the stops of `columns`"""
+        return self.distance_metric.distances(rows, columns)
+
+    @property
+    def stops_distance_matrix(self) -> np.ndarray:
+        """The distances between all the stops, only affordable for small regions"""
+        stops = np.arange(len(self.stops_grid))
+        return self.distances(stops, stops)
+
+
+# Service regions already built in this process, keyed by ServiceRegion.region_key
+_shared_service_regions: Dict[str, ServiceRegion] = {}
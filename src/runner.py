@@ -0,0 +1,280 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import cProfile
+from contextlib import ExitStack
+from dataclasses import replace
+from itertools import batched
+from logging import getLogger
+import os
+import secrets
+import traceback
+from typing import (
+    Callable,
+    Container,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TYPE_CHECKING,
+    Tuple,
+)
+
+import numpy as np
+from tqdm import tqdm
+
+import instrumentation
+from models import Config, ServiceRegion, SimulationResult
+from store import results_directory
+
+if TYPE_CHECKING:
+    from scenarios.base import SharedDraws
+
+logger = getLogger(__name__)
+
+
+class SimulationTask(NamedTuple):
+    """The only payload a worker receives, the scenario is built inside the worker"""
+
+    config: Config
+    simulation_index: int
+    seed: int
+    # Configs simulated on the same draws after `config`, see common_random_numbers_groups
+    paired_configs: Tuple[Config, ...] = ()
+
+
+def simulation_seed(root_seed: int, simulation_index: int) -> int:
+    """
+    Seed of a simulation, derived from the root seed and the simulation index only.
+
+    The seed sequence spawned for index i is the same as the i-th child of
+    SeedSequence(root_seed).spawn, so the streams of the simulations are independent.
+    """
+
+    seed_sequence = np.random.SeedSequence(root_seed, spawn_key=(simulation_index,))
+    return int(seed_sequence.generate_state(1, np.uint64)[0])
+
+
+def resolve_root_seed(config: Config) -> int:
+    """
+    Returns the root seed of the run: ROOT_SEED from the config, otherwise the seed saved
+    in OUTPUT_DIR/.root_seed by a previous run, otherwise a new random seed which is saved.
+    """
+
+    if config.root_seed is None:
+        seed_file = config.output_dir / ".root_seed"
+        if seed_file.exists():
+            config.root_seed = int(seed_file.read_text())
+        else:
+            config.root_seed = secrets.randbits(63)
+            seed_file.parent.mkdir(parents=True, exist_ok=True)
+            seed_file.write_text(str(config.root_seed))
+
+    return config.root_seed
+
+
+def common_random_numbers_groups(configs: Sequence[Config]) -> List[List[Config]]:
+    """
+    Groups the configs with COMMON_RANDOM_NUMBERS that only differ in their scenario (and
+    NAME), such as the points of a SCENARIO sweep. The simulations of a group run in one
+    task on the same trips. Every other config is a group of its own.
+    """
+
+    groups = []
+    for config in configs:
+        for group in groups:
+            if config.common_random_numbers and replace(
+                group[0], scenario=None, name=None
+            ) == replace(config, scenario=None, name=None):
+                group.append(config)
+                break
+        else:
+            groups.append([config])
+    return groups
+
+
+def paired_simulation_tasks(
+    configs: Sequence[Config], completed: Dict[str, Container[int]]
+) -> Iterator[SimulationTask]:
+    """
+    Lazily yields one task per simulation of a group of configs, for the configs that do
+    not have it in `completed` yet. The configs of a group share their root seed.
+    """
+
+    root_seed = resolve_root_seed(configs[0])
+    for index in range(configs[0].number_of_simulations):
+        pending = [config for config in configs if index not in completed[config.name]]
+        if pending:
+            yield SimulationTask(
+                pending[0],
+                index,
+                simulation_seed(root_seed, index),
+                tuple(pending[1:]),
+            )
+
+
+def run_simulation(
+    task: SimulationTask, shared_draws: "SharedDraws" = None
+) -> List[SimulationResult]:
+    """
+    Builds and runs a single scenario, always returning a result per cycle or an error.
+    The metrics of the simulation are set on its first result.
+    """
+
+    if task.paired_configs:
+        return run_paired_simulation(task)
+
+    config, index, seed, _ = task
+    profiler = (
+        cProfile.Profile()
+        if instrumentation.is_profiled(seed, config.profile_fraction)
+        else None
+    )
+    with instrumentation.record(profiler) as metrics:
+        results = simulate(task, shared_draws)
+    results[0].metrics = metrics
+
+    if profiler is not None:
+        instrumentation.save_profile(
+            profiler,
+            instrumentation.profile_path(
+                results_directory(config.output_dir, config.name), index
+            ),
+        )
+    return results
+
+
+def run_paired_simulation(task: SimulationTask) -> List[SimulationResult]:
+    """
+    Runs the simulation for the config of the task and its paired configs, one after the
+    other on the trips drawn by the first. Every config gets its own results and metrics.
+    """
+
+    from scenarios.base import SharedDraws
+
+    shared_draws = SharedDraws()
+    results = []
+    for config in (task.config, *task.paired_configs):
+        results.extend(
+            run_simulation(
+                task._replace(config=config, paired_configs=()), shared_draws
+            )
+        )
+    return results
+
+
+def simulate(
+    task: SimulationTask, shared_draws: "SharedDraws" = None
+) -> List[SimulationResult]:
+    config, index, seed, _ = task
+    try:
+        scenario = config.scenario(
+            config=config,
+            simulation_index=index,
+            seed=seed,
+            shared_draws=shared_draws,
+        )
+        results = scenario.simulate()
+        for result in results:
+            result.config_name = config.name
+        return results
+    except Exception as e:
+        logger.error(e)
+        return [
+            SimulationResult(
+                simulation_index=index,
+                seed=seed,
+                scenario_name=config.scenario.__name__,
+                config_name=config.name,
+                error=traceback.format_exc(),
+            )
+        ]
+
+
+def run_simulation_chunk(
+    tasks: List[SimulationTask],
+) -> List[List[SimulationResult]]:
+    return [run_simulation(task) for task in tasks]
+
+
+def preload_worker(configs: List[Config]) -> None:
+    """
+    Runs once in every worker, before its first simulation: imports the simulation code
+    (already there in a forked worker) and maps the service regions of the configs.
+    """
+
+    import scenarios  # noqa: F401
+
+    for config in configs:
+        ServiceRegion.from_config(config)
+
+
+def worker_pool(
+    num_of_workers: int = None, configs: Sequence[Config] = ()
+) -> ProcessPoolExecutor:
+    """A process pool whose workers are preloaded for the simulations of the configs"""
+
+    return ProcessPoolExecutor(
+        num_of_workers or os.cpu_count(),
+        initializer=preload_worker,
+        initargs=(list(configs),),
+    )
+
+
+def run_simulations(
+    tasks: Iterable[SimulationTask],
+    total: int = None,
+    num_of_workers: int = None,
+    chunk_size: int = 8,
+    configs: Sequence[Config] = (),
+    status: Callable[[], str] = None,
+    executor: Optional[ProcessPoolExecutor] = None,
+    progress: Optional[tqdm] = None,
+) -> Iterator[SimulationResult]:
+    """
+    Runs the tasks on one process pool, preloaded for `configs`, and yields the results
+    as they complete. `status` is shown next to the progress bar, refreshed once the
+    results of a chunk are consumed.
+
+    Tasks are dispatched in chunks of `chunk_size`, and at most two chunks per worker are
+    in flight at a time, so the task iterator is only consumed as fast as the workers go.
+
+    A caller running several batches of tasks passes its own `executor` and `progress`
+    bar, which are kept open.
+    """
+
+    num_of_workers = num_of_workers or os.cpu_count()
+    max_in_flight = 2 * num_of_workers
+
+    with ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(worker_pool(num_of_workers, configs))
+        if progress is None:
+            progress = stack.enter_context(tqdm(total=total))
+        pending = set()
+
+        def collect(return_when):
+            nonlocal pending
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                results = future.result()
+                # A simulation of every config in the results
+                progress.update(
+                    sum(
+                        len({result.config_name for result in simulation_results})
+                        for simulation_results in results
+                    )
+                )
+                for simulation_results in results:
+                    yield from simulation_results
+                if status is not None:
+                    progress.set_postfix_str(status(), refresh=False)
+
+        for chunk in batched(tasks, chunk_size):
+            if len(pending) >= max_in_flight:
+                yield from collect(FIRST_COMPLETED)
+            pending.add(executor.submit(run_simulation_chunk, list(chunk)))
+
+        while pending:
+            yield from collect(FIRST_COMPLETED)
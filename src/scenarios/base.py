@@ -1,33 +1,84 @@
 import datetime
 from math import floor
 from timeit import default_timer as timer
-import traceback
-from typing import List
+from typing import List, Optional, Tuple
 
 import numpy as np
-import pandas as pd
-from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 
-from models import Config, ReservationStatus, ServiceRegion, Trip, TripDirection
-import graph
+import instrumentation
+from models import (
+    Config,
+    ReservationStatus,
+    ServiceRegion,
+    SimulationResult,
+    TripDirection,
+    TripSet,
+)
+from solvers import (
+    AbstractSolver,
+    CachedSolver,
+    DecompositionSolver,
+    OrToolsSolver,
+    PortfolioSolver,
+    PrefilterSolver,
+    RoutingProblem,
+    RoutingSolution,
+    SolverTimePolicy,
+    open_cache,
+)
 
 SECONDS_PER_MINUTE = 60
+MINUTES_PER_HOUR = 60
+
+
+class SharedDraws:
+    """
+    The trips drawn in every cycle of a simulation and the distances between their stops,
+    shared by the scenarios that simulate it on common random numbers. The first scenario
+    draws, the others take copies. Row `i` of the distance matrix is the stop of trip `i`,
+    row 0 the fixed stop.
+    """
+
+    def __init__(self) -> None:
+        self.draws: List[TripSet] = []
+        self.distance_matrix: Optional[np.ndarray] = None
+
+    def add(self, trips: TripSet, service_region: ServiceRegion) -> None:
+        self.draws.append(trips)
+        # Trip ids number the drawn trips from 1, in the order they were drawn
+        stops = np.concatenate(
+            [[service_region.fixed_stop_index]]
+            + [
+                service_region.none_fixed_stops_indices[draw.location_indices]
+                for draw in self.draws
+            ]
+        )
+        self.distance_matrix = service_region.distances(stops, stops)
 
 
 class AbstractScenario:
     def __init__(
         self,
         config: Config,
+        simulation_index: int = 0,
+        seed: int = None,
+        shared_draws: Optional[SharedDraws] = None,
     ) -> None:
         """
         lambda_param: Demand density (number of passengers per hour per zone)
+        shared_draws: the trips of the simulation, when scenarios share them
         """
 
         self.config = config
+        self.simulation_index = simulation_index
+        self.seed = seed
+        # Independent random stream of this simulation, see runner.simulation_seed
+        self.rng = np.random.default_rng(seed)
+        self.shared_draws = shared_draws
 
         self.scenario_name = self.generate_scenario_name()
+        # Only created when something is drawn, results go to the run's ResultStore
         self.scenario_directory = config.output_dir / "data" / self.scenario_name
-        self.scenario_directory.mkdir(parents=True, exist_ok=True)
 
         self.num_of_zones_per_row = config.number_of_zones_per_row
         self.zone_length = config.zone_length
@@ -35,19 +86,17 @@ class AbstractScenario:
         self.lambda_param = config.lambda_param
         self.planning_horizon = config.planning_horizon
 
-        # Initialize a list of trips as empty in the beginning
-        self.trips: List[Trip] = list()
+        # Initialize the trips as empty in the beginning
+        self.trips: TripSet = TripSet.empty()
 
-        # Create a service region
-        self.service_region = ServiceRegion(
-            self.num_of_zones_per_row, self.zone_length, self.zone_width
-        )
+        # The service region only depends on the geometry, it is shared by all simulations
+        self.service_region = ServiceRegion.from_config(config)
 
         self.inbound_or_outbound_px = (
             0.5  # Probability that a trip is inbound or outbound
         )
 
-        self.num_of_shuttles = 1
+        self.num_of_shuttles = config.num_of_shuttles
         self.trips_density = 0
         self.cut_off_time = (
             config.reservation_cuttoff * SECONDS_PER_MINUTE
@@ -58,239 +107,322 @@ class AbstractScenario:
         self.search_parameters = None
         self.allow_dropping = True
 
+        # A shuttle cycle lasts as long as the reservation window (minutes)
+        self.cycle = 0
+        self.cycle_length = config.max_reservation_time
+        self.num_of_drawn_trips = 0
+        # Stops of the previous cycle's route, the next cycle's solve starts from them
+        self.previous_route_stops: Optional[np.ndarray] = None
+
+        self.reset_cycle()
+
         self.init()
 
+    def reset_cycle(self):
+        self.route: List[int] = list()
+        self.routes: List[List[int]] = list()
+        self.route_time: float = None
+        self.problem: RoutingProblem = None
+        self.solution: RoutingSolution = None
+        # Indices into self.trips of the trips handed to the solver, in node order
+        self.routed_indices: np.ndarray = np.empty(0, dtype=int)
+        # Seconds taken to decide each trip, only when trips are dispatched one by one
+        self.decision_times: Optional[np.ndarray] = None
+        self.num_of_resolves = 0
+
     def init(self):
         pass
 
+    def simulate(self) -> List[SimulationResult]:
+        """Runs NUMBER_OF_CYCLES consecutive shuttle cycles, one result per cycle"""
+
+        results = [self.run()]
+        for cycle in range(1, self.config.number_of_cycles):
+            self.start_cycle(cycle)
+            results.append(self.run())
+        return results
+
+    def start_cycle(self, cycle: int):
+        """
+        Replaces the trips by the riders carried over from the last cycle and new trips.
+
+        A rider who was not accepted is carried over if the new cycle starts within
+        PLANNING_HORIZON hours of their reservation. Reservation times are relative to the
+        start of the cycle, so carried riders have negative ones.
+        """
+
+        previous_trips = self.trips
+        waiting = (previous_trips.statuses != ReservationStatus.ACCEPTED.value) & (
+            self.cycle_length - previous_trips.reserved_at
+            <= self.planning_horizon * MINUTES_PER_HOUR
+        )
+        carried = previous_trips.take(np.flatnonzero(waiting))
+        carried.reserved_at -= self.cycle_length
+        carried.statuses[:] = ReservationStatus.PENDING.value
+
+        self.previous_route_stops = self.route_stops()
+        self.cycle = cycle
+        self.reset_cycle()
+        self.trips = TripSet.concatenate([carried, self.next_draw()])
+
     def run(self): ...
 
     def generate_scenario_name(self):
         now = datetime.datetime.now()
         return f"{now.strftime("%d_%m_%Y__%H_%M_%S.%f")}"
 
-    def get_generated_route(self, trips: List[Trip]):
+    def get_generated_route(
+        self, trip_indices: np.ndarray
+    ) -> Tuple[Optional[RoutingSolution], float]:
         starting_time = timer()
 
-        routing_stops_distance_matrix = self.pick_routing_stops_distance_matrix(trips)
-        manager = pywrapcp.RoutingIndexManager(
-            len(trips) + 1,
-            self.num_of_shuttles,
-            0,  # the fixed stop index is always the first item in routing_stops_distance_matrix
-        )
-        routing = pywrapcp.RoutingModel(manager)
-
-        def distance_callback(from_index, to_index):
-            """Returns the travel distance between the two nodes."""
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return routing_stops_distance_matrix[from_node][to_node]
-
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-        dimension_name = "Distance"
-        routing.AddDimension(
-            transit_callback_index,
-            0,  # no slack
-            self.max_distance,  # maximum travel time
-            True,  # start cumul at zero
-            dimension_name,
-        )
-        distance_dimension: pywrapcp.RoutingDimension = routing.GetDimensionOrDie(
-            dimension_name
+        # Node n of the routing problem is the trip self.trips[trip_indices[n - 1]]
+        self.routed_indices = np.asarray(trip_indices, dtype=int)
+        problem = self.problem = RoutingProblem(
+            # the fixed stop is always the first item in the distance matrix
+            distance_matrix=self.pick_routing_stops_distance_matrix(
+                self.routed_indices
+            ),
+            max_distance=self.max_distance,
+            num_of_vehicles=self.num_of_shuttles,
+            allow_dropping=self.allow_dropping,
+            node_locations=np.concatenate(
+                (
+                    [self.service_region.fixed_stop],
+                    self.trips.locations[self.routed_indices],
+                )
+            ),
         )
-        distance_dimension.SetGlobalSpanCostCoefficient(50)
-
-        if self.allow_dropping:
-            # Allow to drop nodes.
-            penalty = 1000
-            for node in range(1, len(trips)):
-                routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
-
-        if not self.search_parameters:
-            search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-            search_parameters.first_solution_strategy = (
-                routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-            )
-            search_parameters.local_search_metaheuristic = (
-                routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-            )
-            search_parameters.time_limit.seconds = 30
-            search_parameters.log_search = True
-        else:
-            search_parameters = self.search_parameters
-
-        solution = routing.SolveWithParameters(search_parameters)
+        initial_routes = None
+        if self.config.warm_start and self.previous_route_stops is not None:
+            initial_routes = self.warm_start_routes(problem)
+        solver = self.make_solver()
+        solution = solver.solve(problem, initial_routes)
+        if solution is not None:
+            instrumentation.add_phase_times(solution.phase_times)
+        self.count_solver_events(solver)
 
         elapsed_time = timer() - starting_time
 
-        return manager, routing, solution, elapsed_time
+        return solution, elapsed_time
 
-    def get_dropped_nodes(self, routing, manager, solution) -> List[int]:
-        """Returns a list of IDs for the dropped nodes"""
+    def route_stops(self) -> np.ndarray:
+        """Indices into the stops grid of the stops along the route, fixed stop excluded"""
 
-        dropped_nodes = []
-        for node in range(routing.Size()):
-            if routing.IsStart(node) or routing.IsEnd(node):
-                continue
-            index = manager.IndexToNode(node)
-            if solution.Value(routing.NextVar(index)) == index:
-                dropped_nodes.append(manager.IndexToNode(index))
+        route_nodes = [node for route in self.routes for node in route[1:-1]]
+        route_trips = self.routed_indices[np.asarray(route_nodes, dtype=int) - 1]
+        return self.service_region.none_fixed_stops_indices[
+            self.trips.location_indices[route_trips]
+        ]
 
-        return dropped_nodes
+    def warm_start_routes(self, problem: RoutingProblem) -> Optional[List[List[int]]]:
+        """
+        A starting route for the solver: the trips ordered like the stops nearest to them
+        in the previous cycle's route, kept while the route fits the distance budget.
+        """
 
-    def write_generated_trips(self):
-        output_lines = (
-            "ID, DIRECTION, LOCATION_INDEX, RESERVED_AT, RESERVATION_STATUS\n"
+        if (
+            problem.num_of_vehicles > 1
+            or not len(self.previous_route_stops)
+            or not len(self.routed_indices)
+        ):
+            return None
+
+        trip_stops = self.service_region.none_fixed_stops_indices[
+            self.trips.location_indices[self.routed_indices]
+        ]
+        to_previous_route = self.service_region.distances(
+            trip_stops, self.previous_route_stops
         )
-        for trip in self.trips:
-            output_lines += f"{trip.as_csv_line()}\n"
+        positions = np.argmin(to_previous_route, axis=1)
+        distances = to_previous_route[np.arange(len(trip_stops)), positions]
+        nodes = np.lexsort((distances, positions)) + 1
+
+        distance_matrix = problem.distance_matrix
+        route, route_distance = [0], 0
+        for node in nodes:
+            extended = route_distance + distance_matrix[route[-1], node]
+            if (
+                not problem.allow_dropping
+                or extended + distance_matrix[node, 0] <= problem.max_distance
+            ):
+                route.append(int(node))
+                route_distance = extended
+        route.append(0)
+
+        return [route]
+
+    def make_solver(self) -> AbstractSolver:
+        time_policy = SolverTimePolicy.from_config(self.config)
+        decomposed = self.num_of_shuttles > 1 and self.config.decomposition != "none"
+        if (
+            self.config.solver_portfolio > 1
+            and self.config.solver in (None, OrToolsSolver)
+            and not decomposed
+        ):
+            # Several searches on the whole instance at once, the subproblems of a
+            # decomposition already run concurrently
+            solver = PortfolioSolver(
+                self.search_parameters, time_policy, self.config.solver_portfolio
+            )
+        else:
+            solver = (self.config.solver or OrToolsSolver)(
+                self.search_parameters, time_policy
+            )
+        if decomposed:
+            # One subproblem per shuttle, solved concurrently
+            solver = DecompositionSolver(
+                solver, self.config.decomposition, self.config.cross_route_pass
+            )
+        if self.config.prefilter:
+            solver = PrefilterSolver(solver, self.config.solver_bound_gap)
+        if self.config.solution_cache:
+            solver = CachedSolver(
+                solver,
+                open_cache(self.config.solution_cache, self.config.solution_cache_size),
+            )
+        return solver
 
-        trips_file = self.scenario_directory / "trips.csv"
-        with open(trips_file, mode="w+") as f:
-            f.write(output_lines)
+    def count_solver_events(self, solver: AbstractSolver):
+        for name, n in solver.counters().items():
+            instrumentation.count(name, n)
 
-    def write_results(
+    def record_results(
         self,
-        solution: pywrapcp.SolutionCollector,
-        routing,
-        manager,
+        solution: Optional[RoutingSolution],
         elapsed_time: 0.0,
     ):
-        """Writes the solution to the filesystem."""
-
-        route_points = []
-        results_file = self.scenario_directory / "results.txt"
-        with open(results_file, mode="w+") as f:
-            try:
-                # f.write(f"Objective: {solution.ObjectiveValue()} s\n")
-                f.write(f"Objective: <= {self.config.reservation_cuttoff} minutes\n")
-
-                index = routing.Start(0)
-                route_distance = 0.0
-                while not routing.IsEnd(index):
-                    route_points.append(str(manager.IndexToNode(index)))
-                    previous_index = index
-                    index = solution.Value(routing.NextVar(index))
-                    route_distance += routing.GetArcCostForVehicle(
-                        previous_index, index, 0
-                    )
-                route_points.append(str(manager.IndexToNode(index)))
-                route_time = route_distance / (self.shuttle_speed * SECONDS_PER_MINUTE)
-
-                f.writelines(
-                    [
-                        "Route for Shuttle:\n",
-                        " -> ".join(route_points) + "\n",
-                        f"Route time: {route_time:.2f} minutes\n\n"
-                        f"Elapsed time: {elapsed_time} seconds\n",
-                    ]
-                )
-            except Exception:
-                f.write("Failed to find solution\n")
-                f.writelines(traceback.format_exc())
+        """Keeps the solution for the simulation result."""
+
+        if solution is not None:
+            self.solution = solution
+            self.route = solution.routes[0]
+            self.routes = solution.routes
+            # The cycle ends when the last shuttle is back at the fixed stop
+            longest_route_distance = max(
+                self.problem.route_distance(route) for route in solution.routes
+            )
+            self.route_time = longest_route_distance / (
+                self.shuttle_speed * SECONDS_PER_MINUTE
+            )
+
+    @instrumentation.timed("extract")
+    def assign_reservation_statuses(self, solution: RoutingSolution):
+        """Accepts the routed trips that the solution did not drop, rejects all others"""
 
-        self.draw_graph(route_points)
+        served = np.ones(len(self.routed_indices), dtype=bool)
+        served[np.asarray(solution.dropped_nodes, dtype=int) - 1] = False
+
+        self.trips.statuses[:] = ReservationStatus.REJECTED.value
+        self.trips.statuses[self.routed_indices[served]] = (
+            ReservationStatus.ACCEPTED.value
+        )
+
+    @instrumentation.timed("extract")
+    def build_result(self, elapsed_time: float) -> SimulationResult:
+        """Summarizes the simulation into a compact, picklable result"""
+
+        solution = self.solution
+        nodes = np.full(len(self.trips), -1, dtype=np.int32)
+        nodes[self.routed_indices] = np.arange(1, len(self.routed_indices) + 1)
+        return SimulationResult(
+            simulation_index=self.simulation_index,
+            seed=self.seed,
+            scenario_name=self.scenario_name,
+            cycle=self.cycle,
+            num_of_trips=len(self.trips),
+            num_of_accepted=self.trips.num_of_accepted,
+            route=self.route,
+            routes=self.routes,
+            route_distance=solution.route_distance if solution else 0,
+            route_time=self.route_time,
+            dropped_nodes=solution.dropped_nodes if solution else [],
+            elapsed_time=elapsed_time,
+            time_limit=solution.time_limit if solution else 0.0,
+            num_of_solutions=solution.num_of_solutions if solution else 0,
+            stop_reason=solution.stop_reason if solution else None,
+            num_of_resolves=self.num_of_resolves,
+            warm_started=solution.warm_started if solution else False,
+            trips={
+                **self.trips.columns(nodes),
+                "decision_time": (
+                    self.decision_times
+                    if self.decision_times is not None
+                    else np.full(len(self.trips), np.nan)
+                ),
+            },
+        )
 
     def write_distance_matrix(self):
+        self.scenario_directory.mkdir(parents=True, exist_ok=True)
         distance_matrix_file = self.scenario_directory / "distance_matrix.out"
         with open(distance_matrix_file, "w+") as f:
             np.savetxt(f, self.service_region.stops_distance_matrix)
 
-    def draw_graph(self, route_points: List):
-        route_points_iterator = iter(route_points)
-        prev_point = int(next(route_points_iterator))
+    def generate_trips(self):
+        self.trips = self.next_draw()
 
-        fixed_stop_color, inbound_color, outbound_color = (
-            "#8DB1E2",
-            "#C4D6A0",
-            "#FFC000",
-        )
-        fixed_stop_size, trips_node_size = (3000, 500)
-
-        nodes = [prev_point]
-        next_nodes = []
-        colors = [fixed_stop_color]
-        sizes = [fixed_stop_size]
-        positions = [tuple(self.service_region.fixed_stop)]
-
-        for curr_point in route_points_iterator:
-            curr_point = int(curr_point)
-            if curr_point == 0:
-                continue
-
-            trip = self.trips[curr_point - 1]
-            direction = trip.direction
-            prev_point = curr_point
-
-            nodes.append(curr_point)
-            next_nodes.append(curr_point)
-            colors.append(
-                outbound_color if direction == TripDirection.OUTBOUND else inbound_color
-            )
-            sizes.append(trips_node_size)
-            positions.append(trip.location)
-        next_nodes.append(0)
-
-        nodes_df = pd.DataFrame(
-            {
-                "NODES": nodes,
-                "NEXT_NODES": next_nodes,
-                "POSITIONS": positions,
-                "COLORS": colors,
-                "SIZES": sizes,
-            }
-        )
+    def next_draw(self) -> TripSet:
+        """The new trips of the cycle, drawn once per simulation when they are shared"""
 
-        dropped_trips = filter(
-            lambda x: x.reservation_status == ReservationStatus.REJECTED, self.trips
-        )
-        for trip in dropped_trips:
-            nodes_df.loc[-1] = [
-                int(trip.id),
-                np.nan,
-                tuple(trip.location),
-                outbound_color
-                if direction == TripDirection.OUTBOUND
-                else inbound_color,
-                trips_node_size,
-            ]
-            nodes_df.index += 1
+        if self.shared_draws is None:
+            return self.draw_trips()
+        if len(self.shared_draws.draws) == self.cycle:
+            self.shared_draws.add(self.draw_trips(), self.service_region)
+        else:
+            self.num_of_drawn_trips += len(self.shared_draws.draws[self.cycle])
+        draw = self.shared_draws.draws[self.cycle]
+        # A copy, the scenario sets the statuses of its trips
+        return draw.take(np.arange(len(draw)))
 
-        # graph.draw(pd.concat([accepted_nodes_df, dropped_nodes_df]), self.scenario_directory)
-        graph.draw(nodes_df, self.scenario_directory)
+    @instrumentation.timed("trips")
+    def draw_trips(self) -> TripSet:
+        """Draws all the trips of a cycle at once, numbered after the trips drawn before"""
 
-    def generate_trips(self):
+        num_of_trips = self.trips_density
         # Pick random stops from all other stops, excluding the fixed stop.
-        # These will be used to generate a list of trips
-        random_stops_index = np.random.choice(
+        # These will be used to generate the trips
+        location_indices = self.rng.choice(
             self.service_region.none_fixed_stops.shape[0],
-            self.trips_density,
+            num_of_trips,
             replace=False,
         )
-        for num, stop_index in enumerate(random_stops_index):
-            reservation_time = np.random.randint(
-                self.config.min_reservation_time, self.config.max_reservation_time
-            )
-            stop_position = tuple(self.service_region.none_fixed_stops[stop_index])
+        reserved_at = self.rng.integers(
+            self.config.min_reservation_time,
+            self.config.max_reservation_time,
+            size=num_of_trips,
+        )
+        directions = np.where(
+            self.rng.random(num_of_trips) < self.inbound_or_outbound_px,
+            TripDirection.INBOUND.value,
+            TripDirection.OUTBOUND.value,
+        )
 
-            direction_of_travel = (
-                TripDirection.INBOUND
-                if np.random.random() < self.inbound_or_outbound_px
-                else TripDirection.OUTBOUND
-            )
-            trip = Trip(
-                id=num + 1,
-                reserved_at=reservation_time,
-                direction=direction_of_travel,
-                location_index=stop_index,
-                location=stop_position,
-            )
-            self.trips.append(trip)
+        first_id = self.num_of_drawn_trips + 1
+        self.num_of_drawn_trips += num_of_trips
+        return TripSet(
+            ids=np.arange(first_id, first_id + num_of_trips, dtype=np.int32),
+            reserved_at=reserved_at.astype(np.int32),
+            directions=directions.astype(np.int8),
+            location_indices=location_indices.astype(np.int32),
+            locations=self.service_region.none_fixed_stops[location_indices],
+            statuses=np.full(
+                num_of_trips, ReservationStatus.PENDING.value, dtype=np.int8
+            ),
+        )
 
-    def pick_routing_stops_distance_matrix(self, trips: List[Trip]):
-        trip_location_indices = [trip.location_index for trip in trips]
-        locations = [self.service_region.fixed_stop_index] + trip_location_indices
-        rows = self.service_region.stops_distance_matrix[locations]
-        return rows[:, locations].astype(int)
+    @instrumentation.timed("submatrix")
+    def pick_routing_stops_distance_matrix(self, trip_indices: np.ndarray):
+        if self.shared_draws is not None:
+            nodes = np.concatenate(([0], self.trips.ids[trip_indices]))
+            return self.shared_draws.distance_matrix[np.ix_(nodes, nodes)].astype(int)
+
+        # Trip location indices refer to none_fixed_stops, map them to the stops grid
+        trip_location_indices = self.service_region.none_fixed_stops_indices[
+            self.trips.location_indices[trip_indices]
+        ]
+        locations = np.concatenate(
+            ([self.service_region.fixed_stop_index], trip_location_indices)
+        )
+        # Only the distances between the selected stops are computed
+        return self.service_region.distances(locations, locations).astype(int)
@@ -1,7 +1,15 @@
+from timeit import default_timer as timer
+
+import numpy as np
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from models import ReservationStatus
+
+import instrumentation
+from solvers import InsertionDispatcher, RoutingProblem
 from .base import AbstractScenario
 
+# How ScenarioOne decides the reservations, see ScenarioOne
+DISPATCH_MODES = ("static", "event")
+
 
 class ScenarioZero(AbstractScenario):
     """
@@ -14,36 +22,21 @@ class ScenarioZero(AbstractScenario):
         self.generate_trips()
 
     def run(self):
-        """trips_within_time = [
-            trip for trip in self.trips if trip.reserved_at <= RESERVATION_CUTOFF
-        ]  # ignore all trips above the cutoff time"""
-
-        trips_within_time = {}
-        for index, trip in enumerate(self.trips):
-            if trip.reserved_at < self.config.reservation_cuttoff:
-                trips_within_time[index] = trip
-
-        manager, routing, solution, elapsed_time = self.get_generated_route(
-            list(trips_within_time.values())
+        # ignore all trips above the cutoff time
+        trips_within_time = np.flatnonzero(
+            self.trips.reserved_at < self.config.reservation_cuttoff
         )
-        dropped_nodes = self.get_dropped_nodes(routing, manager, solution)
+
+        solution, elapsed_time = self.get_generated_route(trips_within_time)
 
         if solution:
-            for index, trip in enumerate(self.trips):
-                status = ReservationStatus.REJECTED
-                if (
-                    index in list(trips_within_time.keys())
-                    and index + 1
-                    not in dropped_nodes  # dropped nodes contains the fixed_stop, offset the index by one forward
-                ):
-                    status = ReservationStatus.ACCEPTED
-
-                trip.reservation_status = status
-
-        self.write_generated_trips()
-        self.write_results(solution, routing, manager, elapsed_time)
+            self.assign_reservation_statuses(solution)
+
+        self.record_results(solution, elapsed_time)
         # self.write_distance_matrix()
 
+        return self.build_result(elapsed_time)
+
 
 class ScenarioAllBelowCutoff(ScenarioZero):
     """Accepts all scenarios below zero"""
@@ -64,12 +57,15 @@ class ScenarioAllBelowCutoff(ScenarioZero):
     def run(self):
         self.max_distance = 1_000_000_000
         self.allow_dropping = False
-        super().run()
+        return super().run()
 
 
 class ScenarioOne(AbstractScenario):
     """
     Scenario 1: Short notice riders are considered
+
+    With DISPATCH_MODE=static all the trips are routed in one solve, with
+    DISPATCH_MODE=event they are decided one by one in reservation order.
     """
 
     def init(self):
@@ -77,25 +73,62 @@ class ScenarioOne(AbstractScenario):
         self.generate_trips()
 
     def run(self):
-        all_trips_generated = dict(
-            [(index, trip) for index, trip in enumerate(self.trips)]
-        )
+        if self.config.dispatch_mode == "event":
+            return self.run_event_driven()
+        if self.config.dispatch_mode != "static":
+            raise ValueError(
+                f"Unknown dispatch mode {self.config.dispatch_mode}, expected one of {DISPATCH_MODES}"
+            )
 
-        manager, routing, solution, elapsed_time = self.get_generated_route(
-            list(all_trips_generated.values())
-        )
-        dropped_nodes = self.get_dropped_nodes(routing, manager, solution)
+        all_trips_generated = np.arange(len(self.trips))
 
-        if solution:
-            for index, trip in enumerate(self.trips):
-                status = ReservationStatus.REJECTED
-                if (
-                    index + 1 not in dropped_nodes
-                ):  # dropped nodes contain the fixed_stop, offset the index by one forward
-                    status = ReservationStatus.ACCEPTED
+        solution, elapsed_time = self.get_generated_route(all_trips_generated)
 
-                trip.reservation_status = status
+        if solution:
+            self.assign_reservation_statuses(solution)
 
-        self.write_generated_trips()
-        self.write_results(solution, routing, manager, elapsed_time)
+        self.record_results(solution, elapsed_time)
         # self.write_distance_matrix()
+
+        return self.build_result(elapsed_time)
+
+    def run_event_driven(self):
+        """
+        Decides every reservation when it is made, by insertion into the planned route,
+        see solvers.InsertionDispatcher. The shuttle's position is not simulated, as in
+        the static mode a decision only has to keep the planned route within the budget.
+        """
+
+        if self.num_of_shuttles > 1:
+            raise ValueError("Event-driven dispatch plans a single shuttle's route")
+
+        starting_time = timer()
+
+        # Node n is the n-th reservation in time
+        self.routed_indices = np.argsort(self.trips.reserved_at, kind="stable")
+        problem = self.problem = RoutingProblem(
+            distance_matrix=self.pick_routing_stops_distance_matrix(
+                self.routed_indices
+            ),
+            max_distance=self.max_distance,
+            num_of_vehicles=self.num_of_shuttles,
+        )
+        solver = self.make_solver()
+        dispatcher = InsertionDispatcher(problem, solver, self.config.resolve_every)
+
+        self.decision_times = np.empty(len(self.trips))
+        for node, index in enumerate(self.routed_indices, start=1):
+            decision_started = timer()
+            dispatcher.request(node)
+            self.decision_times[index] = timer() - decision_started
+
+        elapsed_time = timer() - starting_time
+        solution = dispatcher.solution(elapsed_time)
+        instrumentation.add_phase_times(solution.phase_times)
+        self.count_solver_events(solver)
+        self.num_of_resolves = dispatcher.num_of_resolves
+
+        self.assign_reservation_statuses(solution)
+        self.record_results(solution, elapsed_time)
+
+        return self.build_result(elapsed_time)
@@ -0,0 +1,8 @@
+from .base import AbstractSolver, RoutingProblem, RoutingSolution, SolverTimePolicy
+from .cache import CachedSolver, SolutionCache, open_cache
+from .decomposition import DECOMPOSITIONS, DecompositionSolver
+from .dispatch import InsertionDispatcher
+from .heuristic import HeuristicSolver
+from .or_tools import OrToolsSolver
+from .portfolio import PortfolioSolver
+from .prefilter import PrefilterSolver
@@ -0,0 +1,148 @@
+from dataclasses import asdict, dataclass, field
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+@dataclass
+class RoutingProblem:
+    """
+    A routing instance over the fixed stop (node 0) and the trips (nodes 1..n).
+
+    Every vehicle starts and ends at the fixed stop and may travel at most `max_distance`.
+    When `allow_dropping` is set, leaving a trip out of every route costs `drop_penalty`,
+    or its entry of `drop_penalties` (indexed by node) when given; otherwise all trips
+    must be served. The cost of a solution is its total distance plus
+    `span_cost_coefficient` times the longest route distance.
+    """
+
+    distance_matrix: np.ndarray
+    max_distance: int
+    num_of_vehicles: int = 1
+    allow_dropping: bool = True
+    drop_penalty: int = 1000
+    span_cost_coefficient: int = 50
+    drop_penalties: Optional[np.ndarray] = None
+    # Coordinates of the nodes, only needed to decompose the problem
+    node_locations: Optional[np.ndarray] = None
+
+    @property
+    def num_of_nodes(self) -> int:
+        return len(self.distance_matrix)
+
+    @property
+    def node_drop_penalties(self) -> np.ndarray:
+        if self.drop_penalties is not None:
+            return np.asarray(self.drop_penalties, dtype=np.int64)
+        return np.full(self.num_of_nodes, self.drop_penalty, dtype=np.int64)
+
+    def route_distance(self, route: List[int]) -> int:
+        if len(route) < 2:
+            return 0
+        return int(self.distance_matrix[route[:-1], route[1:]].sum())
+
+    def objective(self, routes: List[List[int]], dropped_nodes: List[int]) -> int:
+        distances = [self.route_distance(route) for route in routes]
+        return (
+            sum(distances)
+            + self.span_cost_coefficient * max(distances, default=0)
+            + int(self.node_drop_penalties[list(dropped_nodes)].sum())
+        )
+
+
+@dataclass
+class SolverTimePolicy:
+    """
+    How long a solver may search on an instance with a given number of trips.
+
+    The time limit grows with the number of trips up to `max_time_limit`. The search also
+    stops when the best solution has not improved for `stall_ratio` of the time limit, or
+    after `solution_limit` solutions when it is set.
+    """
+
+    time_limit: float = 0.1
+    time_per_trip: float = 0.05
+    max_time_limit: float = 30
+    stall_ratio: float = 0.1
+    solution_limit: int = 0
+
+    @classmethod
+    def from_config(cls, config) -> "SolverTimePolicy":
+        return cls(
+            time_limit=config.solver_time_limit,
+            time_per_trip=config.solver_time_per_trip,
+            max_time_limit=config.solver_max_time_limit,
+            stall_ratio=config.solver_stall_ratio,
+            solution_limit=config.solver_solution_limit,
+        )
+
+    def time_limit_for(self, num_of_trips: int) -> float:
+        return min(
+            self.max_time_limit, self.time_limit + self.time_per_trip * num_of_trips
+        )
+
+    def stall_time_for(self, num_of_trips: int) -> float:
+        return self.stall_ratio * self.time_limit_for(num_of_trips)
+
+
+@dataclass
+class RoutingSolution:
+    """Routes (fixed stop first and last) per vehicle and the trip nodes left out"""
+
+    routes: List[List[int]]
+    dropped_nodes: List[int] = field(default_factory=list)
+    route_distance: int = 0
+    objective: int = 0
+    elapsed_time: float = 0.0
+    time_limit: float = 0.0
+    num_of_solutions: int = 0
+    stop_reason: str = "completed"
+    warm_started: bool = False
+    # Seconds spent per phase (model, solve, extract), see instrumentation.PHASES
+    phase_times: Dict[str, float] = field(default_factory=dict)
+
+
+class AbstractSolver:
+    """
+    Solves a RoutingProblem.
+
+    search_parameters: OR-Tools search parameters a scenario wants to use instead of the
+    defaults, solvers that are not based on OR-Tools ignore them.
+    time_policy: the time budget of the search.
+    """
+
+    name = "Abstract"
+
+    def __init__(
+        self, search_parameters=None, time_policy: SolverTimePolicy = None
+    ) -> None:
+        self.search_parameters = search_parameters
+        self.time_policy = time_policy or SolverTimePolicy()
+
+    def solve(
+        self,
+        problem: RoutingProblem,
+        initial_routes: Optional[List[List[int]]] = None,
+    ) -> Optional[RoutingSolution]:
+        """
+        Returns the best solution found, or None when the problem is infeasible.
+
+        initial_routes: routes (fixed stop first and last) to start the search from, nodes
+        left out of them are dropped. Ignored when they are not a feasible solution.
+        """
+        ...
+
+    def counters(self) -> Dict[str, int]:
+        """Events counted since the solver was built, e.g. solution cache hits"""
+        return {}
+
+    def settings_key(self) -> str:
+        """Identifies the solver and the settings its solutions depend on"""
+
+        search_parameters = (
+            self.search_parameters.SerializeToString().hex()
+            if self.search_parameters is not None
+            else None
+        )
+        return json.dumps([self.name, asdict(self.time_policy), search_parameters])
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import time
+from timeit import default_timer as timer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .base import AbstractSolver, RoutingProblem, RoutingSolution
+from .prefilter import proves_infeasible
+
+# Entries are evicted in batches, so that not every insert pays for an eviction
+EVICTION_BATCH = 0.05
+BUSY_TIMEOUT = 60
+
+
+def canonical_order(problem: RoutingProblem) -> np.ndarray:
+    """
+    The nodes of the problem in canonical order, the fixed stop first and the trips
+    sorted by location. Without locations the trips keep their order.
+    """
+
+    if problem.node_locations is None:
+        return np.arange(problem.num_of_nodes)
+    locations = np.asarray(problem.node_locations)[1:]
+    return np.concatenate(([0], np.lexsort(locations.T[::-1]) + 1))
+
+
+def instance_key(problem: RoutingProblem, order: np.ndarray, solver_key: str) -> str:
+    """
+    Hash of the instance in canonical order: its distances, which follow from the trip
+    locations and the region geometry, the distance limit, the drop policy and the solver
+    settings. Instances with the same key have the same solutions.
+    """
+
+    distance_matrix = np.asarray(problem.distance_matrix, dtype=np.int64)
+    digest = hashlib.sha256()
+    digest.update(np.asarray(distance_matrix.shape, np.int64).tobytes())
+    digest.update(distance_matrix[np.ix_(order, order)].tobytes())
+    if problem.allow_dropping:
+        digest.update(problem.node_drop_penalties[order].tobytes())
+    digest.update(
+        json.dumps(
+            [
+                problem.max_distance,
+                problem.num_of_vehicles,
+                problem.allow_dropping,
+                problem.span_cost_coefficient,
+                solver_key,
+            ]
+        ).encode()
+    )
+    return digest.hexdigest()
+
+
+class SolutionCache:
+    """
+    Solutions by instance key in an SQLite database, shared by the workers of a run and
+    by later runs. When it holds more than `max_entries` solutions, the least recently
+    used ones are evicted.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 100_000) -> None:
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.pid = None
+        self.connection: Optional[sqlite3.Connection] = None
+
+    def connect(self) -> sqlite3.Connection:
+        # A connection must not be shared with forked workers
+        if self.connection is None or self.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(
+                self.path, timeout=BUSY_TIMEOUT, isolation_level=None
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS solutions"
+                " (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS solutions_last_used"
+                " ON solutions (last_used)"
+            )
+            self.pid = os.getpid()
+        return self.connection
+
+    def get(self, key: str) -> Optional[Dict]:
+        """The cached value of the key, marked as used now. Processes share the clock"""
+
+        connection = self.connect()
+        row = connection.execute(
+            "SELECT value FROM solutions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            "UPDATE solutions SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict) -> None:
+        connection = self.connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time()),
+        )
+        (num_of_entries,) = connection.execute(
+            "SELECT COUNT(*) FROM solutions"
+        ).fetchone()
+        if num_of_entries > self.max_entries:
+            self.evict(num_of_entries - self.max_entries)
+
+    def evict(self, num_of_entries: int) -> None:
+        num_of_entries += int(self.max_entries * EVICTION_BATCH)
+        self.connect().execute(
+            "DELETE FROM solutions WHERE key IN"
+            " (SELECT key FROM solutions ORDER BY last_used LIMIT ?)",
+            (num_of_entries,),
+        )
+
+    def __len__(self) -> int:
+        return self.connect().execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+
+# Caches already opened in this process, by path
+_caches: Dict[str, SolutionCache] = {}
+
+
+def open_cache(path: Path, max_entries: int) -> SolutionCache:
+    key = str(Path(path).resolve())
+    if key not in _caches:
+        _caches[key] = SolutionCache(path, max_entries)
+    _caches[key].max_entries = max_entries
+    return _caches[key]
+
+
+class CachedSolver(AbstractSolver):
+    """
+    Looks a problem up in `cache` before solving it with `solver`, and stores the
+    solutions it computes. Routes are stored in canonical node order and mapped back to
+    the nodes of the problem, so an instance with the same trip locations in another
+    order is a hit. Solves from initial routes are never cached, their result depends on
+    the routes.
+
+    A problem without a solution is only cached when `proves_infeasible` settles it, the
+    search may also have run out of time before finding one.
+    """
+
+    name = "Cached"
+
+    def __init__(self, solver: AbstractSolver, cache: SolutionCache) -> None:
+        super().__init__(solver.search_parameters, solver.time_policy)
+        self.solver = solver
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def settings_key(self) -> str:
+        return self.solver.settings_key()
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            **self.solver.counters(),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+        }
+
+    def solve(
+        self,
+        problem: RoutingProblem,
+        initial_routes: Optional[List[List[int]]] = None,
+    ) -> Optional[RoutingSolution]:
+        if initial_routes:
+            return self.solver.solve(problem, initial_routes)
+
+        starting_time = timer()
+        order = canonical_order(problem)
+        key = instance_key(problem, order, self.settings_key())
+        value = self.cache.get(key)
+        if value is not None:
+            self.hits += 1
+            return self.from_value(value, order, timer() - starting_time)
+
+        self.misses += 1
+        lookup_time = timer() - starting_time
+        solution = self.solver.solve(problem)
+
+        if solution is None:
+            if proves_infeasible(problem):
+                self.cache.put(key, self.to_value(solution, order))
+            return None
+
+        starting_time = timer()
+        self.cache.put(key, self.to_value(solution, order))
+        solution.phase_times["cache"] = lookup_time + timer() - starting_time
+        return solution
+
+    @staticmethod
+    def to_value(solution: Optional[RoutingSolution], order: np.ndarray) -> Dict:
+        if solution is None:
+            return {"feasible": False}
+
+        positions = np.empty_like(order)
+        positions[order] = np.arange(len(order))
+        return {
+            "feasible": True,
+            "routes": [positions[route].tolist() for route in solution.routes],
+            "dropped_nodes": sorted(positions[solution.dropped_nodes].tolist()),
+            "route_distance": solution.route_distance,
+            "objective": solution.objective,
+            "time_limit": solution.time_limit,
+            "stop_reason": solution.stop_reason,
+        }
+
+    @staticmethod
+    def from_value(
+        value: Dict, order: np.ndarray, elapsed_time: float
+    ) -> Optional[RoutingSolution]:
+        if not value["feasible"]:
+            return None
+
+        return RoutingSolution(
+            routes=[order[route].tolist() for route in value["routes"]],
+            dropped_nodes=sorted(order[value["dropped_nodes"]].tolist()),
+            route_distance=value["route_distance"],
+            objective=value["objective"],
+            elapsed_time=elapsed_time,
+            time_limit=value["time_limit"],
+            stop_reason="cache",
+            phase_times={"cache": elapsed_time},
+        )
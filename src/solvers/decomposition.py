@@ -0,0 +1,269 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+import json
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .base import AbstractSolver, RoutingProblem, RoutingSolution
+from .heuristic import insert_nodes, insertion_costs, or_opt, two_opt
+
+DECOMPOSITIONS = ("none", "sector", "cluster")
+KMEANS_ITERATIONS = 50
+
+
+def sector_partition(locations: np.ndarray, num_of_parts: int) -> np.ndarray:
+    """
+    Splits the trips (rows 1.. of `locations`, row 0 is the fixed stop) into sectors
+    around the fixed stop holding equal numbers of trips. Returns the part of every trip.
+    """
+
+    offsets = locations[1:] - locations[0]
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+    order = np.argsort(angles, kind="stable")
+    parts = np.empty(len(order), dtype=int)
+    parts[order] = np.arange(len(order)) * num_of_parts // max(len(order), 1)
+    return parts
+
+
+def cluster_partition(
+    locations: np.ndarray, num_of_parts: int, seed: int = 0
+) -> np.ndarray:
+    """Clusters the trips (rows 1.. of `locations`) with k-means, returns their cluster"""
+
+    points = locations[1:]
+    num_of_parts = min(num_of_parts, len(points))
+    if num_of_parts <= 1:
+        return np.zeros(len(points), dtype=int)
+
+    # k-means++ initialization
+    rng = np.random.default_rng(seed)
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, num_of_parts):
+        squared = ((points[:, None] - np.array(centers)[None]) ** 2).sum(-1).min(1)
+        centers.append(points[rng.choice(len(points), p=squared / squared.sum())])
+    centers = np.array(centers)
+
+    parts = None
+    for _ in range(KMEANS_ITERATIONS):
+        squared = ((points[:, None] - centers[None]) ** 2).sum(-1)
+        new_parts = np.argmin(squared, axis=1)
+        if parts is not None and np.array_equal(new_parts, parts):
+            break
+        parts = new_parts
+        for part in range(num_of_parts):
+            members = points[parts == part]
+            if len(members):
+                centers[part] = members.mean(axis=0)
+
+    return parts
+
+
+def relocate_nodes(
+    problem: RoutingProblem, routes: List[List[int]], max_moves: int
+) -> bool:
+    """
+    Moves trips between routes while a move lowers the objective, best move first.
+    Returns whether any trip was moved.
+    """
+
+    distance_matrix = problem.distance_matrix
+    moved = False
+    for _ in range(max_moves):
+        distances = np.array([problem.route_distance(route) for route in routes])
+        best = None
+
+        for source, route in enumerate(routes):
+            if len(route) <= 2:
+                continue
+            points = np.asarray(route)
+            previous, nodes, following = points[:-2], points[1:-1], points[2:]
+            removal_gains = (
+                distance_matrix[previous, nodes]
+                + distance_matrix[nodes, following]
+                - distance_matrix[previous, following]
+            )
+
+            for target, target_route in enumerate(routes):
+                if target == source:
+                    continue
+                costs = insertion_costs(distance_matrix, target_route, nodes)
+                edges = np.argmin(costs, axis=0)
+                costs = costs[edges, np.arange(len(nodes))]
+
+                new_distances = np.repeat(distances[None, :], len(nodes), axis=0)
+                new_distances[:, source] -= removal_gains
+                new_distances[:, target] += costs
+                deltas = (
+                    costs.astype(float)
+                    - removal_gains
+                    + problem.span_cost_coefficient
+                    * (new_distances.max(axis=1) - distances.max())
+                )
+                deltas[new_distances[:, target] > problem.max_distance] = np.inf
+
+                node = int(np.argmin(deltas))
+                if deltas[node] < 0 and (best is None or deltas[node] < best[0]):
+                    best = (deltas[node], source, node, target, int(edges[node]))
+
+        if best is None:
+            break
+
+        _, source, node, target, edge = best
+        routes[target].insert(edge + 1, routes[source].pop(node + 1))
+        moved = True
+
+    return moved
+
+
+class DecompositionSolver(AbstractSolver):
+    """
+    Solves a fleet problem as one single-vehicle subproblem per shuttle.
+
+    The trips are partitioned by sector around the fixed stop or by k-means clustering of
+    their locations (`problem.node_locations`), and the subproblems are solved
+    concurrently by `solver`. The cross-route pass then moves trips between routes and
+    inserts dropped trips where that lowers the objective.
+    """
+
+    name = "Decomposition"
+
+    def __init__(
+        self,
+        solver: AbstractSolver,
+        decomposition: str = "cluster",
+        cross_route_pass: bool = True,
+        max_workers: int = None,
+    ) -> None:
+        if decomposition not in DECOMPOSITIONS[1:]:
+            raise ValueError(
+                f"Unknown decomposition {decomposition}, expected one of {DECOMPOSITIONS[1:]}"
+            )
+        super().__init__(solver.search_parameters, solver.time_policy)
+        self.solver = solver
+        self.decomposition = decomposition
+        self.cross_route_pass = cross_route_pass
+        self.max_workers = max_workers
+
+    def settings_key(self) -> str:
+        return json.dumps(
+            [
+                self.name,
+                self.decomposition,
+                self.cross_route_pass,
+                self.solver.settings_key(),
+            ]
+        )
+
+    def counters(self) -> Dict[str, int]:
+        return self.solver.counters()
+
+    def partition(self, problem: RoutingProblem) -> List[np.ndarray]:
+        """The trip nodes of every subproblem"""
+
+        if self.decomposition == "sector":
+            parts = sector_partition(problem.node_locations, problem.num_of_vehicles)
+        else:
+            parts = cluster_partition(problem.node_locations, problem.num_of_vehicles)
+        nodes = np.arange(1, problem.num_of_nodes)
+        return [nodes[parts == part] for part in range(problem.num_of_vehicles)]
+
+    def subproblem(self, problem: RoutingProblem, nodes: np.ndarray) -> RoutingProblem:
+        subset = np.concatenate(([0], nodes))
+        return replace(
+            problem,
+            distance_matrix=problem.distance_matrix[np.ix_(subset, subset)],
+            num_of_vehicles=1,
+            drop_penalties=(
+                problem.node_drop_penalties[subset] if problem.allow_dropping else None
+            ),
+            node_locations=None,
+        )
+
+    def solve_part(self, problem: RoutingProblem, nodes: np.ndarray):
+        """
+        Returns the route and dropped nodes of a part, in nodes of the full problem, the
+        number of solutions and the phase times
+        """
+
+        if not nodes.size:
+            return [0, 0], [], 0, {}
+        starting_time = timer()
+        subproblem = self.subproblem(problem, nodes)
+        submatrix_time = timer() - starting_time
+        solution = self.solver.solve(subproblem)
+        if solution is None:
+            return None
+
+        subset = np.concatenate(([0], nodes))
+        return (
+            [int(node) for node in subset[solution.routes[0]]],
+            [int(subset[node]) for node in solution.dropped_nodes],
+            solution.num_of_solutions,
+            {"submatrix": submatrix_time, **solution.phase_times},
+        )
+
+    def solve(
+        self,
+        problem: RoutingProblem,
+        initial_routes: Optional[List[List[int]]] = None,
+    ) -> Optional[RoutingSolution]:
+        starting_time = timer()
+
+        problem = replace(
+            problem, distance_matrix=np.asarray(problem.distance_matrix, np.int64)
+        )
+        parts = self.partition(problem)
+        with ThreadPoolExecutor(self.max_workers or len(parts)) as executor:
+            solved = list(
+                executor.map(lambda nodes: self.solve_part(problem, nodes), parts)
+            )
+        if any(part is None for part in solved):
+            return None
+
+        routes = [route for route, _, _, _ in solved]
+        dropped = np.array(
+            sorted(node for _, dropped, _, _ in solved for node in dropped), dtype=int
+        )
+        # Thread seconds of the subproblems
+        phase_times = {}
+        for *_, part_phase_times in solved:
+            for name, seconds in part_phase_times.items():
+                phase_times[name] = phase_times.get(name, 0.0) + seconds
+
+        if self.cross_route_pass:
+            improving_time = timer()
+            routes, dropped = self.improve(problem, routes, dropped)
+            phase_times["solve"] = (
+                phase_times.get("solve", 0.0) + timer() - improving_time
+            )
+
+        dropped_nodes = [int(node) for node in dropped]
+        return RoutingSolution(
+            routes=routes,
+            dropped_nodes=dropped_nodes,
+            route_distance=sum(problem.route_distance(route) for route in routes),
+            objective=problem.objective(routes, dropped_nodes),
+            elapsed_time=timer() - starting_time,
+            time_limit=max(
+                self.time_policy.time_limit_for(len(part)) for part in parts
+            ),
+            num_of_solutions=sum(
+                num_of_solutions for _, _, num_of_solutions, _ in solved
+            ),
+            phase_times=phase_times,
+        )
+
+    def improve(
+        self, problem: RoutingProblem, routes: List[List[int]], dropped: np.ndarray
+    ) -> Tuple[List[List[int]], np.ndarray]:
+        """Relocates trips across routes, then reinserts the dropped trips that fit"""
+
+        if relocate_nodes(problem, routes, max_moves=problem.num_of_nodes):
+            for route in routes:
+                two_opt(problem.distance_matrix, route)
+                or_opt(problem.distance_matrix, route)
+        if dropped.size:
+            routes, dropped = insert_nodes(problem, routes, dropped)
+        return routes, np.sort(dropped)
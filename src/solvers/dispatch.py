@@ -0,0 +1,133 @@
+from dataclasses import replace
+from timeit import default_timer as timer
+from typing import List
+
+import numpy as np
+
+from .base import AbstractSolver, RoutingProblem, RoutingSolution
+from .heuristic import insertion_costs
+
+# Drop penalties of the re-solves: dropping an accepted node is never worth it, dropping the
+# requested node only when it cannot be served
+ACCEPTED_DROP_PENALTY = 10**9
+REQUESTED_DROP_PENALTY = 10**6
+
+
+class InsertionDispatcher:
+    """
+    Decides reservations one at a time against a single planned route, as they arrive.
+
+    A reservation is accepted when the cheapest insertion of its node keeps the route
+    within the distance budget. When it does not fit, the accepted nodes and the new one
+    are re-solved with `solver`, and the reservation is accepted if the new route serves
+    them all. Every `resolve_every` acceptances the route is also re-solved to shorten it,
+    which leaves room for later insertions. Accepted reservations are never dropped.
+    """
+
+    def __init__(
+        self,
+        problem: RoutingProblem,
+        solver: AbstractSolver,
+        resolve_every: int = 0,
+    ) -> None:
+        self.problem = replace(
+            problem, distance_matrix=np.asarray(problem.distance_matrix, np.int64)
+        )
+        self.solver = solver
+        self.resolve_every = resolve_every
+
+        self.route: List[int] = [0, 0]
+        self.route_distance = 0
+        self.accepted: List[int] = []
+        self.rejected: List[int] = []
+        self.num_of_resolves = 0
+        self.num_of_solutions = 0
+        self.solver_time = 0.0
+        self.phase_times = {}
+
+    def request(self, node: int) -> bool:
+        """Decides the reservation of a node, returns whether it was accepted"""
+
+        distance_matrix = self.problem.distance_matrix
+        max_distance = self.problem.max_distance
+
+        # Not even a round trip to the node fits in the budget
+        if distance_matrix[0, node] + distance_matrix[node, 0] > max_distance:
+            accepted = False
+        else:
+            accepted = self.insert(node) or self.resolve(self.accepted, node)
+
+        if not accepted:
+            self.rejected.append(node)
+            return False
+
+        self.accepted.append(node)
+        if self.resolve_every and len(self.accepted) % self.resolve_every == 0:
+            self.resolve(self.accepted)
+        return True
+
+    def insert(self, node: int) -> bool:
+        costs = insertion_costs(self.problem.distance_matrix, self.route, [node])[:, 0]
+        edge = int(np.argmin(costs))
+        if self.route_distance + costs[edge] > self.problem.max_distance:
+            return False
+
+        self.route.insert(edge + 1, node)
+        self.route_distance += int(costs[edge])
+        return True
+
+    def resolve(self, nodes: List[int], requested_node: int = None) -> bool:
+        """
+        Solves the route through the accepted nodes and the requested one, if any. The new
+        route is kept if it serves the requested node or is shorter, returns whether it
+        serves all the nodes.
+        """
+
+        self.num_of_resolves += 1
+        starting_time = timer()
+
+        subset = np.array(
+            [0] + nodes + ([requested_node] if requested_node is not None else [])
+        )
+        drop_penalties = np.full(len(subset), ACCEPTED_DROP_PENALTY)
+        if requested_node is not None:
+            drop_penalties[-1] = REQUESTED_DROP_PENALTY
+        problem = replace(
+            self.problem,
+            distance_matrix=self.problem.distance_matrix[np.ix_(subset, subset)],
+            num_of_vehicles=1,
+            allow_dropping=True,
+            drop_penalties=drop_penalties,
+        )
+        solution = self.solver.solve(problem)
+
+        self.solver_time += timer() - starting_time
+        # Accepted nodes may only be dropped by a solver that could not route them
+        if solution is not None:
+            for name, seconds in solution.phase_times.items():
+                self.phase_times[name] = self.phase_times.get(name, 0.0) + seconds
+        if solution is None or solution.dropped_nodes:
+            return False
+        self.num_of_solutions += solution.num_of_solutions
+
+        route = [int(node) for node in subset[solution.routes[0]]]
+        route_distance = self.problem.route_distance(route)
+        if route_distance > self.problem.max_distance:
+            return False
+
+        if requested_node is not None or route_distance < self.route_distance:
+            self.route, self.route_distance = route, route_distance
+        return True
+
+    def solution(self, elapsed_time: float = 0.0) -> RoutingSolution:
+        dropped_nodes = sorted(self.rejected)
+        return RoutingSolution(
+            routes=[self.route],
+            dropped_nodes=dropped_nodes,
+            route_distance=self.route_distance,
+            objective=self.problem.objective([self.route], dropped_nodes),
+            elapsed_time=elapsed_time,
+            num_of_solutions=self.num_of_solutions,
+            stop_reason="dispatch",
+            phase_times=self.phase_times,
+        )
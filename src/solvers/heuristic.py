@@ -0,0 +1,293 @@
+from dataclasses import replace
+from timeit import default_timer as timer
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .base import AbstractSolver, RoutingProblem, RoutingSolution
+
+MAX_IMPROVEMENT_ROUNDS = 1_000
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+
+
+def insertion_costs(distance_matrix: np.ndarray, route: List[int], nodes: np.ndarray):
+    """Returns the extra distance of inserting every node on every edge of the route (edges x nodes)"""
+
+    route = np.asarray(route)
+    edge_starts, edge_ends = route[:-1], route[1:]
+    return (
+        distance_matrix[np.ix_(edge_starts, nodes)]
+        + distance_matrix[np.ix_(nodes, edge_ends)].T
+        - distance_matrix[edge_starts, edge_ends][:, None]
+    )
+
+
+def insert_nodes(
+    problem: RoutingProblem, routes: List[List[int]], nodes: np.ndarray
+) -> Tuple[List[List[int]], np.ndarray]:
+    """
+    Cheapest insertion: repeatedly inserts the node with the lowest extra distance, as long
+    as the route stays within the distance budget and serving the node costs less than
+    dropping it. Returns the routes and the nodes that were not inserted.
+    """
+
+    distance_matrix = problem.distance_matrix
+    distances = [problem.route_distance(route) for route in routes]
+    # Extending a route adds its distance to both the arc costs and the span cost
+    cost_per_distance = 1 + problem.span_cost_coefficient
+
+    nodes = np.asarray(nodes, dtype=int)
+    drop_penalties = problem.node_drop_penalties
+    while nodes.size:
+        best = None
+        for vehicle, route in enumerate(routes):
+            costs = insertion_costs(distance_matrix, route, nodes)
+            costs = np.where(
+                distances[vehicle] + costs <= problem.max_distance, costs, np.inf
+            )
+            if problem.allow_dropping:
+                costs[costs * cost_per_distance >= drop_penalties[nodes]] = np.inf
+
+            edge, node = np.unravel_index(np.argmin(costs), costs.shape)
+            if np.isfinite(costs[edge, node]) and (
+                best is None or costs[edge, node] < best[0]
+            ):
+                best = (costs[edge, node], vehicle, edge, node)
+
+        if best is None:
+            break
+
+        cost, vehicle, edge, node = best
+        routes[vehicle].insert(edge + 1, int(nodes[node]))
+        distances[vehicle] += int(cost)
+        nodes = np.delete(nodes, node)
+
+    return routes, nodes
+
+
+def remove_nodes(problem: RoutingProblem, route: List[int]) -> List[int]:
+    """
+    Removes the trips saving the most distance from the route until it fits the distance
+    budget. Returns the removed nodes.
+    """
+
+    distance_matrix = problem.distance_matrix
+    removed = []
+    while len(route) > 2 and problem.route_distance(route) > problem.max_distance:
+        points = np.asarray(route)
+        previous, nodes, following = points[:-2], points[1:-1], points[2:]
+        savings = (
+            distance_matrix[previous, nodes]
+            + distance_matrix[nodes, following]
+            - distance_matrix[previous, following]
+        )
+        removed.append(route.pop(int(np.argmax(savings)) + 1))
+
+    return removed
+
+
+def two_opt(distance_matrix: np.ndarray, route: List[int]) -> bool:
+    """Applies the best segment reversal while it shortens the route"""
+
+    improved = False
+    for _ in range(MAX_IMPROVEMENT_ROUNDS):
+        points = np.asarray(route)
+        edge_starts, edge_ends = points[:-1], points[1:]
+        if len(edge_starts) < 3:
+            break
+
+        # gains[i, j]: replace edges i and j by (start_i, start_j) and (end_i, end_j)
+        edge_lengths = distance_matrix[edge_starts, edge_ends]
+        gains = (
+            edge_lengths[:, None]
+            + edge_lengths[None, :]
+            - distance_matrix[np.ix_(edge_starts, edge_starts)]
+            - distance_matrix[np.ix_(edge_ends, edge_ends)]
+        )
+        gains = np.triu(gains, k=2)
+        i, j = np.unravel_index(np.argmax(gains), gains.shape)
+        if gains[i, j] <= 0:
+            break
+
+        candidate = route[: i + 1] + route[i + 1 : j + 1][::-1] + route[j + 1 :]
+        # The gain assumes symmetric distances, check it on the actual matrix
+        if route_distance(distance_matrix, candidate) >= route_distance(
+            distance_matrix, route
+        ):
+            break
+        route[:] = candidate
+        improved = True
+
+    return improved
+
+
+def or_opt(distance_matrix: np.ndarray, route: List[int]) -> bool:
+    """Applies the best move of a segment of 1 to 3 trips to another position of the route"""
+
+    improved = False
+    for _ in range(MAX_IMPROVEMENT_ROUNDS):
+        points = np.asarray(route)
+        edge_starts, edge_ends = points[:-1], points[1:]
+        num_of_edges = len(edge_starts)
+        best = None
+
+        for length in OR_OPT_SEGMENT_LENGTHS:
+            # Segments route[s:s + length], never moving the fixed stop at both ends
+            starts = np.arange(1, len(route) - length)
+            if not starts.size:
+                continue
+            firsts, lasts = points[starts], points[starts + length - 1]
+            previous, following = points[starts - 1], points[starts + length]
+            removal_gains = (
+                distance_matrix[previous, firsts]
+                + distance_matrix[lasts, following]
+                - distance_matrix[previous, following]
+            )
+            insertion = (
+                distance_matrix[np.ix_(firsts, edge_starts)]
+                + distance_matrix[np.ix_(lasts, edge_ends)]
+                - distance_matrix[edge_starts, edge_ends][None, :]
+            )
+            # Edges s - 1 .. s + length - 1 touch the segment itself
+            edges = np.arange(num_of_edges)[None, :]
+            touching = (edges >= starts[:, None] - 1) & (
+                edges <= starts[:, None] + length - 1
+            )
+            deltas = np.where(touching, np.inf, insertion - removal_gains[:, None])
+
+            segment, edge = np.unravel_index(np.argmin(deltas), deltas.shape)
+            if deltas[segment, edge] < 0 and (
+                best is None or deltas[segment, edge] < best[0]
+            ):
+                best = (deltas[segment, edge], int(starts[segment]), length, int(edge))
+
+        if best is None:
+            break
+
+        _, start, length, edge = best
+        moved = route[start : start + length]
+        rest = route[:start] + route[start + length :]
+        position = edge + 1 if edge < start else edge + 1 - length
+        route[:] = rest[:position] + moved + rest[position:]
+        improved = True
+
+    return improved
+
+
+def route_distance(distance_matrix: np.ndarray, route: List[int]) -> int:
+    return int(distance_matrix[route[:-1], route[1:]].sum())
+
+
+class HeuristicSolver(AbstractSolver):
+    """
+    Fast in-process solver for screening sweeps: cheapest insertion followed by 2-opt and
+    Or-opt improvements, vectorized with NumPy. It honours the same distance budget and
+    drop penalty as the OR-Tools model, but gives no optimality guarantee.
+    """
+
+    name = "Heuristic"
+
+    def solve(
+        self,
+        problem: RoutingProblem,
+        initial_routes: Optional[List[List[int]]] = None,
+    ) -> Optional[RoutingSolution]:
+        starting_time = timer()
+
+        distance_matrix = np.asarray(problem.distance_matrix, dtype=np.int64)
+        problem = replace(problem, distance_matrix=distance_matrix)
+
+        candidates = [self.insertion_first(problem)]
+        if problem.allow_dropping and problem.num_of_vehicles == 1:
+            candidates.append(self.route_first(problem))
+        if initial_routes:
+            candidates.append(self.from_routes(problem, initial_routes))
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        if not candidates:
+            return None
+
+        routes, unrouted = min(
+            candidates, key=lambda candidate: problem.objective(*candidate)
+        )
+
+        dropped_nodes = sorted(int(node) for node in unrouted)
+        elapsed_time = timer() - starting_time
+        return RoutingSolution(
+            routes=routes,
+            dropped_nodes=dropped_nodes,
+            route_distance=sum(problem.route_distance(route) for route in routes),
+            objective=problem.objective(routes, dropped_nodes),
+            elapsed_time=elapsed_time,
+            # The given routes are one of the starting points
+            warm_started=bool(initial_routes),
+            phase_times={"solve": elapsed_time},
+        )
+
+    def improve(
+        self, problem: RoutingProblem, routes: List[List[int]], unrouted: np.ndarray
+    ) -> Tuple[List[List[int]], np.ndarray]:
+        """Shortens the routes, then inserts the nodes that now fit in the budget"""
+
+        while True:
+            improved = False
+            for route in routes:
+                improved |= two_opt(problem.distance_matrix, route)
+                improved |= or_opt(problem.distance_matrix, route)
+            if not (improved and unrouted.size):
+                break
+            routes, remaining = insert_nodes(problem, routes, unrouted)
+            if remaining.size == unrouted.size:
+                break
+            unrouted = remaining
+
+        return routes, unrouted
+
+    def insertion_first(self, problem: RoutingProblem):
+        """Builds the routes by cheapest insertion within the budget"""
+
+        routes = [[0, 0] for _ in range(problem.num_of_vehicles)]
+        routes, unrouted = insert_nodes(
+            problem, routes, np.arange(1, problem.num_of_nodes)
+        )
+        routes, unrouted = self.improve(problem, routes, unrouted)
+
+        if not problem.allow_dropping and unrouted.size:
+            return None
+        return routes, [int(node) for node in unrouted]
+
+    def from_routes(self, problem: RoutingProblem, initial_routes: List[List[int]]):
+        """Improves the given routes and inserts the nodes left out of them"""
+
+        if any(
+            problem.route_distance(route) > problem.max_distance
+            for route in initial_routes
+        ):
+            return None
+
+        routes = [list(route) for route in initial_routes]
+        unrouted = np.setdiff1d(
+            np.arange(1, problem.num_of_nodes), np.concatenate(routes)
+        )
+        routes, unrouted = insert_nodes(problem, routes, unrouted)
+        routes, unrouted = self.improve(problem, routes, unrouted)
+
+        if not problem.allow_dropping and unrouted.size:
+            return None
+        return routes, [int(node) for node in unrouted]
+
+    def route_first(self, problem: RoutingProblem):
+        """Builds a tour through every trip ignoring the budget, then removes trips until it fits"""
+
+        unbounded = replace(problem, max_distance=np.iinfo(np.int64).max)
+        routes, _ = insert_nodes(
+            replace(unbounded, allow_dropping=False),
+            [[0, 0]],
+            np.arange(1, problem.num_of_nodes),
+        )
+        routes, _ = self.improve(unbounded, routes, np.empty(0, dtype=int))
+
+        removed = remove_nodes(problem, routes[0])
+        routes, unrouted = self.improve(problem, routes, np.array(removed, dtype=int))
+        # Removing trips may make others worth dropping under the penalty, or leave room
+        routes, unrouted = insert_nodes(problem, routes, unrouted)
+        return routes, [int(node) for node in unrouted]
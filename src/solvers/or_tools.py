@@ -0,0 +1,183 @@
+from timeit import default_timer as timer
+from typing import List, Optional
+
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+from .base import AbstractSolver, RoutingProblem, RoutingSolution
+
+
+class OrToolsSolver(AbstractSolver):
+    """Solves the problem with the OR-Tools routing library and guided local search"""
+
+    name = "OrTools"
+
+    def default_search_parameters(self):
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.first_solution_strategy = (
+            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        )
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        )
+        search_parameters.time_limit.FromMilliseconds(
+            int(self.time_policy.max_time_limit * 1000)
+        )
+        search_parameters.log_search = True
+        return search_parameters
+
+    def build_model(self, problem: RoutingProblem):
+        manager = pywrapcp.RoutingIndexManager(
+            problem.num_of_nodes,
+            problem.num_of_vehicles,
+            0,  # the fixed stop index is always the first item in the distance matrix
+        )
+        routing = pywrapcp.RoutingModel(manager)
+
+        # Register the distances as a native matrix, the solver then evaluates arcs in
+        # C++ without calling back into Python
+        transit_callback_index = routing.RegisterTransitMatrix(
+            problem.distance_matrix.tolist()
+        )
+        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+        dimension_name = "Distance"
+        routing.AddDimension(
+            transit_callback_index,
+            0,  # no slack
+            problem.max_distance,  # maximum travel time
+            True,  # start cumul at zero
+            dimension_name,
+        )
+        distance_dimension: pywrapcp.RoutingDimension = routing.GetDimensionOrDie(
+            dimension_name
+        )
+        distance_dimension.SetGlobalSpanCostCoefficient(problem.span_cost_coefficient)
+
+        if problem.allow_dropping:
+            # Allow to drop nodes.
+            drop_penalties = problem.node_drop_penalties
+            for node in range(1, problem.num_of_nodes):
+                routing.AddDisjunction(
+                    [manager.NodeToIndex(node)], int(drop_penalties[node])
+                )
+
+        return manager, routing
+
+    def read_solution(
+        self, problem: RoutingProblem, manager, routing, solution
+    ) -> RoutingSolution:
+        routes = []
+        for vehicle in range(problem.num_of_vehicles):
+            index = routing.Start(vehicle)
+            route = [manager.IndexToNode(index)]
+            while not routing.IsEnd(index):
+                index = solution.Value(routing.NextVar(index))
+                route.append(manager.IndexToNode(index))
+            routes.append(route)
+
+        dropped_nodes = []
+        for index in range(routing.Size()):
+            if routing.IsStart(index) or routing.IsEnd(index):
+                continue
+            if solution.Value(routing.NextVar(index)) == index:
+                dropped_nodes.append(manager.IndexToNode(index))
+
+        return RoutingSolution(
+            routes=routes,
+            dropped_nodes=dropped_nodes,
+            route_distance=sum(problem.route_distance(route) for route in routes),
+            objective=solution.ObjectiveValue(),
+        )
+
+    def apply_time_policy(self, search_parameters, num_of_trips: int) -> float:
+        """Caps the time limit of the parameters with the policy, returns the limit in seconds"""
+
+        time_limit = min(
+            self.time_policy.time_limit_for(num_of_trips),
+            search_parameters.time_limit.ToMilliseconds() / 1000,
+        )
+        search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+        if self.time_policy.solution_limit:
+            search_parameters.solution_limit = self.time_policy.solution_limit
+
+        return time_limit
+
+    def solve(
+        self,
+        problem: RoutingProblem,
+        initial_routes: Optional[List[List[int]]] = None,
+    ) -> Optional[RoutingSolution]:
+        starting_time = timer()
+
+        manager, routing = self.build_model(problem)
+        model_time = timer()
+
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.CopyFrom(
+            self.search_parameters or self.default_search_parameters()
+        )
+        num_of_trips = problem.num_of_nodes - 1
+        time_limit = self.apply_time_policy(search_parameters, num_of_trips)
+
+        # Stop the search once the best objective has not improved for the stall time
+        stall_time = self.time_policy.stall_time_for(num_of_trips)
+        best_objective, last_improvement, num_of_solutions = None, timer(), 0
+        stop_reason = "time_limit"
+
+        def on_solution():
+            nonlocal best_objective, last_improvement, num_of_solutions, stop_reason
+            num_of_solutions += 1
+            objective = routing.CostVar().Value()
+            if best_objective is None or objective < best_objective:
+                best_objective, last_improvement = objective, timer()
+            elif stall_time and timer() - last_improvement > stall_time:
+                stop_reason = "stall"
+                routing.solver().FinishCurrentSearch()
+
+        routing.AddAtSolutionCallback(on_solution)
+
+        initial_solution = (
+            self.read_initial_solution(
+                manager, routing, search_parameters, initial_routes
+            )
+            if initial_routes
+            else None
+        )
+        if initial_solution:
+            # Local search starts from the given routes, no first solution is built
+            solution = routing.SolveFromAssignmentWithParameters(
+                initial_solution, search_parameters
+            )
+        else:
+            solution = routing.SolveWithParameters(search_parameters)
+        solve_time = timer()
+        if not solution:
+            return None
+
+        if num_of_solutions == search_parameters.solution_limit:
+            stop_reason = "solution_limit"
+
+        routing_solution = self.read_solution(problem, manager, routing, solution)
+        routing_solution.elapsed_time = timer() - starting_time
+        routing_solution.phase_times = {
+            "model": model_time - starting_time,
+            "solve": solve_time - model_time,
+            "extract": timer() - solve_time,
+        }
+        routing_solution.time_limit = time_limit
+        routing_solution.num_of_solutions = num_of_solutions
+        routing_solution.stop_reason = stop_reason
+        routing_solution.warm_started = bool(initial_solution)
+        return routing_solution
+
+    def read_initial_solution(
+        self, manager, routing, search_parameters, initial_routes: List[List[int]]
+    ):
+        """Returns the assignment of the routes, None if they are not a feasible solution"""
+
+        routing.CloseModelWithParameters(search_parameters)
+        routes = [
+            [manager.NodeToIndex(node) for node in route[1:-1]]
+            for route in initial_routes
+        ]
+        return routing.ReadAssignmentFromRoutes(routes, True)
@@ -0,0 +1,170 @@
+import json
+import multiprocessing
+from multiprocessing.connection import wait
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+from .base import AbstractSolver, RoutingProblem, RoutingSolution
+from .or_tools import OrToolsSolver
+from .prefilter import objective_lower_bound
+
+FirstSolutionStrategy = routing_enums_pb2.FirstSolutionStrategy
+LocalSearchMetaheuristic = routing_enums_pb2.LocalSearchMetaheuristic
+
+# First solution strategy and metaheuristic of the members after the first one, which
+# keeps the search parameters of the scenario
+PORTFOLIO_MEMBERS = (
+    (FirstSolutionStrategy.SAVINGS, LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH),
+    (
+        FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION,
+        LocalSearchMetaheuristic.SIMULATED_ANNEALING,
+    ),
+    (FirstSolutionStrategy.CHRISTOFIDES, LocalSearchMetaheuristic.TABU_SEARCH),
+    (
+        FirstSolutionStrategy.LOCAL_CHEAPEST_INSERTION,
+        LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH,
+    ),
+    (FirstSolutionStrategy.GLOBAL_CHEAPEST_ARC, LocalSearchMetaheuristic.TABU_SEARCH),
+    (
+        FirstSolutionStrategy.PATH_MOST_CONSTRAINED_ARC,
+        LocalSearchMetaheuristic.SIMULATED_ANNEALING,
+    ),
+    (
+        FirstSolutionStrategy.FIRST_UNBOUND_MIN_VALUE,
+        LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH,
+    ),
+)
+MAX_PORTFOLIO_SIZE = len(PORTFOLIO_MEMBERS) + 1
+
+
+def member_name(search_parameters) -> str:
+    return "{}/{}".format(
+        FirstSolutionStrategy.Value.Name(search_parameters.first_solution_strategy),
+        LocalSearchMetaheuristic.Value.Name(
+            search_parameters.local_search_metaheuristic
+        ),
+    )
+
+
+def solve_member(connection, solver: AbstractSolver, problem, initial_routes) -> None:
+    """Runs in a forked process, sends the solution (or None) back to the parent"""
+
+    try:
+        solution = solver.solve(problem, initial_routes)
+    except Exception:
+        solution = None
+    connection.send(solution)
+    connection.close()
+
+
+class PortfolioSolver(AbstractSolver):
+    """
+    Solves every instance with `size` OR-Tools searches at once, one process each: the
+    search parameters of the scenario plus other first solution strategies and
+    metaheuristics from PORTFOLIO_MEMBERS, all with the same time policy.
+
+    Every member runs to its own stop (stalled, at the solution limit or at the time
+    limit) and the solution with the lowest objective is kept. The searches still running
+    are only cancelled once a member reaches the lower bound of the objective
+    (`objective_lower_bound`), which proves its solution optimal.
+
+    The members are forked, so they get the problem without copying it.
+    """
+
+    name = "Portfolio"
+
+    def __init__(self, search_parameters=None, time_policy=None, size: int = 4) -> None:
+        super().__init__(search_parameters, time_policy)
+        if not 1 <= size <= MAX_PORTFOLIO_SIZE:
+            raise ValueError(
+                f"SOLVER_PORTFOLIO must be between 1 and {MAX_PORTFOLIO_SIZE}, got {size}"
+            )
+        self.members = self.member_solvers(size)
+        self.num_of_cancelled = 0
+        self.wins: Dict[str, int] = {}
+
+    def member_solvers(self, size: int) -> List[OrToolsSolver]:
+        base_parameters = (
+            self.search_parameters
+            or OrToolsSolver(None, self.time_policy).default_search_parameters()
+        )
+        members = [OrToolsSolver(base_parameters, self.time_policy)]
+        for first_solution_strategy, metaheuristic in PORTFOLIO_MEMBERS[: size - 1]:
+            search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+            search_parameters.CopyFrom(base_parameters)
+            search_parameters.first_solution_strategy = first_solution_strategy
+            search_parameters.local_search_metaheuristic = metaheuristic
+            members.append(OrToolsSolver(search_parameters, self.time_policy))
+        return members
+
+    def settings_key(self) -> str:
+        return json.dumps(
+            [self.name, [member.settings_key() for member in self.members]]
+        )
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            "portfolio_cancelled": self.num_of_cancelled,
+            **{f"portfolio_wins:{name}": n for name, n in self.wins.items()},
+        }
+
+    def solve(
+        self,
+        problem: RoutingProblem,
+        initial_routes: Optional[List[List[int]]] = None,
+    ) -> Optional[RoutingSolution]:
+        starting_time = timer()
+        if len(self.members) == 1:
+            return self.members[0].solve(problem, initial_routes)
+
+        context = multiprocessing.get_context("fork")
+        running: Dict = {}
+        for index, member in enumerate(self.members):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=solve_member,
+                args=(sender, member, problem, initial_routes),
+                daemon=True,
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (index, process)
+
+        lower_bound = objective_lower_bound(problem)
+        best: Optional[Tuple[int, RoutingSolution]] = None
+        optimal = False
+        while running and not optimal:
+            for receiver in wait(list(running)):
+                index, process = running.pop(receiver)
+                try:
+                    solution = receiver.recv()
+                except EOFError:
+                    # The member died without a result
+                    solution = None
+                receiver.close()
+                process.join()
+                if solution is None:
+                    continue
+                if best is None or solution.objective < best[1].objective:
+                    best = (index, solution)
+                optimal = optimal or (
+                    lower_bound is not None
+                    and problem.objective(solution.routes, solution.dropped_nodes)
+                    <= lower_bound
+                )
+
+        for receiver, (_, process) in running.items():
+            process.terminate()
+            process.join()
+            receiver.close()
+        self.num_of_cancelled += len(running)
+
+        if best is None:
+            return None
+        index, solution = best
+        name = member_name(self.members[index].search_parameters)
+        self.wins[name] = self.wins.get(name, 0) + 1
+        solution.elapsed_time = timer() - starting_time
+        return solution
@@ -0,0 +1,299 @@
+from dataclasses import replace
+from itertools import combinations, permutations
+import json
+from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .base import AbstractSolver, RoutingProblem, RoutingSolution
+from .heuristic import insert_nodes, or_opt, two_opt
+
+# Single-vehicle instances with at most this many trips are solved by enumeration
+EXACT_MAX_TRIPS = 4
+
+
+def unreachable_nodes(problem: RoutingProblem) -> np.ndarray:
+    """The trips whose round trip from the fixed stop alone exceeds the distance budget"""
+
+    distance_matrix = problem.distance_matrix
+    nodes = np.arange(1, problem.num_of_nodes)
+    round_trips = distance_matrix[0, nodes] + distance_matrix[nodes, 0]
+    return nodes[round_trips > problem.max_distance]
+
+
+def one_tree_bound(distance_matrix: np.ndarray) -> int:
+    """
+    Lower bound on the length of a tour through all the nodes: a minimum spanning tree of
+    the trips (Prim's algorithm) plus the two shortest edges of the fixed stop. Distances
+    are made symmetric with the shorter direction, which keeps the bound valid.
+    """
+
+    symmetric = np.minimum(distance_matrix, distance_matrix.T)
+    num_of_nodes = len(symmetric)
+    if num_of_nodes <= 2:
+        return int(2 * symmetric[0, 1:].sum())
+
+    in_tree = np.zeros(num_of_nodes, dtype=bool)
+    in_tree[[0, 1]] = True
+    # Cheapest edge from the tree to every node, the fixed stop is left out of the tree
+    cheapest = symmetric[1].astype(float)
+    cheapest[in_tree] = np.inf
+    length = 0
+    for _ in range(num_of_nodes - 2):
+        node = int(np.argmin(cheapest))
+        length += int(cheapest[node])
+        in_tree[node] = True
+        cheapest = np.minimum(cheapest, symmetric[node])
+        cheapest[in_tree] = np.inf
+
+    return length + int(np.sort(symmetric[0, 1:])[:2].sum())
+
+
+def objective_lower_bound(problem: RoutingProblem) -> Optional[int]:
+    """
+    Lower bound on the objective of a single-vehicle problem that must serve every trip,
+    from the 1-tree bound on its route. None for other problems.
+    """
+
+    if problem.num_of_vehicles != 1 or problem.allow_dropping:
+        return None
+    distance_matrix = np.asarray(problem.distance_matrix, np.int64)
+    return (1 + problem.span_cost_coefficient) * one_tree_bound(distance_matrix)
+
+
+def quick_tour(problem: RoutingProblem) -> List[int]:
+    """A tour through every trip ignoring the budget: cheapest insertion, 2-opt, Or-opt"""
+
+    unbounded = replace(
+        problem, max_distance=np.iinfo(np.int64).max, allow_dropping=False
+    )
+    (route,), _ = insert_nodes(unbounded, [[0, 0]], np.arange(1, problem.num_of_nodes))
+    while two_opt(problem.distance_matrix, route) | or_opt(
+        problem.distance_matrix, route
+    ):
+        pass
+    return route
+
+
+def enumerate_routes(problem: RoutingProblem) -> Optional[Tuple[List[int], List[int]]]:
+    """
+    The optimal single-vehicle solution of a small problem, by enumerating every subset of
+    served trips in every order. Returns the route and the dropped nodes, or None when no
+    route within the budget serves all the trips that may not be dropped.
+    """
+
+    nodes = list(range(1, problem.num_of_nodes))
+    sizes = range(len(nodes) + 1) if problem.allow_dropping else [len(nodes)]
+    best = None
+    for size in sizes:
+        for served in combinations(nodes, size):
+            dropped = [node for node in nodes if node not in served]
+            for order in permutations(served):
+                route = [0, *order, 0]
+                if problem.route_distance(route) > problem.max_distance:
+                    continue
+                objective = problem.objective([route], dropped)
+                if best is None or objective < best[0]:
+                    best = (objective, route, dropped)
+
+    return best[1:] if best is not None else None
+
+
+def proves_infeasible(problem: RoutingProblem) -> bool:
+    """
+    Whether the cheap checks prove that no route within the budget serves all the trips
+    that may not be dropped: an unreachable trip, the enumeration of a small
+    single-vehicle problem, or a 1-tree bound above the budget. A problem that allows
+    dropping is always feasible.
+    """
+
+    if problem.allow_dropping:
+        return False
+    problem = replace(
+        problem, distance_matrix=np.asarray(problem.distance_matrix, np.int64)
+    )
+    if unreachable_nodes(problem).size:
+        return True
+    if problem.num_of_vehicles != 1:
+        return False
+    if problem.num_of_nodes - 1 <= EXACT_MAX_TRIPS:
+        return enumerate_routes(problem) is None
+    return one_tree_bound(problem.distance_matrix) > problem.max_distance
+
+
+class PrefilterSolver(AbstractSolver):
+    """
+    Cheap checks before handing a problem to `solver`:
+
+    - Trips whose round trip from the fixed stop alone exceeds the budget can never be
+      served. They are dropped up front, or the problem is infeasible without dropping.
+    - A single-vehicle problem with at most EXACT_MAX_TRIPS trips left is solved exactly
+      by enumeration.
+    - With `bound_gap` above 0, a single-vehicle problem whose quick tour through all the
+      trips fits the budget and is within `bound_gap` of the 1-tree lower bound keeps that
+      tour, all its trips are accepted without a search.
+    """
+
+    name = "Prefilter"
+
+    def __init__(self, solver: AbstractSolver, bound_gap: float = 0.0) -> None:
+        super().__init__(solver.search_parameters, solver.time_policy)
+        self.solver = solver
+        self.bound_gap = bound_gap
+        self.num_of_unreachable = 0
+        self.num_of_exact = 0
+        self.num_of_bounded = 0
+
+    def settings_key(self) -> str:
+        return json.dumps(
+            [self.name, EXACT_MAX_TRIPS, self.bound_gap, self.solver.settings_key()]
+        )
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            **self.solver.counters(),
+            "prefilter_unreachable": self.num_of_unreachable,
+            "prefilter_exact": self.num_of_exact,
+            "prefilter_bounded": self.num_of_bounded,
+        }
+
+    def solve(
+        self,
+        problem: RoutingProblem,
+        initial_routes: Optional[List[List[int]]] = None,
+    ) -> Optional[RoutingSolution]:
+        starting_time = timer()
+
+        problem = replace(
+            problem, distance_matrix=np.asarray(problem.distance_matrix, np.int64)
+        )
+        unreachable = unreachable_nodes(problem)
+        if unreachable.size and not problem.allow_dropping:
+            return None
+        self.num_of_unreachable += len(unreachable)
+
+        # Node n of the reduced problem is node subset[n] of the problem
+        subset = np.setdiff1d(np.arange(problem.num_of_nodes), unreachable)
+        reduced = self.reduce(problem, subset)
+        prefilter_time = timer() - starting_time
+
+        solution = None
+        if problem.num_of_vehicles == 1:
+            solution = self.shortcut(reduced)
+        if solution is None:
+            solution = self.solver.solve(
+                reduced, self.reduce_routes(initial_routes, subset, problem)
+            )
+            if solution is None:
+                return None
+        solution.phase_times["prefilter"] = (
+            solution.phase_times.get("prefilter", 0.0) + prefilter_time
+        )
+
+        routes = [[int(node) for node in subset[route]] for route in solution.routes]
+        dropped_nodes = sorted(
+            [int(node) for node in subset[solution.dropped_nodes]]
+            + unreachable.tolist()
+        )
+        return replace(
+            solution,
+            routes=routes,
+            dropped_nodes=dropped_nodes,
+            objective=problem.objective(routes, dropped_nodes),
+            elapsed_time=timer() - starting_time,
+        )
+
+    @staticmethod
+    def reduce(problem: RoutingProblem, subset: np.ndarray) -> RoutingProblem:
+        if len(subset) == problem.num_of_nodes:
+            return problem
+        return replace(
+            problem,
+            distance_matrix=problem.distance_matrix[np.ix_(subset, subset)],
+            drop_penalties=(
+                problem.node_drop_penalties[subset] if problem.allow_dropping else None
+            ),
+            node_locations=(
+                problem.node_locations[subset]
+                if problem.node_locations is not None
+                else None
+            ),
+        )
+
+    @staticmethod
+    def reduce_routes(
+        initial_routes: Optional[List[List[int]]],
+        subset: np.ndarray,
+        problem: RoutingProblem,
+    ) -> Optional[List[List[int]]]:
+        """The initial routes in nodes of the reduced problem, without dropped trips"""
+
+        if not initial_routes:
+            return initial_routes
+        positions = np.full(problem.num_of_nodes, -1)
+        positions[subset] = np.arange(len(subset))
+        return [
+            [int(positions[node]) for node in route if positions[node] >= 0]
+            for route in initial_routes
+        ]
+
+    @staticmethod
+    def worth_serving(problem: RoutingProblem, route: List[int]) -> bool:
+        """Whether leaving out any single trip of the route costs more than serving it"""
+
+        if not problem.allow_dropping or len(route) <= 2:
+            return True
+        distance_matrix = problem.distance_matrix
+        points = np.asarray(route)
+        previous, nodes, following = points[:-2], points[1:-1], points[2:]
+        savings = (
+            distance_matrix[previous, nodes]
+            + distance_matrix[nodes, following]
+            - distance_matrix[previous, following]
+        )
+        return bool(
+            np.all(
+                savings * (1 + problem.span_cost_coefficient)
+                < problem.node_drop_penalties[nodes]
+            )
+        )
+
+    def shortcut(self, problem: RoutingProblem) -> Optional[RoutingSolution]:
+        """The solution of a single-vehicle problem that needs no search, if any"""
+
+        starting_time = timer()
+        num_of_trips = problem.num_of_nodes - 1
+        if num_of_trips <= EXACT_MAX_TRIPS:
+            solved = enumerate_routes(problem)
+            if solved is None:
+                return None
+            route, dropped_nodes = solved
+            self.num_of_exact += 1
+            stop_reason = "exact"
+        elif self.bound_gap > 0:
+            route = quick_tour(problem)
+            route_distance = problem.route_distance(route)
+            if (
+                route_distance > problem.max_distance
+                or route_distance
+                > (1 + self.bound_gap) * one_tree_bound(problem.distance_matrix)
+                or not self.worth_serving(problem, route)
+            ):
+                return None
+            dropped_nodes = []
+            self.num_of_bounded += 1
+            stop_reason = "bound"
+        else:
+            return None
+
+        elapsed_time = timer() - starting_time
+        return RoutingSolution(
+            routes=[route],
+            dropped_nodes=dropped_nodes,
+            route_distance=problem.route_distance(route),
+            objective=problem.objective([route], dropped_nodes),
+            elapsed_time=elapsed_time,
+            stop_reason=stop_reason,
+            phase_times={"solve": elapsed_time},
+        )
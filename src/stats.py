@@ -0,0 +1,292 @@
+"""
+Running statistics of a configuration, updated as the simulation results stream in.
+
+Every simulation is one observation, whatever its number of cycles: the mean route time
+of its solved cycles, its total solver time and the share of its riders that were
+accepted, overall and by the minute of the cycle they reserved at (riders carried over
+count once, with their last status). Means and variances are kept with Welford's
+algorithm, confidence intervals use the normal approximation, which holds for the
+dozens of simulations a run has at least.
+
+With TARGET_PRECISION, a configuration stops scheduling simulations once the confidence
+intervals of its mean route time and acceptance rate are within that fraction of their
+means, after at least MIN_SIMULATIONS simulations.
+"""
+
+import json
+import math
+from pathlib import Path
+from statistics import NormalDist
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from models import Config, ReservationStatus, SimulationResult
+
+STATS_FILE = "stats.json"
+PAIRED_STATS_FILE = "paired_stats.json"
+
+
+class RunningStat:
+    """Mean and variance of a stream of values, with Welford's algorithm"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    def half_width(self, z: float) -> float:
+        """Half width of the confidence interval of the mean, inf with fewer than 2 values"""
+
+        if self.count < 2:
+            return math.inf
+        return z * math.sqrt(self.variance / self.count)
+
+    def relative_half_width(self, z: float) -> float:
+        return self.half_width(z) / abs(self.mean) if self.mean else math.inf
+
+    def to_dict(self, z: float) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "std": math.sqrt(self.variance) if self.count > 1 else None,
+            "half_width": finite_or_none(self.half_width(z)),
+        }
+
+
+def finite_or_none(value: float) -> Optional[float]:
+    """JSON has no infinity"""
+    return value if math.isfinite(value) else None
+
+
+def simulation_values(
+    results: List[SimulationResult], bucket_minutes: int
+) -> Optional[Dict]:
+    """
+    The observations of one simulation, None if it failed. Route time and acceptance
+    rate are None when no cycle was solved or no trip was drawn.
+    """
+
+    if any(result.error for result in results):
+        return None
+
+    route_times = [r.route_time for r in results if r.route_time is not None]
+    values = {
+        "route_time": float(np.mean(route_times)) if route_times else None,
+        "solver_time": sum(result.elapsed_time for result in results),
+        "acceptance_rate": None,
+        "bucket_acceptance_rates": {},
+    }
+
+    trip_ids = np.concatenate([result.trips["trip_id"] for result in results])
+    if not len(trip_ids):
+        return values
+    reserved_at = np.concatenate([result.trips["reserved_at"] for result in results])
+    statuses = np.concatenate(
+        [result.trips["reservation_status"] for result in results]
+    )
+    # A carried rider reserved in the cycle of their first row, and ended with the
+    # status of their last one
+    _, first = np.unique(trip_ids, return_index=True)
+    _, last = np.unique(trip_ids[::-1], return_index=True)
+    accepted = statuses[len(trip_ids) - 1 - last] == ReservationStatus.ACCEPTED.name
+    buckets = reserved_at[first] // bucket_minutes * bucket_minutes
+
+    values["acceptance_rate"] = float(accepted.mean())
+    values["bucket_acceptance_rates"] = {
+        int(bucket): float(accepted[buckets == bucket].mean())
+        for bucket in np.unique(buckets)
+    }
+    return values
+
+
+class RunStatistics:
+    """The running statistics of one configuration"""
+
+    def __init__(self, config: Config) -> None:
+        self.confidence_level = config.confidence_level
+        self.z = NormalDist().inv_cdf(0.5 + config.confidence_level / 2)
+        self.target_precision = config.target_precision
+        self.min_simulations = config.min_simulations
+        self.bucket_minutes = config.stats_bucket_minutes
+
+        self.num_of_simulations = 0
+        self.num_of_failed = 0
+        self.route_time = RunningStat()
+        self.solver_time = RunningStat()
+        self.acceptance_rate = RunningStat()
+        # By the first minute of the bucket
+        self.bucket_acceptance_rates: Dict[int, RunningStat] = {}
+
+    def add(self, results: List[SimulationResult]) -> None:
+        """Folds in the results of one simulation, a result per cycle"""
+
+        self.num_of_simulations += 1
+        values = simulation_values(results, self.bucket_minutes)
+        if values is None:
+            self.num_of_failed += 1
+            return
+
+        if values["route_time"] is not None:
+            self.route_time.add(values["route_time"])
+        self.solver_time.add(values["solver_time"])
+        if values["acceptance_rate"] is not None:
+            self.acceptance_rate.add(values["acceptance_rate"])
+        for bucket, rate in values["bucket_acceptance_rates"].items():
+            self.bucket_acceptance_rates.setdefault(bucket, RunningStat()).add(rate)
+
+    @property
+    def precise(self) -> bool:
+        """Whether the target precision is reached, never without a target"""
+
+        return (
+            self.target_precision > 0
+            and self.acceptance_rate.count >= self.min_simulations
+            and self.route_time.relative_half_width(self.z) <= self.target_precision
+            and self.acceptance_rate.relative_half_width(self.z)
+            <= self.target_precision
+        )
+
+    def summary(self) -> str:
+        """One line for the progress bar"""
+
+        return (
+            f"route {self.route_time.mean:.2f}±{self.route_time.half_width(self.z):.2f}min,"
+            f" accepted {self.acceptance_rate.mean:.1%}±{self.acceptance_rate.half_width(self.z):.1%}"
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "confidence_level": self.confidence_level,
+            "target_precision": self.target_precision,
+            "precise": self.precise,
+            "num_of_simulations": self.num_of_simulations,
+            "num_of_failed": self.num_of_failed,
+            "route_time": self.route_time.to_dict(self.z),
+            "solver_time": self.solver_time.to_dict(self.z),
+            "acceptance_rate": self.acceptance_rate.to_dict(self.z),
+            "bucket_minutes": self.bucket_minutes,
+            "bucket_acceptance_rates": {
+                str(bucket): stat.to_dict(self.z)
+                for bucket, stat in sorted(self.bucket_acceptance_rates.items())
+            },
+        }
+
+    def write(self, directory: Path) -> None:
+        with open(directory / STATS_FILE, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def format(self) -> str:
+        lines = [
+            f"{self.num_of_simulations - self.num_of_failed} simulations, means with their {self.confidence_level:.0%} confidence intervals:",
+            f"  route time     {self.route_time.mean:>8.2f} ± {self.route_time.half_width(self.z):.2f} minutes",
+            f"  solver time    {self.solver_time.mean:>8.3f} ± {self.solver_time.half_width(self.z):.3f} seconds",
+            f"  acceptance     {self.acceptance_rate.mean:>8.1%} ± {self.acceptance_rate.half_width(self.z):.1%}",
+        ]
+        for bucket, stat in sorted(self.bucket_acceptance_rates.items()):
+            lines.append(
+                f"    {bucket:>4}-{bucket + self.bucket_minutes:<4} min {stat.mean:>6.1%} ± {stat.half_width(self.z):.1%}"
+            )
+        return "\n".join(lines)
+
+
+class PairedStatistics:
+    """
+    Differences between the configs of a common random numbers group, which simulate the
+    same trips: every other config against the first one, one paired observation per
+    simulation. With both configs on the same trips, their sampling noise mostly cancels.
+    """
+
+    METRICS = ("route_time", "acceptance_rate")
+
+    def __init__(self, configs: List[Config]) -> None:
+        self.names = [config.name for config in configs]
+        self.z = NormalDist().inv_cdf(0.5 + configs[0].confidence_level / 2)
+        self.confidence_level = configs[0].confidence_level
+        self.bucket_minutes = configs[0].stats_bucket_minutes
+        self.differences = {
+            name: {metric: RunningStat() for metric in self.METRICS}
+            for name in self.names[1:]
+        }
+        # Observations of the simulations not yet seen for every config, by index
+        self.pending: Dict[int, Dict[str, Optional[Dict]]] = {}
+
+    def add(
+        self, name: str, simulation_index: int, results: List[SimulationResult]
+    ) -> None:
+        pending = self.pending.setdefault(simulation_index, {})
+        pending[name] = simulation_values(results, self.bucket_minutes)
+        if len(pending) < len(self.names):
+            return
+
+        del self.pending[simulation_index]
+        baseline = pending[self.names[0]]
+        for name in self.names[1:]:
+            for metric in self.METRICS:
+                if (
+                    baseline is not None
+                    and pending[name] is not None
+                    and baseline[metric] is not None
+                    and pending[name][metric] is not None
+                ):
+                    self.differences[name][metric].add(
+                        pending[name][metric] - baseline[metric]
+                    )
+
+    def unpaired_half_width(
+        self, statistics: Dict[str, RunStatistics], name: str, metric: str
+    ) -> float:
+        """Half width of the difference's interval if the configs drew their own trips"""
+
+        stats = [getattr(statistics[n], metric) for n in (self.names[0], name)]
+        if any(stat.count < 2 for stat in stats):
+            return math.inf
+        return self.z * math.sqrt(sum(stat.variance / stat.count for stat in stats))
+
+    def to_dict(self, statistics: Dict[str, RunStatistics]) -> Dict:
+        return {
+            "baseline": self.names[0],
+            "confidence_level": self.confidence_level,
+            "differences": {
+                name: {
+                    metric: {
+                        **stat.to_dict(self.z),
+                        "unpaired_half_width": finite_or_none(
+                            self.unpaired_half_width(statistics, name, metric)
+                        ),
+                    }
+                    for metric, stat in differences.items()
+                }
+                for name, differences in self.differences.items()
+            },
+        }
+
+    def write(self, directory: Path, statistics: Dict[str, RunStatistics]) -> None:
+        with open(directory / PAIRED_STATS_FILE, "w") as f:
+            json.dump(self.to_dict(statistics), f, indent=2)
+
+    def format(self, statistics: Dict[str, RunStatistics]) -> str:
+        lines = [
+            f"Paired differences to {self.names[0]}, with their {self.confidence_level:.0%} confidence intervals (unpaired):"
+        ]
+        for name, differences in self.differences.items():
+            route_time = differences["route_time"]
+            acceptance_rate = differences["acceptance_rate"]
+            lines.append(
+                f"  {name}: route time {route_time.mean:+.2f} ± {route_time.half_width(self.z):.2f}"
+                f" ({self.unpaired_half_width(statistics, name, 'route_time'):.2f}) minutes,"
+                f" acceptance {acceptance_rate.mean:+.1%} ± {acceptance_rate.half_width(self.z):.1%}"
+                f" ({self.unpaired_half_width(statistics, name, 'acceptance_rate'):.1%})"
+                f" over {acceptance_rate.count} simulations"
+            )
+        return "\n".join(lines)
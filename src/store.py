@@ -0,0 +1,396 @@
+"""
+Columnar storage of simulation results.
+
+All the simulations of a run are appended to Parquet files under
+`OUTPUT_DIR/results/config=<NAME>/{routes,trips}/`, one file per flushed chunk, instead of
+a directory of text files per simulation.
+
+A chunk is committed by appending a line to the writer's file in `manifest/` once both
+of its files are in place. Files without a manifest line belong to a chunk that was cut
+short, they are ignored by readers and removed on resume. Readers go through
+`read_committed`, which also reads a simulation committed twice only once.
+"""
+
+import json
+import os
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Dict, Iterator, List
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from models import Config, SimulationResult
+
+ROUTES_SCHEMA = pa.schema(
+    [
+        ("simulation_index", pa.int64()),
+        ("root_seed", pa.int64()),
+        ("seed", pa.uint64()),
+        ("scenario_name", pa.string()),
+        ("cycle", pa.int32()),
+        ("num_of_trips", pa.int32()),
+        ("num_of_accepted", pa.int32()),
+        ("route", pa.list_(pa.int32())),
+        ("routes", pa.list_(pa.list_(pa.int32()))),
+        ("route_distance", pa.int64()),
+        ("route_time", pa.float64()),
+        ("dropped_nodes", pa.list_(pa.int32())),
+        ("solver_time", pa.float64()),
+        ("time_limit", pa.float64()),
+        ("num_of_solutions", pa.int64()),
+        ("stop_reason", pa.dictionary(pa.int8(), pa.string())),
+        ("num_of_resolves", pa.int32()),
+        ("warm_started", pa.bool_()),
+        ("error", pa.string()),
+    ]
+)
+
+TRIPS_SCHEMA = pa.schema(
+    [
+        ("simulation_index", pa.int64()),
+        ("cycle", pa.int32()),
+        ("trip_id", pa.int32()),
+        # Node of the trip in the routing problem, null if it was not handed to the solver
+        # (-1 in SimulationResult.trips)
+        ("node", pa.int32()),
+        ("direction", pa.dictionary(pa.int8(), pa.string())),
+        ("location_index", pa.int32()),
+        ("reserved_at", pa.int32()),
+        ("reservation_status", pa.dictionary(pa.int8(), pa.string())),
+        # Seconds taken to decide the reservation, null unless dispatched event by event
+        ("decision_time", pa.float64()),
+    ]
+)
+
+TABLE_SCHEMAS = {"routes": ROUTES_SCHEMA, "trips": TRIPS_SCHEMA}
+
+MANIFEST_DIRECTORY = "manifest"
+
+
+# How missing values are held in SimulationResult.trips
+NULL_VALUES = {
+    "node": lambda column: column < 0,
+    "decision_time": np.isnan,
+}
+
+
+def results_directory(output_dir: Path, name: str) -> Path:
+    return output_dir / "results" / f"config={name}"
+
+
+def read_manifest(directory: Path) -> List[Dict]:
+    """Returns the committed chunks of a results directory"""
+
+    entries = []
+    for path in sorted((directory / MANIFEST_DIRECTORY).glob("*.jsonl")):
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A line cut short by a crash, its chunk was never committed
+                    break
+    return entries
+
+
+def manifest_simulations(entries: List[Dict]) -> Dict[int, bool]:
+    """The simulations of the manifest entries, by index, with whether they failed"""
+
+    simulations = {}
+    for entry in entries:
+        failed = set(entry["failed"])
+        for index in entry["simulation_index"]:
+            simulations[index] = index in failed
+    return simulations
+
+
+def committed_parts(directory: Path) -> set | None:
+    """Names of the committed part files, None for results stored without a manifest"""
+
+    if not (directory / MANIFEST_DIRECTORY).is_dir():
+        return None
+    return {entry["part"] for entry in read_manifest(directory)}
+
+
+def read_committed(
+    directory: Path, table_name: str, columns: List[str] = None, filter=None
+) -> pa.Table:
+    """
+    Reads a table of the committed chunks, rows matching the pyarrow `filter` expression
+    only. A simulation committed by several chunks, such as a queue chunk committed by a
+    worker whose lease had expired and by the worker that leased it next, is read from
+    the first of them only.
+    """
+
+    entries = read_manifest(directory)
+    if not (directory / MANIFEST_DIRECTORY).is_dir():
+        # Stored without a manifest, every part counts once
+        entries = [
+            {"part": path.name, "simulation_index": None}
+            for path in sorted((directory / table_name).glob("*.parquet"))
+        ]
+
+    tables = []
+    seen = set()
+    for entry in entries:
+        part = directory / table_name / entry["part"]
+        if entry["simulation_index"] is None:
+            tables.append(pq.read_table(part, columns=columns, filters=filter))
+            continue
+        new = set(entry["simulation_index"]) - seen
+        if not new:
+            continue
+        part_filter = pc.field("simulation_index").isin(sorted(new))
+        if filter is not None:
+            part_filter = part_filter & filter
+        tables.append(pq.read_table(part, columns=columns, filters=part_filter))
+        seen |= new
+
+    if not tables:
+        schema = TABLE_SCHEMAS[table_name]
+        return schema.empty_table().select(columns) if columns else schema.empty_table()
+    return pa.concat_tables(tables)
+
+
+def remove_uncommitted_parts(directory: Path) -> int:
+    """Deletes the files of chunks that were never committed, returns their number"""
+
+    committed = committed_parts(directory)
+    if committed is None:
+        return 0
+
+    removed = 0
+    for table in ("routes", "trips"):
+        for path in (directory / table).glob("part-*"):
+            if path.name not in committed:
+                path.unlink()
+                removed += 1
+    return removed
+
+
+def read_simulations(directory: Path) -> Iterator[List[SimulationResult]]:
+    """
+    Reads back the committed results of a config, a list of results (one per cycle) per
+    simulation in index order. The results only hold what the running statistics need:
+    route time, solver time, error and the trip ids, reservation times and statuses. When
+    a simulation was committed twice, its first copy is kept.
+    """
+
+    results: Dict[tuple, SimulationResult] = {}
+    for part in dict.fromkeys(entry["part"] for entry in read_manifest(directory)):
+        routes = pq.read_table(
+            directory / "routes" / part,
+            columns=["simulation_index", "seed", "scenario_name", "cycle"]
+            + ["route_time", "solver_time", "error"],
+        )
+        new = {}
+        for row in routes.to_pylist():
+            key = (row["simulation_index"], row["cycle"])
+            if key not in results:
+                new[key] = SimulationResult(
+                    simulation_index=row["simulation_index"],
+                    seed=row["seed"],
+                    scenario_name=row["scenario_name"],
+                    cycle=row["cycle"],
+                    route_time=row["route_time"],
+                    elapsed_time=row["solver_time"],
+                    error=row["error"],
+                )
+        if not new:
+            continue
+
+        trips = pq.read_table(
+            directory / "trips" / part,
+            columns=["simulation_index", "cycle", "trip_id", "reserved_at"]
+            + ["reservation_status"],
+        )
+        keys = np.column_stack(
+            [
+                trips["simulation_index"].to_numpy(),
+                trips["cycle"].to_numpy(),
+            ]
+        )
+        columns = {
+            "trip_id": trips["trip_id"].to_numpy(),
+            "reserved_at": trips["reserved_at"].to_numpy(),
+            "reservation_status": np.array(
+                trips["reservation_status"].to_pylist(), dtype=object
+            ),
+        }
+        if len(keys):
+            unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            order = np.argsort(inverse.ravel(), kind="stable")
+            bounds = np.cumsum(np.bincount(inverse.ravel()))[:-1]
+            for key, rows in zip(unique_keys, np.split(order, bounds)):
+                key = tuple(int(k) for k in key)
+                if key in new:
+                    new[key].trips = {
+                        name: column[rows] for name, column in columns.items()
+                    }
+        for result in new.values():
+            if not result.trips:
+                result.trips = {name: column[:0] for name, column in columns.items()}
+        results.update(new)
+
+    simulation = []
+    for key in sorted(results):
+        if simulation and simulation[0].simulation_index != key[0]:
+            yield simulation
+            simulation = []
+        simulation.append(results[key])
+    if simulation:
+        yield simulation
+
+
+class ResultStore:
+    """
+    Buffers simulation results and writes them in chunks of `chunk_size` simulations.
+
+    Every chunk is a new Parquet file per table, written to a temporary file and renamed,
+    so a reader never sees a partially written chunk.
+    """
+
+    def __init__(self, config: Config, chunk_size: int = None) -> None:
+        self.directory = results_directory(config.output_dir, config.name)
+        self.root_seed = config.root_seed
+        self.chunk_size = chunk_size or config.results_chunk_size
+        # Unique per writer, several runs may append to the same directory
+        self.session = uuid.uuid4().hex[:12]
+        self.num_of_chunks = 0
+        self.buffer: List[SimulationResult] = []
+        # Simulations in the buffer
+        self.num_of_buffered = 0
+        # Seconds spent writing and committing chunks
+        self.write_time = 0.0
+
+        for table in ("routes", "trips", MANIFEST_DIRECTORY):
+            (self.directory / table).mkdir(parents=True, exist_ok=True)
+        self.manifest_path = (
+            self.directory / MANIFEST_DIRECTORY / f"{self.session}.jsonl"
+        )
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def append(self, results: List[SimulationResult]) -> None:
+        """
+        Buffers the results of one simulation, a result per cycle. The cycles of a
+        simulation always go to the same chunk, so a committed simulation is complete.
+        """
+
+        self.buffer.extend(results)
+        self.num_of_buffered += 1
+        if self.num_of_buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> List[Path]:
+        """Writes the buffered results, returns the written files"""
+
+        if not self.buffer:
+            return []
+
+        starting_time = timer()
+        part_name = f"part-{self.session}-{self.num_of_chunks:05d}.parquet"
+        written = [
+            self.write_table(self.routes_table(self.buffer), "routes", part_name),
+            self.write_table(self.trips_table(self.buffer), "trips", part_name),
+        ]
+        self.commit(part_name, self.buffer)
+        self.num_of_chunks += 1
+        self.buffer = []
+        self.num_of_buffered = 0
+        self.write_time += timer() - starting_time
+        return written
+
+    def close(self) -> None:
+        self.flush()
+
+    def write_chunk(self, results: List[SimulationResult]) -> List[Path]:
+        """Writes the results as a chunk of their own, committed at once"""
+
+        self.flush()
+        self.buffer = list(results)
+        return self.flush()
+
+    def commit(self, part_name: str, results: List[SimulationResult]) -> None:
+        """Records the chunk in the manifest, the chunk counts once the line is on disk"""
+
+        entry = {
+            "part": part_name,
+            "root_seed": self.root_seed,
+            "simulation_index": [result.simulation_index for result in results],
+            "seed": [result.seed for result in results],
+            "failed": [result.simulation_index for result in results if result.error],
+        }
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_table(self, table: pa.Table, table_name: str, part_name: str) -> Path:
+        path = self.directory / table_name / part_name
+        temporary_path = path.with_suffix(".tmp")
+        pq.write_table(table, temporary_path)
+        temporary_path.replace(path)
+        return path
+
+    def routes_table(self, results: List[SimulationResult]) -> pa.Table:
+        return pa.Table.from_pydict(
+            {
+                "simulation_index": [r.simulation_index for r in results],
+                "root_seed": [self.root_seed] * len(results),
+                "seed": [r.seed for r in results],
+                "scenario_name": [r.scenario_name for r in results],
+                "cycle": [r.cycle for r in results],
+                "num_of_trips": [r.num_of_trips for r in results],
+                "num_of_accepted": [r.num_of_accepted for r in results],
+                "route": [r.route for r in results],
+                "routes": [r.routes for r in results],
+                "route_distance": [r.route_distance for r in results],
+                "route_time": [r.route_time for r in results],
+                "dropped_nodes": [r.dropped_nodes for r in results],
+                "solver_time": [r.elapsed_time for r in results],
+                "time_limit": [r.time_limit for r in results],
+                "num_of_solutions": [r.num_of_solutions for r in results],
+                "stop_reason": [r.stop_reason for r in results],
+                "num_of_resolves": [r.num_of_resolves for r in results],
+                "warm_started": [r.warm_started for r in results],
+                "error": [r.error for r in results],
+            },
+            schema=ROUTES_SCHEMA,
+        )
+
+    @staticmethod
+    def trips_table(results: List[SimulationResult]) -> pa.Table:
+        """Concatenates the trip columns of the results, unrouted trips get a null node"""
+
+        results = [result for result in results if result.trips]
+        if not results:
+            return TRIPS_SCHEMA.empty_table()
+
+        num_of_trips = [len(result.trips["trip_id"]) for result in results]
+        columns = {
+            "simulation_index": np.repeat(
+                [result.simulation_index for result in results], num_of_trips
+            ),
+            "cycle": np.repeat([result.cycle for result in results], num_of_trips),
+        }
+        for name in TRIPS_SCHEMA.names[2:]:
+            columns[name] = np.concatenate([result.trips[name] for result in results])
+
+        arrays = [
+            pa.array(
+                columns[name],
+                type=TRIPS_SCHEMA.field(name).type,
+                mask=NULL_VALUES[name](columns[name]) if name in NULL_VALUES else None,
+            )
+            for name in TRIPS_SCHEMA.names
+        ]
+        return pa.Table.from_arrays(arrays, schema=TRIPS_SCHEMA)
@@ -0,0 +1,90 @@
+"""
+Parameter sweeps over a base configuration.
+
+Any of the SWEEP_KEYS of a configuration file, or of a `--sweep KEY=VALUES` argument, may
+hold several values, either as a list or as a range (the stop is excluded):
+
+    LAMBDA_PARAM=0.1,0.2,0.4
+    NUMBER_OF_ZONES_PER_ROW=10:31:10
+
+The configuration is expanded into one point per combination of values. Every point is
+stored under its own NAME (or SCENARIO), suffixed with the swept values, e.g.
+`Zero__lambda_param-0.2__number_of_zones_per_row-20`.
+"""
+
+from itertools import product
+from typing import Dict, List
+
+import numpy as np
+
+SWEEP_KEYS = (
+    "SCENARIO",
+    "LAMBDA_PARAM",
+    "RESERVATION_CUTOFF",
+    "NUMBER_OF_ZONES_PER_ROW",
+    "SHUTTLE_SPEED",
+    "NUM_OF_SHUTTLES",
+    "DECOMPOSITION",
+)
+
+
+def parse_values(value: str) -> List[str]:
+    """Splits `a,b,c` into its values and expands `start:stop:step` into a range"""
+
+    value = value.strip()
+    if "," in value:
+        return [item.strip() for item in value.split(",") if item.strip()]
+    if ":" not in value:
+        return [value]
+
+    start, stop, *step = value.split(":")
+    step = step[0] if step else "1"
+    if all(part.replace("_", "").lstrip("-").isdigit() for part in (start, stop, step)):
+        return [str(item) for item in range(int(start), int(stop), int(step))]
+
+    items = np.arange(float(start), float(stop), float(step))
+    # Round away the floating point error of the steps
+    return [f"{item:g}" for item in np.round(items, 10)]
+
+
+def parse_overrides(arguments: List[str]) -> Dict[str, str]:
+    """Parses the `KEY=VALUES` arguments of the command line"""
+
+    overrides = {}
+    for argument in arguments or []:
+        key, separator, value = argument.partition("=")
+        if not separator or key not in SWEEP_KEYS:
+            raise ValueError(
+                f"Invalid sweep {argument!r}, expected KEY=VALUES with KEY one of {SWEEP_KEYS}"
+            )
+        overrides[key] = value
+    return overrides
+
+
+def expand_sweep(
+    env: Dict[str, str], overrides: Dict[str, str] = None
+) -> List[Dict[str, str]]:
+    """Returns the environment of every point of the sweep, with its NAME set"""
+
+    env = {**env, **(overrides or {})}
+    # Without a NAME, points are named after their scenario as in a single run
+    base_name = env.get("NAME")
+
+    swept = {
+        key: parse_values(env[key]) for key in SWEEP_KEYS if env.get(key) is not None
+    }
+    varying = [
+        key
+        for key, values in swept.items()
+        if len(values) > 1 and (base_name or key != "SCENARIO")
+    ]
+
+    points = []
+    for values in product(*swept.values()):
+        point = {**env, **dict(zip(swept, values))}
+        point["NAME"] = "__".join(
+            [base_name or point["SCENARIO"]]
+            + [f"{key.lower()}-{point[key]}" for key in varying]
+        )
+        points.append(point)
+    return points
@@ -0,0 +1,162 @@
+"""
+A work queue on a shared directory, so that several machines can run the simulations of
+one run.
+
+`main.py --coordinate` splits the simulations of the configs into chunks of
+QUEUE_CHUNK_SIZE, written as JSON files to `OUTPUT_DIR/queue/pending/`. Every
+`main.py --work` (on any machine that mounts OUTPUT_DIR) leases a chunk by renaming it to
+`leased/<chunk>@<worker>.json`. A rename is atomic, so only one worker gets the chunk.
+The worker touches its lease files while it runs their simulations, and once all the
+simulations of a chunk are back it commits them to the results (see store.py) and
+deletes the lease.
+
+A lease that was not touched for LEASE_SECONDS belongs to a worker that crashed or lost
+the shared directory: the coordinator renames it back to `pending/`, and a worker that
+finds its lease gone discards the results of the chunk. The coordinator also requeues
+the simulations that are neither committed nor queued, and writes `finished` once every
+simulation is committed, which stops the workers.
+
+Lease ages are compared with the clock of the coordinator, the machines must keep their
+clocks in sync.
+"""
+
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+import socket
+import time
+from typing import Dict, Iterable, List, Optional, Set
+import uuid
+
+QUEUE_DIRECTORY = "queue"
+# Seconds between two looks at the queue, of the coordinator and of idle workers
+POLL_SECONDS = 5
+
+
+@dataclass
+class QueueChunk:
+    """Simulations of a group of configs, the configs run on the same draws"""
+
+    configs: List[str]
+    simulation_index: List[int]
+    root_seed: int
+
+
+@dataclass
+class Lease:
+    path: Path
+    chunk: QueueChunk
+
+    @property
+    def name(self) -> str:
+        return self.path.stem
+
+
+class WorkQueue:
+    def __init__(self, directory: Path, lease_seconds: float = 600) -> None:
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.pending_directory = directory / "pending"
+        self.leased_directory = directory / "leased"
+        self.finished_path = directory / "finished"
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self.num_of_chunks = 0
+
+    @classmethod
+    def of_output_dir(cls, output_dir: Path, lease_seconds: float) -> "WorkQueue":
+        return cls(output_dir / QUEUE_DIRECTORY, lease_seconds)
+
+    def exists(self) -> bool:
+        return self.pending_directory.is_dir()
+
+    def create(self) -> None:
+        for directory in (self.pending_directory, self.leased_directory):
+            directory.mkdir(parents=True, exist_ok=True)
+        self.finished_path.unlink(missing_ok=True)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_path.exists()
+
+    def finish(self) -> None:
+        self.finished_path.touch()
+
+    def put(self, chunk: QueueChunk) -> None:
+        # Chunks are leased in name order, the sequence number keeps the order they were
+        # queued in
+        name = f"{self.num_of_chunks:06d}-{uuid.uuid4().hex[:8]}"
+        self.num_of_chunks += 1
+        temporary_path = self.directory / f"{name}.tmp"
+        temporary_path.write_text(json.dumps(asdict(chunk)))
+        temporary_path.replace(self.pending_directory / f"{name}.json")
+
+    def has_pending(self) -> bool:
+        return any(self.pending_directory.glob("*.json"))
+
+    def lease(self) -> Optional[Lease]:
+        """Leases the next pending chunk, None when there is none left"""
+
+        for path in sorted(self.pending_directory.glob("*.json")):
+            leased_path = self.leased_directory / f"{path.stem}@{self.worker}.json"
+            try:
+                path.rename(leased_path)
+                os.utime(leased_path)
+                return Lease(leased_path, read_chunk(leased_path))
+            except FileNotFoundError:
+                # Leased by another worker first, or already requeued
+                continue
+        return None
+
+    def renew(self, leases: Iterable[Lease]) -> List[Lease]:
+        """Touches the lease files, returns the leases that were lost"""
+
+        lost = []
+        for lease in leases:
+            try:
+                os.utime(lease.path)
+            except FileNotFoundError:
+                lost.append(lease)
+        return lost
+
+    def holds(self, lease: Lease) -> bool:
+        return lease.path.exists()
+
+    def complete(self, lease: Lease) -> None:
+        lease.path.unlink(missing_ok=True)
+
+    def requeue_expired(self) -> int:
+        """Moves the leases not touched for `lease_seconds` back to pending"""
+
+        requeued = 0
+        now = time.time()
+        for path in self.leased_directory.glob("*.json"):
+            try:
+                stat = path.stat()
+                # A rename updates ctime only, a touch updates both
+                if now - max(stat.st_mtime, stat.st_ctime) < self.lease_seconds:
+                    continue
+                path.rename(self.pending_directory / f"{path.stem.split('@')[0]}.json")
+                requeued += 1
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def queued_simulations(self) -> Dict[str, Set[int]]:
+        """The simulations of the pending and leased chunks, by config name"""
+
+        queued = {}
+        # Pending first: a chunk leased in between is then found among the leases
+        for directory in (self.pending_directory, self.leased_directory):
+            for path in sorted(directory.glob("*.json")):
+                try:
+                    chunk = read_chunk(path)
+                except FileNotFoundError:
+                    continue
+                for name in chunk.configs:
+                    queued.setdefault(name, set()).update(chunk.simulation_index)
+        return queued
+
+
+def read_chunk(path: Path) -> QueueChunk:
+    return QueueChunk(**json.loads(path.read_text()))
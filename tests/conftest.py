@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+
+from models import Config
+from scenarios import ScenarioZero
+
+
+@pytest.fixture
+def make_config(tmp_path: Path):
+    """Builds a small config writing to a temporary OUTPUT_DIR"""
+
+    def make_config(**overrides) -> Config:
+        values = dict(
+            scenario=ScenarioZero,
+            reservation_cuttoff=50,
+            output_dir=tmp_path / "outputs",
+            number_of_zones_per_row=5,
+            zone_length=1,
+            zone_width=1,
+            lambda_param=0.5,
+            planning_horizon=0.7,
+            number_of_simulations=4,
+            shuttle_speed=0.00556,
+            min_reservation_time=0,
+            max_reservation_time=60,
+            num_of_workers=1,
+            solver_solution_limit=20,
+            name="Zero",
+        )
+        values.update(overrides)
+        return Config(**values)
+
+    return make_config
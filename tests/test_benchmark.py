@@ -0,0 +1,45 @@
+from benchmark import compare_cases
+
+BASELINE = {
+    "setup_time": 0.010,
+    "solve_time": 0.100,
+    "simulation_time": 0.200,
+    "peak_rss": 100 * 2**20,
+    "acceptance_rate": 1.0,
+    "route_time": 20.0,
+}
+
+
+def compare(**changes):
+    return compare_cases({**BASELINE, **changes}, BASELINE, 0.2, 0.005, 0.02)
+
+
+def test_an_unchanged_case_has_no_regressions():
+    assert compare() == []
+
+
+def test_a_longer_route_time_is_a_regression_when_all_trips_are_accepted():
+    assert compare(route_time=20.3) == []
+    assert compare(route_time=20.5) == ["route_time"]
+    assert compare(route_time=15.0) == []
+
+
+def test_losing_every_route_is_a_regression():
+    assert compare(route_time=None) == ["route_time"]
+    assert (
+        compare_cases(
+            {**BASELINE, "route_time": None},
+            {**BASELINE, "route_time": None},
+            0.2,
+            0.005,
+            0.02,
+        )
+        == []
+    )
+
+
+def test_other_regressions_are_still_found():
+    assert compare(acceptance_rate=0.99, solve_time=0.2) == [
+        "solve_time",
+        "acceptance_rate",
+    ]
@@ -0,0 +1,70 @@
+import numpy as np
+
+from solvers import AbstractSolver, CachedSolver, RoutingProblem, SolutionCache
+from solvers.heuristic import HeuristicSolver
+
+
+def problem_of(locations: np.ndarray, **kwargs) -> RoutingProblem:
+    distances = np.linalg.norm(locations[:, None] - locations[None], axis=-1)
+    return RoutingProblem(
+        distance_matrix=np.rint(distances).astype(np.int64),
+        node_locations=locations,
+        **kwargs,
+    )
+
+
+class Counting(AbstractSolver):
+    """Solves with `solver` and counts the solves, or finds nothing without a solver"""
+
+    def __init__(self, solver: AbstractSolver = None) -> None:
+        super().__init__()
+        self.solver = solver
+        self.num_of_solves = 0
+
+    def solve(self, problem, initial_routes=None):
+        self.num_of_solves += 1
+        return self.solver.solve(problem) if self.solver else None
+
+
+def test_same_trips_in_another_order_are_a_hit(tmp_path):
+    locations = np.random.default_rng(0).integers(0, 1000, (8, 2))
+    problem = problem_of(locations, max_distance=10_000, allow_dropping=False)
+    order = np.concatenate(([0], np.random.default_rng(1).permutation(7) + 1))
+    shuffled = problem_of(locations[order], max_distance=10_000, allow_dropping=False)
+
+    inner = Counting(HeuristicSolver())
+    solver = CachedSolver(inner, SolutionCache(tmp_path / "cache.sqlite"))
+    solution = solver.solve(problem)
+    hit = solver.solve(shuffled)
+
+    assert inner.num_of_solves == 1 and solver.hits == 1
+    assert hit.stop_reason == "cache"
+    assert sorted(hit.routes[0][1:-1]) == list(range(1, 8))
+    assert shuffled.route_distance(hit.routes[0]) == solution.route_distance
+
+
+def test_a_search_without_a_solution_is_not_cached(tmp_path):
+    locations = np.random.default_rng(0).integers(0, 1000, (8, 2))
+    # Every trip is reachable and the budget is above the 1-tree bound, a search could
+    # have found a route with more time
+    problem = problem_of(locations, max_distance=10_000, allow_dropping=False)
+
+    inner = Counting()
+    cache = SolutionCache(tmp_path / "cache.sqlite")
+    solver = CachedSolver(inner, cache)
+    assert solver.solve(problem) is None
+    assert solver.solve(problem) is None
+
+    assert inner.num_of_solves == 2 and len(cache) == 0
+
+
+def test_a_proven_infeasible_problem_is_cached(tmp_path):
+    locations = np.random.default_rng(0).integers(0, 1000, (8, 2))
+    problem = problem_of(locations, max_distance=100, allow_dropping=False)
+
+    inner = Counting()
+    solver = CachedSolver(inner, SolutionCache(tmp_path / "cache.sqlite"))
+    assert solver.solve(problem) is None
+    assert solver.solve(problem) is None
+
+    assert inner.num_of_solves == 1 and solver.hits == 1
@@ -0,0 +1,61 @@
+from pathlib import Path
+
+from dotenv import dotenv_values
+import pytest
+
+from main import config_from_env, read_sweep
+
+SAMPLE_CONF = Path(__file__).parents[1] / "sample.conf"
+
+
+@pytest.fixture
+def env():
+    return dotenv_values(SAMPLE_CONF)
+
+
+def test_sample_conf_is_valid(env):
+    config = config_from_env(env)
+    assert config.render_mode == "none"
+
+
+def test_unknown_render_mode_is_rejected(env):
+    with pytest.raises(ValueError, match="RENDER_MODE must be one of"):
+        config_from_env({**env, "RENDER_MODE": "failure"})
+
+
+def test_unknown_dispatch_mode_is_rejected(env):
+    with pytest.raises(ValueError, match="DISPATCH_MODE must be one of"):
+        config_from_env({**env, "SCENARIO": "One", "DISPATCH_MODE": "events"})
+
+
+def test_event_dispatch_of_a_fleet_is_rejected(env):
+    fleet = {**env, "SCENARIO": "One", "NUM_OF_SHUTTLES": "2"}
+    assert config_from_env(fleet).num_of_shuttles == 2
+    with pytest.raises(ValueError, match="single shuttle"):
+        config_from_env({**fleet, "DISPATCH_MODE": "event"})
+
+
+def test_unknown_decomposition_is_rejected(env):
+    with pytest.raises(ValueError, match="DECOMPOSITION must be one of"):
+        config_from_env({**env, "NUM_OF_SHUTTLES": "2", "DECOMPOSITION": "sectors"})
+
+
+def test_queued_copies_of_a_file_are_named_after_the_file(tmp_path):
+    for name in ("first", "second"):
+        (tmp_path / f"{name}.conf").write_text(SAMPLE_CONF.read_text())
+    (tmp_path / "named.conf").write_text(SAMPLE_CONF.read_text() + "NAME=baseline\n")
+
+    configs = [
+        config
+        for env_file in sorted(tmp_path.glob("*.conf"))
+        for config in read_sweep(env_file, {"LAMBDA_PARAM": "0.1,0.2"}, env_file.stem)
+    ]
+    assert [config.name for config in configs] == [
+        "first__lambda_param-0.1",
+        "first__lambda_param-0.2",
+        "baseline__lambda_param-0.1",
+        "baseline__lambda_param-0.2",
+        "second__lambda_param-0.1",
+        "second__lambda_param-0.2",
+    ]
+    assert [config.name for config in read_sweep(SAMPLE_CONF)] == ["Zero"]
@@ -0,0 +1,38 @@
+from graph import render_run
+from models import SimulationResult
+from store import ResultStore
+
+
+def failed_results(config, indices):
+    return [
+        SimulationResult(
+            simulation_index=index,
+            seed=index,
+            scenario_name="ScenarioZero",
+            config_name=config.name,
+            error="Traceback",
+        )
+        for index in indices
+    ]
+
+
+def test_failed_simulations_get_a_graph_each(make_config):
+    config = make_config(root_seed=1, render_mode="failures")
+    with ResultStore(config) as store:
+        store.write_chunk(failed_results(config, range(3)))
+
+    assert render_run(config) == 3
+    failures = config.output_dir / "data" / "ScenarioZero" / "failures"
+    assert sorted(path.parent.name for path in failures.glob("*/graph.gml")) == [
+        f"simulation_{index}_cycle_0" for index in range(3)
+    ]
+
+
+def test_a_chunk_committed_twice_is_drawn_once(make_config):
+    config = make_config(root_seed=1, render_mode="all")
+    # A worker committed the chunk after its lease expired and it was run again
+    for _ in range(2):
+        with ResultStore(config) as store:
+            store.write_chunk(failed_results(config, range(3)))
+
+    assert render_run(config) == 3
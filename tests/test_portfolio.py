@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+
+from solvers import (
+    AbstractSolver,
+    OrToolsSolver,
+    PortfolioSolver,
+    RoutingProblem,
+    RoutingSolution,
+)
+
+# Fixed stop and 3 trips on the corners of a square, the shortest route goes around it
+# and meets the 1-tree bound
+DISTANCES = np.array([[0, 1, 2, 1], [1, 0, 1, 2], [2, 1, 0, 1], [1, 2, 1, 0]])
+OPTIMAL, DETOUR = [0, 1, 2, 3, 0], [0, 2, 1, 3, 0]
+
+
+class Member(AbstractSolver):
+    """Returns `route` after `delay` seconds, stopped for `stop_reason`"""
+
+    def __init__(self, route, delay: float, stop_reason: str) -> None:
+        super().__init__(OrToolsSolver().default_search_parameters())
+        self.route, self.delay, self.stop_reason = route, delay, stop_reason
+
+    def solve(self, problem, initial_routes=None):
+        time.sleep(self.delay)
+        return RoutingSolution(
+            routes=[self.route],
+            route_distance=problem.route_distance(self.route),
+            objective=problem.objective([self.route], []),
+            stop_reason=self.stop_reason,
+        )
+
+
+def portfolio(*members: Member) -> PortfolioSolver:
+    solver = PortfolioSolver(size=len(members))
+    solver.members = list(members)
+    return solver
+
+
+def test_a_member_that_stalls_first_does_not_end_the_race():
+    solver = portfolio(Member(DETOUR, 0, "stall"), Member(OPTIMAL, 0.5, "time_limit"))
+    solution = solver.solve(RoutingProblem(DISTANCES, max_distance=100))
+
+    assert solution.routes == [OPTIMAL]
+    assert solver.num_of_cancelled == 0
+
+
+def test_a_solution_at_the_lower_bound_cancels_the_other_members():
+    solver = portfolio(Member(OPTIMAL, 0, "stall"), Member(DETOUR, 5, "time_limit"))
+    problem = RoutingProblem(DISTANCES, max_distance=100, allow_dropping=False)
+    starting_time = time.time()
+    solution = solver.solve(problem)
+
+    assert solution.routes == [OPTIMAL]
+    assert solver.num_of_cancelled == 1
+    assert time.time() - starting_time < 5
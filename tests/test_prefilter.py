@@ -0,0 +1,115 @@
+from dataclasses import replace
+from itertools import permutations
+
+import numpy as np
+import pytest
+
+from solvers import OrToolsSolver, PrefilterSolver, RoutingProblem, SolverTimePolicy
+from solvers.prefilter import (
+    EXACT_MAX_TRIPS,
+    enumerate_routes,
+    one_tree_bound,
+    proves_infeasible,
+    unreachable_nodes,
+)
+
+SEEDS = range(10)
+
+
+def problem_of(locations: np.ndarray, **kwargs) -> RoutingProblem:
+    """Manhattan distances between the locations, the fixed stop first"""
+
+    distances = np.abs(locations[:, None] - locations[None]).sum(axis=-1)
+    return RoutingProblem(
+        distance_matrix=distances.astype(np.int64), node_locations=locations, **kwargs
+    )
+
+
+def random_problem(seed: int, num_of_trips: int, **kwargs) -> RoutingProblem:
+    locations = np.random.default_rng(seed).integers(0, 1000, (num_of_trips + 1, 2))
+    return problem_of(locations, **{"max_distance": 10**6, **kwargs})
+
+
+def or_tools() -> OrToolsSolver:
+    return OrToolsSolver(
+        time_policy=SolverTimePolicy(time_limit=0.2, time_per_trip=0, stall_ratio=0.5)
+    )
+
+
+def shortest_tour(problem: RoutingProblem) -> int:
+    return min(
+        problem.route_distance([0, *order, 0])
+        for order in permutations(range(1, problem.num_of_nodes))
+    )
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_one_tree_bound_is_below_the_shortest_tour(seed):
+    problem = random_problem(seed, 6)
+    assert one_tree_bound(problem.distance_matrix) <= shortest_tour(problem)
+
+    # One way streets: the bound takes the shorter direction of every pair
+    extra = np.triu(np.random.default_rng(seed).integers(0, 500, (7, 7)), 1)
+    asymmetric = replace(problem, distance_matrix=problem.distance_matrix + extra)
+    assert one_tree_bound(asymmetric.distance_matrix) <= shortest_tour(asymmetric)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_enumeration_is_at_least_as_good_as_or_tools(seed):
+    problem = random_problem(
+        seed, EXACT_MAX_TRIPS, max_distance=2500, drop_penalty=1500
+    )
+    route, dropped_nodes = enumerate_routes(problem)
+    solution = or_tools().solve(problem)
+
+    assert problem.route_distance(route) <= problem.max_distance
+    assert sorted([*route[1:-1], *dropped_nodes]) == [1, 2, 3, 4]
+    assert problem.objective([route], dropped_nodes) <= solution.objective
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_prefilter_drops_unreachable_trips_and_solves_the_rest_exactly(seed):
+    rng = np.random.default_rng(seed)
+    near = rng.integers(0, 300, (EXACT_MAX_TRIPS + 1, 2))
+    far = rng.integers(2000, 3000, (3, 2))
+    trips = rng.permutation(np.concatenate([near[1:], far]))
+    problem = problem_of(
+        np.concatenate([near[:1], trips]), max_distance=2000, drop_penalty=1500
+    )
+    solution = PrefilterSolver(or_tools()).solve(problem)
+    reference = or_tools().solve(problem)
+
+    (route,) = solution.routes
+    assert solution.stop_reason == "exact"
+    assert problem.route_distance(route) <= problem.max_distance
+    assert len(unreachable_nodes(problem)) == 3
+    assert set(unreachable_nodes(problem)) <= set(solution.dropped_nodes)
+    assert sorted([*route[1:-1], *solution.dropped_nodes]) == list(range(1, 8))
+    assert solution.objective == problem.objective([route], solution.dropped_nodes)
+    assert solution.objective <= reference.objective
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("num_of_trips", [3, 6])
+def test_proven_infeasibility_agrees_with_or_tools(seed, num_of_trips):
+    problem = random_problem(seed, num_of_trips, allow_dropping=False)
+    budget = shortest_tour(problem)
+
+    enough = replace(problem, max_distance=budget)
+    assert not proves_infeasible(enough)
+    assert or_tools().solve(enough) is not None
+
+    bound = one_tree_bound(problem.distance_matrix)
+    for max_distance in (budget - 1, bound - 1):
+        tight = replace(problem, max_distance=max_distance)
+        if num_of_trips <= EXACT_MAX_TRIPS or max_distance < bound:
+            assert proves_infeasible(tight)
+        if proves_infeasible(tight):
+            assert or_tools().solve(tight) is None
+            assert PrefilterSolver(or_tools()).solve(tight) is None
+
+
+def test_dropping_is_never_proven_infeasible():
+    problem = random_problem(0, 3, max_distance=10)
+    assert len(unreachable_nodes(problem)) == 3
+    assert not proves_infeasible(problem)
@@ -0,0 +1,71 @@
+import numpy as np
+
+from runner import (
+    SimulationTask,
+    paired_simulation_tasks,
+    resolve_root_seed,
+    run_simulation,
+    simulation_seed,
+)
+
+
+def test_simulation_seed_is_the_spawned_child_of_the_root_seed():
+    children = np.random.SeedSequence(42).spawn(5)
+    for index, child in enumerate(children):
+        assert simulation_seed(42, index) == int(child.generate_state(1, np.uint64)[0])
+
+
+def test_simulation_seeds_differ_between_indices_and_root_seeds():
+    seeds = {simulation_seed(root_seed, i) for root_seed in (1, 2) for i in range(100)}
+    assert len(seeds) == 200
+
+
+def test_root_seed_of_the_config_wins(make_config):
+    config = make_config(root_seed=7)
+    assert resolve_root_seed(config) == 7
+    assert not (config.output_dir / ".root_seed").exists()
+
+
+def test_root_seed_is_saved_and_reused(make_config):
+    config = make_config()
+    root_seed = resolve_root_seed(config)
+    assert int((config.output_dir / ".root_seed").read_text()) == root_seed
+
+    rerun = make_config()
+    assert resolve_root_seed(rerun) == root_seed
+
+
+def test_tasks_skip_completed_simulations_and_keep_their_seeds(make_config):
+    config = make_config(root_seed=3)
+    all_tasks = list(paired_simulation_tasks([config], {"Zero": set()}))
+    assert [task.simulation_index for task in all_tasks] == [0, 1, 2, 3]
+    assert [task.seed for task in all_tasks] == [
+        simulation_seed(3, index) for index in range(4)
+    ]
+
+    resumed = list(paired_simulation_tasks([config], {"Zero": {0, 2}}))
+    assert resumed == [all_tasks[1], all_tasks[3]]
+
+
+def test_paired_configs_share_the_seeds_of_a_simulation(make_config):
+    first, second = make_config(root_seed=3), make_config(name="Other")
+    tasks = list(
+        paired_simulation_tasks([first, second], {"Zero": {1}, "Other": set()})
+    )
+
+    assert tasks[0].config is first and tasks[0].paired_configs == (second,)
+    assert tasks[1].config is second and tasks[1].paired_configs == ()
+    assert [task.seed for task in tasks] == [
+        simulation_seed(3, index) for index in range(4)
+    ]
+
+
+def test_a_simulation_replays_from_its_seed(make_config):
+    config = make_config()
+    task = SimulationTask(config, 0, simulation_seed(11, 0))
+    first, replayed = run_simulation(task), run_simulation(task)
+
+    assert first[0].error is None and first[0].num_of_trips > 0
+    assert replayed[0].routes == first[0].routes
+    for column, values in first[0].trips.items():
+        np.testing.assert_array_equal(replayed[0].trips[column], values)
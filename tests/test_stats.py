@@ -0,0 +1,152 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+import pytest
+
+from models import SimulationResult
+from runner import common_random_numbers_groups
+from scenarios import ScenarioOne
+from stats import PairedStatistics, RunningStat, RunStatistics, simulation_values
+
+
+def result(index, route_time, trip_ids, reserved_at, statuses, cycle=0, error=None):
+    return SimulationResult(
+        simulation_index=index,
+        seed=index,
+        scenario_name="ScenarioZero",
+        cycle=cycle,
+        route_time=route_time,
+        elapsed_time=0.5,
+        error=error,
+        trips={
+            "trip_id": np.asarray(trip_ids),
+            "reserved_at": np.asarray(reserved_at),
+            "reservation_status": np.asarray(statuses, dtype=object),
+        },
+    )
+
+
+@pytest.mark.parametrize("size", [2, 10, 1000])
+def test_running_stat_matches_numpy(size):
+    values = np.random.default_rng(size).lognormal(3, 1, size)
+    stat = RunningStat()
+    for value in values:
+        stat.add(value)
+
+    z = NormalDist().inv_cdf(0.975)
+    assert stat.count == size
+    assert stat.mean == pytest.approx(np.mean(values))
+    assert stat.variance == pytest.approx(np.var(values, ddof=1))
+    assert stat.half_width(z) == pytest.approx(
+        z * np.std(values, ddof=1) / math.sqrt(size)
+    )
+
+
+def test_running_stat_of_one_value_has_no_interval():
+    stat = RunningStat()
+    stat.add(4.0)
+    assert math.isnan(stat.variance)
+    assert stat.half_width(1.96) == math.inf
+    assert stat.to_dict(1.96) == {
+        "count": 1,
+        "mean": 4.0,
+        "std": None,
+        "half_width": None,
+    }
+
+
+def test_carried_riders_count_once_with_their_last_status():
+    values = simulation_values(
+        [
+            result(
+                0, 20.0, [1, 2, 3], [5, 12, 14], ["ACCEPTED", "PENDING", "REJECTED"]
+            ),
+            result(0, None, [2, 4], [12, 25], ["ACCEPTED", "REJECTED"], cycle=1),
+        ],
+        bucket_minutes=10,
+    )
+
+    assert values["route_time"] == 20.0
+    assert values["solver_time"] == 1.0
+    assert values["acceptance_rate"] == 0.5
+    assert values["bucket_acceptance_rates"] == {0: 1.0, 10: 0.5, 20: 0.0}
+
+
+def test_run_statistics_match_numpy(make_config):
+    rng = np.random.default_rng(0)
+    statistics = RunStatistics(make_config())
+    route_times, acceptance_rates = [], []
+    for index in range(50):
+        statuses = rng.choice(["ACCEPTED", "REJECTED"], 8)
+        route_time = float(rng.uniform(10, 30))
+        statistics.add(
+            [result(index, route_time, range(8), rng.integers(0, 60, 8), statuses)]
+        )
+        route_times.append(route_time)
+        acceptance_rates.append(np.mean(statuses == "ACCEPTED"))
+    statistics.add([result(50, None, [], [], [], error="Traceback")])
+
+    assert statistics.num_of_simulations == 51
+    assert statistics.num_of_failed == 1
+    assert statistics.route_time.mean == pytest.approx(np.mean(route_times))
+    assert statistics.route_time.variance == pytest.approx(np.var(route_times, ddof=1))
+    assert statistics.acceptance_rate.mean == pytest.approx(np.mean(acceptance_rates))
+    assert statistics.acceptance_rate.variance == pytest.approx(
+        np.var(acceptance_rates, ddof=1)
+    )
+
+
+def test_target_precision_needs_min_simulations(make_config):
+    statistics = RunStatistics(make_config(target_precision=0.5, min_simulations=5))
+    for index in range(5):
+        assert not statistics.precise
+        statistics.add(
+            [result(index, 20.0 + index % 2, [1, 2], [0, 0], ["ACCEPTED", "REJECTED"])]
+        )
+    assert statistics.precise
+    assert not RunStatistics(make_config()).precise
+
+
+def test_paired_differences_match_numpy(make_config):
+    configs = [make_config(), make_config(scenario=ScenarioOne, name="One")]
+    paired = PairedStatistics(configs)
+    rng = np.random.default_rng(0)
+    baseline, other = rng.uniform(10, 30, 20), rng.uniform(10, 30, 20)
+    # Reported out of order, as the results of the two configs come back
+    for index in reversed(range(20)):
+        paired.add("One", index, [result(index, other[index], [], [], [])])
+    assert paired.pending and paired.differences["One"]["route_time"].count == 0
+    for index in range(20):
+        paired.add("Zero", index, [result(index, baseline[index], [], [], [])])
+
+    differences = paired.differences["One"]["route_time"]
+    assert not paired.pending
+    assert differences.mean == pytest.approx(np.mean(other - baseline))
+    assert differences.variance == pytest.approx(np.var(other - baseline, ddof=1))
+
+
+def test_failed_simulations_are_left_out_of_the_pairs(make_config):
+    configs = [make_config(), make_config(scenario=ScenarioOne, name="One")]
+    paired = PairedStatistics(configs)
+    paired.add("Zero", 0, [result(0, 10.0, [], [], [], error="Traceback")])
+    paired.add("One", 0, [result(0, 12.0, [], [], [])])
+    paired.add("Zero", 1, [result(1, 10.0, [], [], [])])
+    paired.add("One", 1, [result(1, 12.0, [], [], [])])
+
+    assert paired.differences["One"]["route_time"].count == 1
+    assert paired.differences["One"]["route_time"].mean == 2.0
+
+
+def test_only_configs_that_differ_in_their_scenario_are_paired(make_config):
+    zero = make_config(common_random_numbers=True)
+    one = make_config(scenario=ScenarioOne, name="One", common_random_numbers=True)
+    busier = make_config(name="Busier", lambda_param=1, common_random_numbers=True)
+    alone = make_config(scenario=ScenarioOne, name="Alone")
+
+    groups = common_random_numbers_groups([zero, one, busier, alone])
+    assert [[config.name for config in group] for group in groups] == [
+        ["Zero", "One"],
+        ["Busier"],
+        ["Alone"],
+    ]
@@ -0,0 +1,161 @@
+import shutil
+
+import pytest
+
+from analysis import load_table
+from main import completed_simulations
+from models import SimulationResult
+from store import (
+    ResultStore,
+    committed_parts,
+    read_committed,
+    read_manifest,
+    remove_uncommitted_parts,
+    results_directory,
+)
+
+
+def result(index: int, error: str = None, cycle: int = 0) -> SimulationResult:
+    return SimulationResult(
+        simulation_index=index,
+        seed=100 + index,
+        scenario_name="ScenarioZero",
+        config_name="Zero",
+        cycle=cycle,
+        route_time=None if error else 10.0 + index,
+        error=error,
+    )
+
+
+def crash_after_writing(directory, part_name):
+    """Leaves a chunk on disk whose writer died before committing it"""
+
+    for table in ("routes", "trips"):
+        shutil.copy(
+            directory / table / part_name,
+            directory / table / part_name.replace("part-", "part-crashed-"),
+        )
+
+
+@pytest.fixture
+def stored(make_config):
+    config = make_config(root_seed=5, results_chunk_size=2)
+    with ResultStore(config) as store:
+        for index in range(5):
+            store.append([result(index, error="Traceback" if index == 3 else None)])
+    return config, results_directory(config.output_dir, config.name)
+
+
+def test_every_chunk_is_committed(stored):
+    _, directory = stored
+    parts = committed_parts(directory)
+
+    assert len(parts) == 3
+    assert {path.name for path in (directory / "routes").glob("*")} == parts
+    assert [entry["simulation_index"] for entry in read_manifest(directory)] == [
+        [0, 1],
+        [2, 3],
+        [4],
+    ]
+    assert read_manifest(directory)[1]["failed"] == [3]
+
+
+def test_uncommitted_parts_are_not_read_and_removed(stored):
+    _, directory = stored
+    part_name = sorted(committed_parts(directory))[0]
+    crash_after_writing(directory, part_name)
+
+    assert len(list((directory / "routes").glob("*"))) == 4
+    assert read_committed(directory, "routes")["simulation_index"].to_pylist() == [
+        0,
+        1,
+        2,
+        3,
+        4,
+    ]
+
+    assert remove_uncommitted_parts(directory) == 2
+    assert {path.name for path in (directory / "trips").glob("*")} == committed_parts(
+        directory
+    )
+    assert remove_uncommitted_parts(directory) == 0
+
+
+def test_manifest_line_cut_short_is_not_committed(stored):
+    _, directory = stored
+    (manifest,) = (directory / "manifest").glob("*.jsonl")
+    lines = manifest.read_text().splitlines()
+    manifest.write_text("\n".join(lines[:2]) + "\n" + lines[2][:10])
+
+    assert len(committed_parts(directory)) == 2
+    assert remove_uncommitted_parts(directory) == 2
+
+
+def test_results_without_a_manifest_are_all_committed(stored):
+    _, directory = stored
+    shutil.rmtree(directory / "manifest")
+
+    assert committed_parts(directory) is None
+    assert read_committed(directory, "routes").num_rows == 5
+    assert remove_uncommitted_parts(directory) == 0
+
+
+def test_resume_returns_the_committed_simulations(stored):
+    config, directory = stored
+    crash_after_writing(directory, sorted(committed_parts(directory))[0])
+
+    completed = completed_simulations(config, resume=True)
+
+    assert completed == {0: False, 1: False, 2: False, 3: True, 4: False}
+    assert len(list((directory / "routes").glob("*"))) == 3
+
+
+def test_existing_results_need_resume(stored):
+    config, _ = stored
+    with pytest.raises(ValueError, match="--resume"):
+        completed_simulations(config, resume=False)
+
+
+def test_resume_rejects_another_root_seed(stored):
+    config, _ = stored
+    config.root_seed = 6
+    with pytest.raises(ValueError, match="root seed 5"):
+        completed_simulations(config, resume=True)
+
+
+def test_resume_after_a_crash_keeps_the_cycles_of_a_simulation_together(make_config):
+    config = make_config(root_seed=5, number_of_cycles=3, results_chunk_size=4)
+    directory = results_directory(config.output_dir, config.name)
+    store = ResultStore(config)
+    for index in range(6):
+        store.append([result(index, cycle=cycle) for cycle in range(3)])
+    # The process dies before closing the store, the last 2 simulations are lost
+
+    assert completed_simulations(config, resume=True) == {i: False for i in range(4)}
+    routes = read_committed(directory, "routes").to_pylist()
+    assert sorted((row["simulation_index"], row["cycle"]) for row in routes) == [
+        (index, cycle) for index in range(4) for cycle in range(3)
+    ]
+
+
+def test_a_chunk_committed_after_its_lease_expired_is_read_once(make_config):
+    config = make_config(root_seed=5)
+    directory = results_directory(config.output_dir, config.name)
+    # The chunk of simulations 0-3 was requeued and run again by a second worker, then
+    # the first worker committed it anyway
+    with ResultStore(config) as second_worker:
+        second_worker.write_chunk([result(index) for index in range(4)])
+    with ResultStore(config) as first_worker:
+        first_worker.write_chunk([result(index) for index in range(2, 6)])
+
+    assert len(committed_parts(directory)) == 2
+    routes = read_committed(directory, "routes", columns=["simulation_index"])
+    assert sorted(routes["simulation_index"].to_pylist()) == list(range(6))
+
+    frame = load_table(config.output_dir, "routes")
+    assert sorted(frame["simulation_index"]) == list(range(6))
+    assert list(frame["config"].unique()) == ["Zero"]
+
+
+def test_first_run_has_nothing_completed(make_config):
+    assert completed_simulations(make_config(root_seed=5), resume=False) == {}
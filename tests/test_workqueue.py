@@ -0,0 +1,75 @@
+import time
+
+from workqueue import QueueChunk, WorkQueue
+
+LEASE_SECONDS = 0.5
+
+
+def chunk(*simulation_index: int) -> QueueChunk:
+    return QueueChunk(["Zero", "One"], list(simulation_index), root_seed=5)
+
+
+def make_queue(tmp_path) -> WorkQueue:
+    queue = WorkQueue.of_output_dir(tmp_path, LEASE_SECONDS)
+    queue.create()
+    return queue
+
+
+def test_chunks_are_leased_once_in_queue_order(tmp_path):
+    coordinator = make_queue(tmp_path)
+    for start in (0, 2, 4):
+        coordinator.put(chunk(start, start + 1))
+    workers = [WorkQueue.of_output_dir(tmp_path, LEASE_SECONDS) for _ in range(2)]
+
+    leases = [workers[0].lease(), workers[1].lease(), workers[0].lease()]
+    assert [lease.chunk for lease in leases] == [chunk(0, 1), chunk(2, 3), chunk(4, 5)]
+    assert len({lease.name for lease in leases}) == 3
+    assert workers[1].lease() is None
+    assert not coordinator.has_pending()
+
+
+def test_queued_simulations_cover_pending_and_leased_chunks(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put(chunk(0, 1))
+    queue.put(chunk(2))
+    lease = queue.lease()
+    assert queue.queued_simulations() == {"Zero": {0, 1, 2}, "One": {0, 1, 2}}
+
+    queue.complete(lease)
+    assert queue.queued_simulations() == {"Zero": {2}, "One": {2}}
+
+
+def test_an_expired_lease_is_requeued_and_lost(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put(chunk(0, 1))
+    lease = queue.lease()
+    assert queue.requeue_expired() == 0
+
+    time.sleep(LEASE_SECONDS * 1.5)
+    assert queue.requeue_expired() == 1
+    assert not queue.holds(lease)
+    assert queue.renew([lease]) == [lease]
+
+    other = WorkQueue.of_output_dir(tmp_path, LEASE_SECONDS).lease()
+    assert other.chunk == lease.chunk
+
+
+def test_a_renewed_lease_is_kept(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put(chunk(0, 1))
+    lease = queue.lease()
+    for _ in range(3):
+        time.sleep(LEASE_SECONDS / 2)
+        assert queue.renew([lease]) == []
+        assert queue.requeue_expired() == 0
+    assert queue.holds(lease)
+
+
+def test_finished_is_cleared_by_a_new_queue(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.exists() and not queue.finished
+    queue.finish()
+    assert WorkQueue.of_output_dir(tmp_path, LEASE_SECONDS).finished
+
+    make_queue(tmp_path)
+    assert not queue.finished